@@ -0,0 +1,599 @@
+import os
+import json
+import time
+import logging
+import argparse
+import numpy as np
+
+from Algo import ALGOscan
+from Algo import ALGOcorpus
+
+# Setting up logging with detailed formatting
+logging.basicConfig(
+    filename="algoLog.log",
+    level=logging.INFO,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+annName = "ann"
+annMetaName = "ann.json"
+
+# Windows of bars appended after the index was built, see appendAnn
+deltaNames = ("deltaSummaries.npy", "deltaFileIds.npy", "deltaEnds.npy")
+
+# Window lengths summarised by default, one trading day and one week of bars
+defaultLengths = (390, 1950)
+
+# PAA segments per channel
+defaultSegments = 8
+
+# Candidates re-ranked with the exact distance, per requested result
+candidateFactor = 20
+
+# Close z-scores are scaled by 4 and volume z-scores by 1, see ALGOscan
+channelScales = (4.0, 1.0)
+
+
+def annPath(binPath, windowLen):
+    """Returns the directory of the approximate index for one window length."""
+    return os.path.join(binPath, annName, f"L{windowLen}")
+
+
+def segmentBounds(windowLen, segments):
+    # Edges of the PAA segments, as even as the window length allows
+    return np.linspace(0, windowLen, segments + 1).astype(np.int64)
+
+
+def paaSummaries(close, volume, starts, windowLen, segments):
+    """
+    Computes the PAA summary of the z-scored windows beginning at starts.
+
+    Each window is z-scored like ALGOscan does, then averaged over segments
+    of equal length per channel.
+
+    Args:
+        close (NumPy array): Close column of the ticker.
+        volume (NumPy array): Volume column of the ticker.
+        starts (NumPy array): Start rows of the windows.
+        windowLen (int): The length of every window.
+        segments (int): PAA segments per channel.
+
+    Returns:
+        NumPy array: float32 summaries of shape (len(starts), 2 * segments),
+        NaN for flat windows.
+    """
+    bounds = segmentBounds(windowLen, segments)
+    widths = np.diff(bounds)
+    summaries = np.empty((len(starts), 2 * segments), dtype=np.float32)
+
+    for channel, (values, scale) in enumerate(zip((close, volume), channelScales)):
+        values = np.asarray(values, dtype=np.float64)
+        means, stds = ALGOscan.rollingStats(values, starts, windowLen)
+
+        centre = values.mean() if len(values) else 0.0
+        cumulative = np.concatenate(([0.0], np.cumsum(values - centre)))
+        segmentMeans = (
+            cumulative[starts[:, None] + bounds[1:]]
+            - cumulative[starts[:, None] + bounds[:-1]]
+        ) / widths + centre
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            paa = scale * (segmentMeans - means[:, None]) / stds[:, None]
+        paa[stds == 0] = np.nan
+        summaries[:, channel * segments : (channel + 1) * segments] = paa
+
+    return summaries
+
+
+def querySummary(query, windowLen, segments):
+    """
+    Computes the PAA summary of the last windowLen bars of a query.
+
+    Args:
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        windowLen (int): Length of the index the summary is compared against.
+        segments (int): PAA segments per channel.
+
+    Returns:
+        NumPy array: float64 summary of shape (2 * segments,).
+    """
+    bounds = segmentBounds(windowLen, segments)
+    widths = np.diff(bounds)
+    summary = []
+    for channel, scale in enumerate(channelScales):
+        # Re-z-score the tail, the index holds windows of windowLen bars
+        values = query[-windowLen:, channel]
+        zScores = scale * (values - values.mean()) / values.std()
+        summary.append(np.add.reduceat(zScores, bounds[:-1]) / widths)
+    return np.concatenate(summary)
+
+
+def buildAnn(corpus, windowLens=defaultLengths, segments=defaultSegments):
+    """
+    Writes the approximate index of a corpus for every window length.
+
+    Windows are grouped by the minute of day of their last bar. Each group
+    holds the PAA summary, file id and last row of every window ending on
+    that minute, so a query reads one group only.
+
+    Every window length takes 8 * segments + 12 bytes per corpus row, 76
+    bytes with the default segments, so the default lengths take 152 bytes
+    per row on top of the corpus. Bars appended later are added by appendAnn.
+
+    Args:
+        corpus (Corpus): The binary corpus to summarise.
+        windowLens (tuple): Window lengths to build an index for.
+        segments (int): PAA segments per channel.
+    """
+    tickers = [
+        (fileId, ticker)
+        for fileId, ticker in enumerate(corpus.tickers)
+        if {"close", "volume", "minuteOfDay"} <= set(ticker["columns"])
+    ]
+
+    for windowLen in windowLens:
+        path = annPath(corpus.binPath, windowLen)
+        os.makedirs(path, exist_ok=True)
+
+        # First pass: windows per minute of day, to lay the buckets out
+        counts = np.zeros(1440, dtype=np.int64)
+        for fileId, ticker in tickers:
+            if ticker["rows"] >= windowLen:
+                minutes = corpus.column(fileId, "minuteOfDay")[windowLen - 1 :]
+                counts += np.bincount(minutes, minlength=1440)
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        total = int(offsets[-1])
+
+        def output(name, dtype, shape):
+            return np.lib.format.open_memmap(
+                os.path.join(path, name), mode="w+", dtype=dtype, shape=shape
+            )
+
+        summaries = output("summaries.npy", np.float32, (total, 2 * segments))
+        fileIds = output("fileIds.npy", np.int32, (total,))
+        ends = output("ends.npy", np.int64, (total,))
+
+        # Second pass: summarise every ticker into its buckets
+        filled = np.zeros(1440, dtype=np.int64)
+        for fileId, ticker in tickers:
+            if ticker["rows"] < windowLen:
+                continue
+
+            columns = corpus.open(fileId)
+            starts = np.arange(ticker["rows"] - windowLen + 1)
+            minutes = columns["minuteOfDay"][windowLen - 1 :].astype(np.int64)
+
+            order = np.argsort(minutes, kind="stable")
+            sortedMinutes = minutes[order]
+            fileCounts = np.bincount(minutes, minlength=1440)
+            firstOfMinute = np.concatenate(([0], np.cumsum(fileCounts)[:-1]))
+            rank = np.arange(len(order)) - firstOfMinute[sortedMinutes]
+            positions = offsets[sortedMinutes] + filled[sortedMinutes] + rank
+            filled += fileCounts
+
+            summaries[positions] = paaSummaries(
+                columns["close"], columns["volume"], starts[order], windowLen, segments
+            )
+            fileIds[positions] = fileId
+            ends[positions] = starts[order] + windowLen - 1
+
+        for array in (summaries, fileIds, ends):
+            array.flush()
+        del summaries, fileIds, ends
+        offsets.tofile(os.path.join(path, "offsets.bin"))
+
+        ALGOcorpus.writeJson(
+            path,
+            annMetaName,
+            {
+                "corpusFingerprint": corpus.fingerprint(),
+                "windowLen": windowLen,
+                "segments": segments,
+                "windows": total,
+            },
+        )
+        logging.info(f"Built approximate index of {total} windows of {windowLen} bars")
+
+
+def writeDelta(path, summaries, fileIds, ends, minutes):
+    # Windows of appended bars, bucketed by minute of day like the index
+    order = np.argsort(minutes, kind="stable")
+    for name, array in zip(deltaNames, (summaries, fileIds, ends)):
+        np.save(os.path.join(path, name), array[order])
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(minutes, minlength=1440))))
+    offsets.astype(np.int64).tofile(os.path.join(path, "deltaOffsets.bin"))
+
+
+def appendAnn(corpus, previous):
+    """
+    Adds the windows ending on appended bars to the approximate indexes.
+
+    The windows go into a delta next to each index, which AnnIndex.bucket
+    reads with it, so an append does not rebuild the index. Indexes that were
+    already stale before the append are left stale.
+
+    Args:
+        corpus (Corpus): The corpus after the append.
+        previous (Corpus): The corpus before the append.
+    """
+    root = os.path.join(corpus.binPath, annName)
+    if not os.path.isdir(root):
+        return
+
+    previousRows = [ticker["rows"] for ticker in previous.tickers]
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not AnnIndex.exists(path):
+            continue
+        index = AnnIndex(path)
+        if index.isStale(previous):
+            continue
+
+        # Start from the windows of earlier appends
+        summaries, fileIds, ends = index.delta()
+        minutes = [np.repeat(np.arange(1440), np.diff(index.deltaOffsets()))]
+        summaries, fileIds, ends = [summaries], [fileIds], [ends]
+
+        for fileId, ticker in enumerate(corpus.tickers):
+            if not {"close", "volume", "minuteOfDay"} <= set(ticker["columns"]):
+                continue
+
+            # Every window whose last bar is new
+            oldRows = previousRows[fileId] if fileId < len(previousRows) else 0
+            starts = np.arange(
+                max(oldRows - index.windowLen + 1, 0),
+                ticker["rows"] - index.windowLen + 1,
+            )
+            if len(starts) == 0:
+                continue
+
+            columns = corpus.open(fileId)
+            summaries.append(
+                paaSummaries(
+                    columns["close"],
+                    columns["volume"],
+                    starts,
+                    index.windowLen,
+                    index.segments,
+                )
+            )
+            fileIds.append(np.full(len(starts), fileId, dtype=np.int32))
+            ends.append(starts + index.windowLen - 1)
+            minutes.append(
+                columns["minuteOfDay"][starts + index.windowLen - 1].astype(np.int64)
+            )
+
+        summaries, fileIds, ends, minutes = (
+            np.concatenate(arrays) for arrays in (summaries, fileIds, ends, minutes)
+        )
+        writeDelta(path, summaries, fileIds, ends, minutes)
+
+        # Written last, an append that stops halfway leaves the index stale
+        ALGOcorpus.writeJson(
+            path,
+            annMetaName,
+            dict(
+                index.meta,
+                corpusFingerprint=corpus.fingerprint(),
+                deltaWindows=len(ends),
+            ),
+        )
+        logging.info(f"Added {len(ends)} appended windows to {path}")
+
+
+class AnnIndex:
+    def __init__(self, path):
+        """
+        Opens the approximate index of one window length.
+
+        Args:
+            path (str): Directory written by buildAnn, see annPath.
+        """
+        self.path = path
+        with open(os.path.join(path, annMetaName)) as f:
+            self.meta = json.load(f)
+        self.windowLen = self.meta["windowLen"]
+        self.segments = self.meta["segments"]
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(os.path.join(path, annMetaName))
+
+    def isStale(self, corpus):
+        return self.meta["corpusFingerprint"] != corpus.fingerprint()
+
+    def bucket(self, anchorMinute):
+        """
+        Reads the windows ending on one minute of day.
+
+        Returns:
+            tuple: (summaries, fileIds, ends) of the windows, memory-mapped.
+        """
+        offsets = np.fromfile(
+            os.path.join(self.path, "offsets.bin"),
+            dtype=np.int64,
+            count=2,
+            offset=anchorMinute * 8,
+        )
+        bucket = slice(int(offsets[0]), int(offsets[1]))
+        arrays = tuple(
+            np.load(os.path.join(self.path, name), mmap_mode="r")[bucket]
+            for name in ("summaries.npy", "fileIds.npy", "ends.npy")
+        )
+        if not self.meta.get("deltaWindows"):
+            return arrays
+
+        # Windows of appended bars ending on the same minute
+        offsets = self.deltaOffsets()
+        bucket = slice(int(offsets[anchorMinute]), int(offsets[anchorMinute + 1]))
+        return tuple(
+            np.concatenate((array, delta[bucket]))
+            for array, delta in zip(arrays, self.delta())
+        )
+
+    def deltaOffsets(self):
+        # Start of every minute of day in the delta, zeros without one
+        if not self.meta.get("deltaWindows"):
+            return np.zeros(1441, dtype=np.int64)
+        return np.fromfile(os.path.join(self.path, "deltaOffsets.bin"), dtype=np.int64)
+
+    def delta(self):
+        """
+        Reads the windows added by appendAnn.
+
+        Returns:
+            tuple: (summaries, fileIds, ends) of every appended window,
+            memory-mapped.
+        """
+        if not self.meta.get("deltaWindows"):
+            return (
+                np.empty((0, 2 * self.segments), dtype=np.float32),
+                np.empty(0, dtype=np.int32),
+                np.empty(0, dtype=np.int64),
+            )
+        return tuple(
+            np.load(os.path.join(self.path, name), mmap_mode="r") for name in deltaNames
+        )
+
+
+def openAnn(corpus, windowLen):
+    """
+    Returns the longest fresh approximate index no longer than windowLen.
+
+    Args:
+        corpus (Corpus): The corpus the index has to match.
+        windowLen (int): The length of the query.
+
+    Returns:
+        AnnIndex: The index, or None when there is none to use.
+    """
+    root = os.path.join(corpus.binPath, annName)
+    if not os.path.isdir(root):
+        return None
+
+    lengths = sorted(
+        int(name[1:])
+        for name in os.listdir(root)
+        if name.startswith("L") and name[1:].isdigit()
+    )
+    for length in reversed(lengths):
+        path = annPath(corpus.binPath, length)
+        if length > windowLen or not AnnIndex.exists(path):
+            continue
+
+        index = AnnIndex(path)
+        if index.isStale(corpus):
+            logging.warning(f"Approximate index is stale: {path}")
+            continue
+        return index
+    return None
+
+
+def approximateTopK(corpus, query):
+    """
+    Finds the closest windows of a query through the approximate index.
+
+    Windows ending on the query's minute of day are ranked by the distance of
+    their PAA summaries. The best candidateFactor * resultSize of them are
+    re-ranked with the exact ALGOscan distance.
+
+    Args:
+        corpus (Corpus): The binary corpus to match against.
+        query (dict): tickerDataZScores, predictionLen, dataSize and resultSize.
+
+    Returns:
+        tuple: (distances, fileIds, rows) as TopK.result(), or None when no
+        approximate index can serve the query.
+    """
+    tickerDataZScores = query["tickerDataZScores"]
+    windowLen = len(tickerDataZScores)
+    index = openAnn(corpus, windowLen)
+    if index is None:
+        return None
+
+    vectors = tickerDataZScores[:, [1, 2]].astype(np.float64)
+    anchorMinute = ALGOcorpus.anchorMinute(
+        ALGOscan.anchorTimeOfDay(tickerDataZScores[-1, 0])
+    )
+    topResults = ALGOscan.TopK(query["resultSize"])
+    if not 0 <= anchorMinute < 1440:
+        return topResults.result()
+
+    summaries, fileIds, ends = index.bucket(anchorMinute)
+
+    # Same candidates as the exact scan: whole window and prediction in the file
+    rows = np.array([ticker["rows"] for ticker in corpus.tickers], dtype=np.int64)
+    starts = ends - (windowLen - 1)
+    valid = (
+        (fileIds < query["dataSize"])
+        & (starts >= 0)
+        & (starts < rows[fileIds] - windowLen - query["predictionLen"])
+    )
+    candidates = np.flatnonzero(valid)
+
+    # Rank by the PAA distance, weighted by segment length
+    widths = np.tile(np.diff(segmentBounds(index.windowLen, index.segments)), 2)
+    difference = summaries[candidates] - querySummary(
+        vectors, index.windowLen, index.segments
+    )
+    paaDistances = np.where(
+        np.isnan(difference).any(axis=1),
+        np.inf,
+        np.nan_to_num(difference) ** 2 @ widths,
+    )
+    count = min(len(candidates), query["resultSize"] * candidateFactor)
+    if count < len(candidates):
+        candidates = candidates[np.argpartition(paaDistances, count - 1)[:count]]
+
+    # Exact re-rank, file by file
+    for fileId in np.unique(fileIds[candidates]):
+        fileStarts = np.sort(starts[candidates[fileIds[candidates] == fileId]])
+        columns = corpus.open(int(fileId))
+        topResults.push(
+            ALGOscan.zScoreDistances(
+                columns["close"],
+                columns["volume"],
+                fileStarts,
+                vectors,
+                corpus.prefixes(int(fileId)),
+            ),
+            int(fileId),
+            fileStarts,
+        )
+    return topResults.result()
+
+
+def exactTopK(corpus, query):
+    # Reference answer of the benchmark, the same windows ALGOdt4 scans
+    tickerDataZScores = query["tickerDataZScores"]
+    vectors = tickerDataZScores[:, [1, 2]].astype(np.float64)
+    anchorMinute = ALGOcorpus.anchorMinute(
+        ALGOscan.anchorTimeOfDay(tickerDataZScores[-1, 0])
+    )
+    topResults = ALGOscan.TopK(query["resultSize"])
+    for fileId in range(min(query["dataSize"], len(corpus))):
+        columns = corpus.open(fileId)
+        if not {"close", "volume", "minuteOfDay"} <= set(columns):
+            continue
+        starts = ALGOscan.anchorStarts(
+            columns["minuteOfDay"],
+            anchorMinute,
+            len(vectors),
+            query["predictionLen"],
+        )
+        topResults.push(
+            ALGOscan.zScoreDistances(
+                columns["close"],
+                columns["volume"],
+                starts,
+                vectors,
+                corpus.prefixes(fileId),
+            ),
+            fileId,
+            starts,
+        )
+    return topResults.result()
+
+
+def benchmark(corpus, queries=20, resultSize=100, noise=0.1, seed=0):
+    """
+    Measures the recall and speed of the approximate index against the exact scan.
+
+    Queries are random windows of the corpus with Gaussian noise added to
+    their z-scores, one set per indexed window length.
+
+    Args:
+        corpus (Corpus): The binary corpus with its approximate index.
+        queries (int): Queries per window length.
+        resultSize (int): Results compared per query.
+        noise (float): Std of the noise added to the query z-scores.
+        seed (int): Seed of the random queries.
+
+    Returns:
+        list: One dict per window length with recall and mean query times.
+    """
+    rng = np.random.default_rng(seed)
+    root = os.path.join(corpus.binPath, annName)
+    lengths = sorted(int(name[1:]) for name in os.listdir(root) if name[1:].isdigit())
+
+    report = []
+    for windowLen in lengths:
+        recalls = []
+        exactTime = 0.0
+        approximateTime = 0.0
+        for _ in range(queries):
+            fileId = int(rng.integers(len(corpus)))
+            columns = corpus.open(fileId)
+            if len(columns["close"]) < 2 * windowLen:
+                continue
+            start = int(rng.integers(len(columns["close"]) - windowLen))
+
+            close = columns["close"][start : start + windowLen].astype(np.float64)
+            volume = columns["volume"][start : start + windowLen].astype(np.float64)
+            if close.std() == 0 or volume.std() == 0:
+                continue
+            epochMinutes = columns["epochMinutes"][start : start + windowLen]
+            tickerDataZScores = np.column_stack(
+                [
+                    epochMinutes.astype("datetime64[m]").astype(object),
+                    4 * (close - close.mean()) / close.std()
+                    + rng.normal(0, noise, windowLen),
+                    (volume - volume.mean()) / volume.std()
+                    + rng.normal(0, noise, windowLen),
+                ]
+            )
+            query = {
+                "tickerDataZScores": tickerDataZScores,
+                "predictionLen": windowLen // 5,
+                "dataSize": len(corpus),
+                "resultSize": resultSize,
+            }
+
+            startTime = time.perf_counter()
+            _, exactFiles, exactRows = exactTopK(corpus, query)
+            exactTime += time.perf_counter() - startTime
+
+            startTime = time.perf_counter()
+            _, approximateFiles, approximateRows = approximateTopK(corpus, query)
+            approximateTime += time.perf_counter() - startTime
+
+            exact = set(zip(exactFiles.tolist(), exactRows.tolist()))
+            found = set(zip(approximateFiles.tolist(), approximateRows.tolist()))
+            if exact:
+                recalls.append(len(exact & found) / len(exact))
+
+        if recalls:
+            report.append(
+                {
+                    "windowLen": windowLen,
+                    "queries": len(recalls),
+                    "recall": float(np.mean(recalls)),
+                    "exactTime": exactTime / len(recalls),
+                    "approximateTime": approximateTime / len(recalls),
+                }
+            )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Approximate window index")
+    parser.add_argument("command", choices=["build", "benchmark"])
+    parser.add_argument("tickerDataPath")
+    parser.add_argument("--lengths", type=int, nargs="+", default=defaultLengths)
+    parser.add_argument("--segments", type=int, default=defaultSegments)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--resultSize", type=int, default=100)
+    args = parser.parse_args()
+
+    corpus = ALGOcorpus.Corpus(ALGOcorpus.corpusPath(args.tickerDataPath))
+    if args.command == "build":
+        buildAnn(corpus, args.lengths, args.segments)
+        print(f"Built approximate index for lengths {args.lengths}")
+    elif args.command == "benchmark":
+        for row in benchmark(corpus, args.queries, args.resultSize):
+            print(
+                f"L={row['windowLen']}: recall@{args.resultSize} "
+                f"{row['recall']:.1%} over {row['queries']} queries, "
+                f"exact {row['exactTime'] * 1000:.0f}ms, "
+                f"approximate {row['approximateTime'] * 1000:.0f}ms"
+            )
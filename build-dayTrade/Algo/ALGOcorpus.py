@@ -0,0 +1,699 @@
+import os
+import json
+import logging
+import argparse
+import hashlib
+import numpy as np
+import pandas as pd
+
+from Algo import ALGOscan
+
+# Setting up logging with detailed formatting
+logging.basicConfig(
+    filename="algoLog.log",
+    level=logging.INFO,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+manifestName = "manifest.json"
+indexName = "index.json"
+
+# Column name in the binary corpus -> dtype on disk
+corpusColumns = {
+    "close": "float32",
+    "volume": "float32",
+    "epochMinutes": "int64",
+    "minuteOfDay": "int16",
+}
+
+# Columns whose prefix sums are stored with the index, see ALGOscan.prefixSums
+prefixColumns = ("close", "volume")
+
+# Share of a ticker's rows appended since its last full index at which the
+# time of day delta is merged back into the base index
+maxDeltaShare = 0.1
+
+
+def corpusPath(tickerDataPath):
+    """Returns the directory the binary copy of a CSV corpus lives in."""
+    return tickerDataPath.rstrip("/\\") + "_bin"
+
+
+def directoryFingerprint(path):
+    """
+    Hashes the names, sizes and modification times of a directory's files.
+
+    Args:
+        path (str): The directory to fingerprint.
+
+    Returns:
+        str: Hex digest that changes whenever a file is added, removed or edited.
+    """
+    digest = hashlib.sha1()
+    for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+        stat = entry.stat()
+        digest.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def anchorMinute(anchorTime):
+    """
+    Converts a time of day in microseconds into a minute of day.
+
+    Returns -1 when the anchor is not on a whole minute, so no row matches.
+    """
+    if anchorTime % 60000000 != 0:
+        return -1
+    return anchorTime // 60000000
+
+
+def convertTicker(filePath):
+    """
+    Parses one CSV ticker file into the columns of the binary corpus.
+
+    Args:
+        filePath (str): Path of the CSV file.
+
+    Returns:
+        dict: Column name -> NumPy array, only for columns present in the file.
+    """
+    return tickerColumns(pd.read_csv(filePath))
+
+
+def tickerColumns(tickerCache):
+    """
+    Converts a DataFrame of bars into the columns of the binary corpus.
+
+    Args:
+        tickerCache (DataFrame): Bars with datetime, close and volume columns
+            in any case.
+
+    Returns:
+        dict: Column name -> NumPy array, only for columns present in the bars.
+    """
+    tickerCache = tickerCache.copy()
+    tickerCache.columns = [column.lower() for column in tickerCache.columns]
+
+    columns = {}
+    for name in ("close", "volume"):
+        if name in tickerCache.columns:
+            columns[name] = tickerCache[name].to_numpy(dtype=corpusColumns[name])
+
+    if "datetime" in tickerCache.columns:
+        datetimes = pd.to_datetime(tickerCache["datetime"]).to_numpy()
+        epochMinutes = datetimes.astype("datetime64[m]").astype(np.int64)
+        columns["epochMinutes"] = epochMinutes
+        columns["minuteOfDay"] = (epochMinutes % 1440).astype(
+            corpusColumns["minuteOfDay"]
+        )
+
+    return columns
+
+
+def buildCorpus(tickerDataPath, binPath=None):
+    """
+    Converts every CSV file of a corpus into contiguous binary columns.
+
+    Each ticker gets a directory with one raw array per column, and a manifest
+    with the row count of every ticker is written last.
+
+    Args:
+        tickerDataPath (str): Directory holding the CSV files.
+        binPath (str): Output directory, defaults to corpusPath(tickerDataPath).
+
+    Returns:
+        Corpus: The converted corpus.
+    """
+    binPath = binPath or corpusPath(tickerDataPath)
+    os.makedirs(binPath, exist_ok=True)
+
+    tickers = []
+    for fileName in sorted(os.listdir(tickerDataPath)):
+        filePath = os.path.join(tickerDataPath, fileName)
+        try:
+            columns = convertTicker(filePath)
+        except Exception as e:
+            logging.error(f"Error converting {filePath}: {e}")
+            continue
+
+        name = os.path.splitext(fileName)[0]
+        os.makedirs(os.path.join(binPath, name), exist_ok=True)
+        for column, values in columns.items():
+            values.tofile(os.path.join(binPath, name, column + ".bin"))
+
+        tickers.append(
+            {
+                "name": name,
+                "file": fileName,
+                "rows": len(next(iter(columns.values()), [])),
+                "columns": sorted(columns),
+            }
+        )
+
+    writeManifest(
+        binPath,
+        {
+            "source": tickerDataPath,
+            "sourceFingerprint": directoryFingerprint(tickerDataPath),
+            "dtypes": corpusColumns,
+            "tickers": tickers,
+        },
+    )
+    logging.info(f"Built binary corpus of {len(tickers)} tickers in {binPath}")
+    return Corpus(binPath)
+
+
+def writeJson(binPath, fileName, content):
+    """Writes a JSON file atomically so readers never see a partial file."""
+    tempPath = os.path.join(binPath, fileName + ".tmp")
+    with open(tempPath, "w") as f:
+        json.dump(content, f, indent=1)
+    os.replace(tempPath, os.path.join(binPath, fileName))
+
+
+def writeManifest(binPath, manifest):
+    writeJson(binPath, manifestName, manifest)
+
+
+def buildTimeIndex(minuteOfDay):
+    """
+    Groups the rows of one ticker by minute of day.
+
+    Args:
+        minuteOfDay (NumPy array): The minuteOfDay column of the ticker.
+
+    Returns:
+        tuple: (rows, offsets) where rows[offsets[m] : offsets[m + 1]] are the
+        ascending rows whose bar falls on minute m.
+    """
+    rows = np.argsort(minuteOfDay, kind="stable").astype(np.int64)
+    counts = np.bincount(minuteOfDay, minlength=1440)
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    return rows, offsets
+
+
+def buildIndex(corpus):
+    """
+    Writes the minute-of-day index of every ticker next to its columns, and
+    the prefix sums the window stats and PAA lower bounds are read from.
+
+    Args:
+        corpus (Corpus): The binary corpus to index.
+
+    Returns:
+        Corpus: The corpus, reopened with the fresh index.
+    """
+    centres = {}
+    indexedRows = {}
+    for fileId, ticker in enumerate(corpus.tickers):
+        tickerPath = os.path.join(corpus.binPath, ticker["name"])
+
+        # Centres are kept in the index, the sums are relative to them
+        centres[ticker["name"]] = {}
+        for name in prefixColumns:
+            if name in ticker["columns"]:
+                centre, sums = ALGOscan.prefixSums(corpus.column(fileId, name))
+                sums.tofile(os.path.join(tickerPath, name + "Prefix.bin"))
+                centres[ticker["name"]][name] = centre
+
+        if "minuteOfDay" not in ticker["columns"]:
+            continue
+
+        writeTimeIndex(tickerPath, "tod", corpus.column(fileId, "minuteOfDay"))
+        indexedRows[ticker["name"]] = ticker["rows"]
+
+    writeJson(
+        corpus.binPath,
+        indexName,
+        {
+            "corpusFingerprint": corpus.fingerprint(),
+            "centres": centres,
+            "indexedRows": indexedRows,
+        },
+    )
+    logging.info(f"Built time of day index for {len(corpus)} tickers")
+    return Corpus(corpus.binPath)
+
+
+def writeTimeIndex(tickerPath, prefix, minuteOfDay, firstRow=0):
+    """
+    Writes the time of day index of some rows of one ticker.
+
+    Args:
+        tickerPath (str): Directory of the ticker in the corpus.
+        prefix (str): "tod" for the base index, "todDelta" for appended rows.
+        minuteOfDay (NumPy array): The minuteOfDay column of those rows.
+        firstRow (int): Row of the ticker the column starts at.
+    """
+    rows, offsets = buildTimeIndex(minuteOfDay)
+    for name, values in (("Rows", rows + firstRow), ("Offsets", offsets)):
+        # Replaced whole, readers never see a partial index
+        tempPath = os.path.join(tickerPath, prefix + name + ".bin.tmp")
+        values.tofile(tempPath)
+        os.replace(tempPath, os.path.join(tickerPath, prefix + name + ".bin"))
+
+
+def appendArray(path, values, rows):
+    """
+    Appends values to a raw array file holding rows entries.
+
+    Entries past rows are left over from an append that never reached the
+    manifest and are overwritten.
+    """
+    with open(path, "ab") as f:
+        f.truncate(rows * values.itemsize)
+        values.tofile(f)
+
+
+def newBars(corpus, fileId, columns):
+    """
+    Sorts bars by time and keeps the ones after the last stored bar.
+
+    Duplicate timestamps keep their last bar, so overlapping downloads can be
+    appended as they are.
+
+    Args:
+        corpus (Corpus): The corpus the bars are appended to.
+        fileId (int): Position of the ticker in the manifest, None if new.
+        columns (dict): tickerColumns of the bars.
+
+    Returns:
+        dict: The columns of the bars to append, in time order.
+    """
+    epochMinutes = columns["epochMinutes"]
+    order = np.argsort(epochMinutes, kind="stable")
+    epochMinutes = epochMinutes[order]
+
+    keep = np.append(epochMinutes[1:] != epochMinutes[:-1], True)
+    if fileId is not None and corpus.tickers[fileId]["rows"] > 0:
+        keep &= epochMinutes > corpus.column(fileId, "epochMinutes")[-1]
+    return {name: values[order][keep] for name, values in columns.items()}
+
+
+def appendTicker(corpus, ticker, columns, index):
+    """
+    Appends the new bars of one ticker to its columns, prefix sums and time of
+    day index.
+
+    Args:
+        corpus (Corpus): The corpus appended to.
+        ticker (dict): Manifest entry of the ticker, rows updated in place.
+        columns (dict): newBars of the ticker.
+        index (dict): Contents of index.json, updated in place, or None when
+            the index is stale and gets rebuilt afterwards.
+    """
+    rows = ticker["rows"]
+    tickerPath = os.path.join(corpus.binPath, ticker["name"])
+    os.makedirs(tickerPath, exist_ok=True)
+    for name, values in columns.items():
+        appendArray(os.path.join(tickerPath, name + ".bin"), values, rows)
+    ticker["rows"] = rows + len(columns["epochMinutes"])
+
+    if index is None:
+        return
+
+    # Continue the prefix sums from their last row, around the stored centre
+    centres = index["centres"].setdefault(ticker["name"], {})
+    for name in prefixColumns:
+        if name not in columns:
+            continue
+        prefixPath = os.path.join(tickerPath, name + "Prefix.bin")
+        if name not in centres:
+            # No sums to continue, written over the whole column
+            centre, sums = ALGOscan.prefixSums(
+                np.fromfile(
+                    os.path.join(tickerPath, name + ".bin"),
+                    dtype=corpusColumns[name],
+                    count=ticker["rows"],
+                )
+            )
+            sums.tofile(prefixPath)
+            centres[name] = centre
+            continue
+
+        last = np.fromfile(prefixPath, dtype=np.float64, count=2, offset=rows * 16)
+        centred = np.asarray(columns[name], dtype=np.float64) - centres[name]
+        sums = np.empty((len(centred), 2), dtype=np.float64)
+        sums[:, 0] = last[0] + np.cumsum(centred)
+        sums[:, 1] = last[1] + np.cumsum(centred * centred)
+        appendArray(prefixPath, sums, (rows + 1) * 2)
+
+    # Appended rows get a small delta index until it is worth merging
+    indexedRows = index["indexedRows"].get(ticker["name"], 0)
+    if ticker["rows"] - indexedRows > maxDeltaShare * indexedRows:
+        minuteOfDay = np.fromfile(
+            os.path.join(tickerPath, "minuteOfDay.bin"),
+            dtype=corpusColumns["minuteOfDay"],
+            count=ticker["rows"],
+        )
+        writeTimeIndex(tickerPath, "tod", minuteOfDay)
+        index["indexedRows"][ticker["name"]] = ticker["rows"]
+    else:
+        minuteOfDay = np.fromfile(
+            os.path.join(tickerPath, "minuteOfDay.bin"),
+            dtype=corpusColumns["minuteOfDay"],
+            count=ticker["rows"] - indexedRows,
+            offset=indexedRows * np.dtype(corpusColumns["minuteOfDay"]).itemsize,
+        )
+        writeTimeIndex(tickerPath, "todDelta", minuteOfDay, indexedRows)
+
+
+def appendCorpus(corpus, bars):
+    """
+    Appends new 1-minute bars to the corpus without rebuilding it.
+
+    Only the new rows are converted, and the prefix sums and time of day index
+    are extended from them, and so are the approximate indexes, see
+    ALGOann.appendAnn. The manifest and index are written last, so an
+    append that stops halfway leaves the corpus as it was. Bars appended here
+    are not in the CSV directory and are lost if the corpus is rebuilt from it.
+
+    Args:
+        corpus (Corpus): The binary corpus to append to.
+        bars (dict): Ticker name -> DataFrame with datetime, close and volume,
+            new names are added as tickers.
+
+    Returns:
+        Corpus: The corpus, reopened with the appended rows.
+    """
+    previous = corpus
+    index = None
+    if not corpus.indexIsStale():
+        index = json.loads(json.dumps(corpus.index))
+        index.setdefault("centres", {})
+        index.setdefault(
+            "indexedRows", {ticker["name"]: ticker["rows"] for ticker in corpus.tickers}
+        )
+
+    tickers = [dict(ticker) for ticker in corpus.tickers]
+    fileIds = {ticker["name"]: i for i, ticker in enumerate(tickers)}
+    appended = 0
+    for name, tickerBars in bars.items():
+        try:
+            columns = tickerColumns(tickerBars)
+        except Exception as e:
+            logging.error(f"Error converting bars of {name}: {e}")
+            continue
+
+        fileId = fileIds.get(name)
+        expected = tickers[fileId]["columns"] if fileId is not None else None
+        if "epochMinutes" not in columns or expected not in (None, sorted(columns)):
+            logging.error(f"Bars of {name} do not match the corpus columns")
+            continue
+
+        columns = newBars(corpus, fileId, columns)
+        if len(columns["epochMinutes"]) == 0:
+            continue
+
+        if fileId is None:
+            tickers.append(
+                {
+                    "name": name,
+                    "file": name + ".csv",
+                    "rows": 0,
+                    "columns": sorted(columns),
+                }
+            )
+            fileIds[name] = fileId = len(tickers) - 1
+            if index is not None:
+                index["indexedRows"][name] = 0
+        appendTicker(corpus, tickers[fileId], columns, index)
+        appended += len(columns["epochMinutes"])
+
+    writeManifest(corpus.binPath, dict(corpus.manifest, tickers=tickers))
+    corpus = Corpus(corpus.binPath)
+    if index is None:
+        corpus = buildIndex(corpus)
+    else:
+        index["corpusFingerprint"] = corpus.fingerprint()
+        writeJson(corpus.binPath, indexName, index)
+        corpus = Corpus(corpus.binPath)
+
+    # Imported here, ALGOann imports this module
+    from Algo import ALGOann
+
+    ALGOann.appendAnn(corpus, previous)
+
+    logging.info(f"Appended {appended} bars to {corpus.binPath}")
+    return corpus
+
+
+def downloadBars(names, period="5d"):
+    """
+    Downloads recent 1-minute bars of some tickers from Yahoo Finance.
+
+    Args:
+        names (list): Ticker names of the corpus, used as the symbols.
+        period (str): How far back to download, at most 7 days for 1-minute bars.
+
+    Returns:
+        dict: Ticker name -> DataFrame with datetime, close and volume in
+        exchange time, tickers whose download failed are left out.
+    """
+    import yfinance as yf
+
+    bars = {}
+    for name in names:
+        try:
+            tickerData = yf.Ticker(name).history(
+                period=period, interval="1m", prepost=False
+            )
+        except Exception as e:
+            logging.error(f"Error downloading {name}: {e}")
+            continue
+        if tickerData.empty:
+            continue
+
+        # The corpus stores exchange time without a timezone
+        tickerData.index = tickerData.index.tz_localize(None)
+        bars[name] = pd.DataFrame(
+            {
+                "datetime": tickerData.index,
+                "close": tickerData["Close"].to_numpy(),
+                "volume": tickerData["Volume"].to_numpy(),
+            }
+        )
+    return bars
+
+
+def refreshCorpus(tickerDataPath, binPath=None):
+    """
+    Rebuilds whatever is out of date: the binary corpus when the CSV directory
+    changed since it was built, and the index when it no longer matches.
+
+    Args:
+        tickerDataPath (str): Directory holding the CSV files.
+        binPath (str): Binary corpus directory, defaults to corpusPath.
+
+    Returns:
+        Corpus: The up to date corpus.
+    """
+    binPath = binPath or corpusPath(tickerDataPath)
+    if not Corpus.exists(binPath) or Corpus(binPath).sourceIsStale():
+        buildCorpus(tickerDataPath, binPath)
+
+    corpus = Corpus(binPath)
+    if corpus.indexIsStale():
+        corpus = buildIndex(corpus)
+    return corpus
+
+
+class Corpus:
+    def __init__(self, binPath):
+        """
+        Opens the manifest of a binary corpus. Arrays are mapped lazily.
+
+        Args:
+            binPath (str): Directory written by buildCorpus.
+        """
+        self.binPath = binPath
+        with open(os.path.join(binPath, manifestName)) as f:
+            self.manifest = json.load(f)
+
+        self.tickers = self.manifest["tickers"]
+        self.files = [ticker["file"] for ticker in self.tickers]
+        self.fileIds = {fileName: i for i, fileName in enumerate(self.files)}
+
+        self.index = None
+        if os.path.isfile(os.path.join(binPath, indexName)):
+            with open(os.path.join(binPath, indexName)) as f:
+                self.index = json.load(f)
+
+        # Prefix sums are written with the index and go stale with it
+        self.centres = {}
+        if not self.indexIsStale():
+            self.centres = self.index.get("centres", {})
+
+    @staticmethod
+    def exists(binPath):
+        return os.path.isfile(os.path.join(binPath, manifestName))
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def column(self, fileId, name):
+        """
+        Memory-maps one column of one ticker.
+
+        Args:
+            fileId (int): Position of the ticker in the manifest.
+            name (str): Column name, see corpusColumns.
+
+        Returns:
+            NumPy memmap: Read-only view of the column.
+        """
+        ticker = self.tickers[fileId]
+        dtype = np.dtype(self.manifest["dtypes"][name])
+        if ticker["rows"] == 0:
+            return np.empty(0, dtype=dtype)
+
+        return np.memmap(
+            os.path.join(self.binPath, ticker["name"], name + ".bin"),
+            dtype=dtype,
+            mode="r",
+            shape=(ticker["rows"],),
+        )
+
+    def fingerprint(self):
+        """Hashes the ticker names and row counts the index was built for."""
+        digest = hashlib.sha1()
+        for ticker in self.tickers:
+            digest.update(f"{ticker['name']}:{ticker['rows']};".encode())
+        return digest.hexdigest()
+
+    def indexIsStale(self):
+        # The index is stale once tickers are added, removed or appended to
+        if self.index is None:
+            return True
+        return self.index["corpusFingerprint"] != self.fingerprint()
+
+    def sourceIsStale(self):
+        # The corpus is stale once the CSV directory it was built from changes
+        source = self.manifest["source"]
+        if not os.path.isdir(source):
+            return False
+        return self.manifest.get("sourceFingerprint") != directoryFingerprint(source)
+
+    def anchorStarts(self, fileId, anchorMinute, windowLen, predictionLen):
+        """
+        Looks up every window start whose last bar falls on anchorMinute.
+
+        Args:
+            fileId (int): Position of the ticker in the manifest.
+            anchorMinute (int): Minute of day of the last bar of the query.
+            windowLen (int): The length of the query.
+            predictionLen (int): The number of rows required after each window.
+
+        Returns:
+            NumPy array: Sorted start rows, the same ALGOscan.anchorStarts finds.
+        """
+        ticker = self.tickers[fileId]
+        if not 0 <= anchorMinute < 1440 or ticker["rows"] == 0:
+            return np.empty(0, dtype=np.int64)
+
+        tickerPath = os.path.join(self.binPath, ticker["name"])
+        rows = self.timeIndexRows(tickerPath, "tod", anchorMinute)
+
+        # Rows appended since the last full index, all after the base rows
+        indexedRows = self.index.get("indexedRows", {}).get(ticker["name"])
+        if indexedRows is not None and indexedRows < ticker["rows"]:
+            rows = np.concatenate(
+                (rows, self.timeIndexRows(tickerPath, "todDelta", anchorMinute))
+            )
+
+        starts = rows - (windowLen - 1)
+        stop = ticker["rows"] - windowLen - int(predictionLen)
+        return starts[(starts >= 0) & (starts < stop)]
+
+    @staticmethod
+    def timeIndexRows(tickerPath, prefix, anchorMinute):
+        # Reads one minute's bucket of a time of day index, see writeTimeIndex
+        offsets = np.fromfile(
+            os.path.join(tickerPath, prefix + "Offsets.bin"),
+            dtype=np.int64,
+            count=2,
+            offset=anchorMinute * 8,
+        )
+        return np.fromfile(
+            os.path.join(tickerPath, prefix + "Rows.bin"),
+            dtype=np.int64,
+            count=offsets[1] - offsets[0],
+            offset=offsets[0] * 8,
+        )
+
+    def prefixes(self, fileId):
+        """Returns the stored prefixSums of close and volume, or None."""
+        prefixes = tuple(self.prefixSums(fileId, name) for name in prefixColumns)
+        if None in prefixes:
+            return None
+        return prefixes
+
+    def prefixSums(self, fileId, name):
+        """
+        Memory-maps the stored prefix sums of one column of one ticker.
+
+        Args:
+            fileId (int): Position of the ticker in the manifest.
+            name (str): Column name, see prefixColumns.
+
+        Returns:
+            tuple: (centre, sums) as ALGOscan.prefixSums returns them, or None
+            when the index is stale or was built without them.
+        """
+        ticker = self.tickers[fileId]
+        centre = self.centres.get(ticker["name"], {}).get(name)
+        if centre is None:
+            return None
+
+        return centre, np.memmap(
+            os.path.join(self.binPath, ticker["name"], name + "Prefix.bin"),
+            dtype=np.float64,
+            mode="r",
+            shape=(ticker["rows"] + 1, 2),
+        )
+
+    def open(self, fileId):
+        """Memory-maps every column stored for one ticker."""
+        return {
+            name: self.column(fileId, name) for name in self.tickers[fileId]["columns"]
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Binary copy of a CSV corpus")
+    parser.add_argument(
+        "command", choices=["build", "index", "refresh", "append", "ingest"]
+    )
+    parser.add_argument("tickerDataPath")
+    parser.add_argument("binPath", nargs="?")
+    parser.add_argument(
+        "--bars", nargs="*", default=[], help="CSV files of bars for append"
+    )
+    parser.add_argument("--period", default="5d", help="Download period for ingest")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        corpus = buildIndex(buildCorpus(args.tickerDataPath, args.binPath))
+        print(f"{len(corpus)} tickers written to {corpus.binPath}")
+    elif args.command == "index":
+        corpus = Corpus(args.binPath or corpusPath(args.tickerDataPath))
+        buildIndex(corpus)
+        print(f"Indexed {len(corpus)} tickers in {corpus.binPath}")
+    elif args.command == "refresh":
+        corpus = refreshCorpus(args.tickerDataPath, args.binPath)
+        print(f"{len(corpus)} tickers up to date in {corpus.binPath}")
+    elif args.command == "append":
+        corpus = Corpus(args.binPath or corpusPath(args.tickerDataPath))
+        corpus = appendCorpus(
+            corpus,
+            {
+                os.path.splitext(os.path.basename(filePath))[0]: pd.read_csv(filePath)
+                for filePath in args.bars
+            },
+        )
+        print(f"{len(corpus)} tickers up to date in {corpus.binPath}")
+    elif args.command == "ingest":
+        corpus = Corpus(args.binPath or corpusPath(args.tickerDataPath))
+        bars = downloadBars([ticker["name"] for ticker in corpus.tickers], args.period)
+        corpus = appendCorpus(corpus, bars)
+        print(f"{len(corpus)} tickers up to date in {corpus.binPath}")
@@ -5,6 +5,10 @@ import time
 import multiprocessing as mp
 import logging
 
+from Algo import ALGOcorpus
+from Algo import ALGOscan
+from Algo import ALGOprogress
+
 # Setting up logging with detailed formatting
 logging.basicConfig(
     filename="algoLog.log",
@@ -12,9 +16,21 @@ logging.basicConfig(
     format="%(asctime)s:%(levelname)s:%(message)s",
 )
 
+tickerDataPath = "C:/Users/Simon E/Documents/Resources/Ticker_Data_Multiplied"
+
 
 class Algo:
-    def __init__(self, dataSize, predictionLen, tickerDataMultiplied, progressQueue):
+    def __init__(
+        self,
+        dataSize,
+        predictionLen,
+        tickerDataMultiplied,
+        progressQueue,
+        heuristics=True,
+        pool=None,
+        firstFile=0,
+        resultSize=100,
+    ):
         """
         Initialize the Algo class with settings for processing financial data.
 
@@ -23,14 +39,49 @@ class Algo:
             predictionLen (int): The length of the prediction interval.
             tickerDataMultiplied (DataFrame): The pre-processed ticker data.
             progressQueue (Queue): A queue for progress updates.
+            heuristics (bool): Apply the skip and break heuristics to each file
+                instead of ranking every window. Ranking every window scores
+                windows exactly only when their PAA lower bound can still
+                reach the top results.
+            pool (Pool): Multiprocessing pool kept up between queries, a new
+                one is started per query if None.
+            firstFile (int): The files firstFile to firstFile + dataSize are
+                scanned, so nodes can split the corpus between them.
+            resultSize (int): The number of closest windows kept.
         """
         self.settings = {
             "dataSize": dataSize,
             "predictionLen": predictionLen,
             "tickerDataMultiplied": tickerDataMultiplied.to_numpy(),
             "progressQueue": progressQueue,
+            "heuristics": heuristics,
+            "firstFile": firstFile,
+            "resultSize": resultSize,
         }
 
+        self.pool = pool
+        self.tickerDataPath = tickerDataPath
+        self.tickerBinPath = ALGOcorpus.corpusPath(self.tickerDataPath)
+
+        # Memory-map the binary corpus when it has been built
+        self.corpus = None
+        if ALGOcorpus.Corpus.exists(self.tickerBinPath):
+            self.corpus = ALGOcorpus.Corpus(self.tickerBinPath)
+
+        # CSV files changed since the build, scan them instead
+        if self.corpus is not None and self.corpus.sourceIsStale():
+            logging.warning(
+                f"Binary corpus is stale, scanning CSV: {self.tickerBinPath}"
+            )
+            self.corpus = None
+
+    def __getstate__(self):
+        # Workers report through shared counters, the queue stays in this process
+        state = self.__dict__.copy()
+        state["settings"] = dict(self.settings, progressQueue=None)
+        state["pool"] = None
+        return state
+
     def startPool(self):
         """
         Starts a multiprocessing pool to parallelize data processing, accompanied by a progress bar.
@@ -38,131 +89,192 @@ class Algo:
         Returns:
             DataFrame: The prediction results in a DataFrame format.
         """
+        try:
+            matches, predictionArray = self.findMatches()
+            return pd.DataFrame(predictionArray)
+        except Exception as e:
+            logging.exception("An error occurred during startPool execution: " + str(e))
+            return pd.DataFrame()
+
+    def findMatches(self):
+        """
+        Scans the files of the query and continues the closest windows.
+
+        Returns:
+            tuple: (matches, predictions). matches holds distance, fileNum and
+            location of the closest windows, closest first, and predictions
+            holds the continuation of every one of them as a column.
+        """
         self.tickerDataLen = len(self.settings["tickerDataMultiplied"])
+        predictionRows = self.tickerDataLen + int(self.settings["predictionLen"])
 
-        numProcesses = mp.cpu_count()
-        manager = mp.Manager()
-        progressList = manager.list(
-            [0] * numProcesses
+        self.processes = mp.cpu_count()
+        progressCounters = ALGOprogress.ProgressCounters(
+            self.processes
         )  # Tracks progress of each process
+        progressReporter = ALGOprogress.ProgressReporter(
+            self.settings["progressQueue"], int(self.settings["dataSize"])
+        )
 
         resultsArray = np.empty((0, 3))
-        predictionArray = np.empty((0, 1))
 
+        pool = self.pool or mp.Pool(processes=self.processes)
         try:
-            with mp.Pool(processes=numProcesses) as pool:
-                results = [
-                    pool.apply_async(self.algo, args=(processId, progressList))
-                    for processId in range(numProcesses)
-                ]
-
-                # Progress bar logic
-                prevTotal = 0
-                while any(result.ready() is False for result in results):
-                    currentTotal = sum(progressList)
-                    if currentTotal != prevTotal:
-                        self.settings["progressQueue"].put(
-                            currentTotal / self.settings["dataSize"]
-                        )
-                    prevTotal = currentTotal
-                    time.sleep(0.1)  # Update interval
-
-                for result in results:
-                    processResult = result.get()
-                    if processResult.size > 0:
-                        resultsArray = np.vstack((resultsArray, processResult))
-
-            # Sort results based on the distance metric
-            resultsArray = resultsArray[np.argsort(resultsArray[:, 0])]
-
-            # Process predictions
-            for i in range(min(100, len(resultsArray))):
-                self.fileNum = int(resultsArray[i, 1])
-                self.location = int(resultsArray[i, 2])
-
-                result = self.findPredictions()
-
-                if predictionArray.shape[0] == 0:
-                    predictionArray = result.reshape(-1, 1)
-                else:
-                    if result.size == predictionArray.shape[0]:
-                        predictionArray = np.hstack(
-                            (predictionArray, result.reshape(-1, 1))
-                        )
-                    else:
-                        logging.error("Result array size mismatch.")
-
-            return pd.DataFrame(predictionArray)
-        except Exception as e:
-            logging.exception("An error occurred during startPool execution: " + str(e))
-            return pd.DataFrame()
+            results = [
+                pool.apply_async(self.algo, args=(processId, progressCounters.spec()))
+                for processId in range(self.processes)
+            ]
 
-    def algo(self, processId, progressList):
+            # Progress bar logic
+            while any(result.ready() is False for result in results):
+                progressReporter.update(*progressCounters.totals())
+                time.sleep(ALGOprogress.updateInterval)  # Update interval
+            progressReporter.update(*progressCounters.totals(), force=True)
+
+            for result in results:
+                processResult = result.get()
+                if processResult.size > 0:
+                    resultsArray = np.vstack((resultsArray, processResult))
+        finally:
+            if self.pool is None:
+                pool.terminate()
+            progressCounters.close()
+
+        # Sort results based on the distance metric
+        resultsArray = resultsArray[
+            np.argsort(resultsArray[:, 0], kind="stable")[: self.settings["resultSize"]]
+        ]
+
+        # Process predictions, a match without a full continuation is dropped
+        matches = []
+        predictions = []
+        for match in resultsArray:
+            self.fileNum = int(match[1])
+            self.location = int(match[2])
+
+            result = self.findPredictions()
+            if result.size == predictionRows:
+                matches.append(match)
+                predictions.append(result)
+            else:
+                logging.error("Result array size mismatch.")
+
+        if not matches:
+            return np.empty((0, 3)), np.empty((predictionRows, 0))
+        return np.array(matches), np.column_stack(predictions)
+
+    def algo(self, processId, progressSpec):
         """
         Processes data in parallel, updating the progress, and identifies segments matching the criteria.
 
         Args:
             processId (int): The identifier for the process in the pool.
-            progressList (Manager.list): A shared list for tracking progress.
+            progressSpec (dict): ProgressCounters.spec(), this process counts in
+                row processId.
 
         Returns:
             NumPy array: The results of the algorithm for this process.
         """
-        resultList = []  # Collects the results
-        tickerDataPath = "C:/Users/Simon E/Documents/Resources/Ticker_Data_Multiplied"
+        # Only the resultSize closest windows are continued by findMatches
+        topResults = ALGOscan.TopK(self.settings["resultSize"])
 
         try:
-            files = os.listdir(tickerDataPath)
+            files = self.listFiles()
         except FileNotFoundError:
-            logging.error(f"Directory not found: {tickerDataPath}")
+            logging.error(f"Directory not found: {self.tickerDataPath}")
             return np.array([])
 
-        for x in range(int(self.settings["dataSize"] / 16)):
-            progressList[processId] += 1
-            skipLen = 0
-            try:
-                filePath = os.path.join(
-                    tickerDataPath,
-                    files[int(x + self.settings["dataSize"] / 16 * processId)],
-                )
-                tickerCache = pd.read_csv(filePath, usecols=["Close"]).to_numpy()
-
-                for i in range(
-                    len(tickerCache)
-                    - self.tickerDataLen
-                    - int(self.settings["predictionLen"])
-                ):
-                    if skipLen == 0:
-                        tickerCacheSegment = tickerCache[i : i + self.tickerDataLen]
-                        tickerCacheSegmentNormalized = (
-                            tickerCacheSegment / tickerCacheSegment[-1]
-                        )
+        # Every process scans an equal slice of the files of the query
+        firstFile = self.settings["firstFile"]
+        dataSize = int(self.settings["dataSize"])
+        sliceStart = firstFile + dataSize * processId // self.processes
+        sliceEnd = firstFile + dataSize * (processId + 1) // self.processes
 
-                        distance = np.linalg.norm(
-                            self.settings["tickerDataMultiplied"]
-                            - tickerCacheSegmentNormalized
-                        )
-
-                        if distance > self.tickerDataLen / 50:
-                            break
-                        elif distance > self.tickerDataLen / 1000 * 0.5:
-                            skipLen = int(self.tickerDataLen / 5)
-
-                        resultList.append(
-                            [
-                                distance,
-                                x + int(self.settings["dataSize"] / 16 * processId),
-                                i,
-                            ]
+        progressBlock, counters = ALGOprogress.attachCounters(progressSpec)
+        progress = counters[processId]
+        try:
+            for fileNum in range(sliceStart, min(sliceEnd, len(files))):
+                progress[0] += 1
+                try:
+                    filePath = os.path.join(self.tickerDataPath, files[fileNum])
+                    tickerCache = self.readClose(fileNum, filePath)
+                    progress[1] += len(tickerCache)
+
+                    # Every window with a prediction after it
+                    stop = max(
+                        0,
+                        len(tickerCache)
+                        - self.tickerDataLen
+                        - int(self.settings["predictionLen"]),
+                    )
+
+                    if self.settings["heuristics"]:
+                        profile = ALGOscan.ratioProfile(
+                            tickerCache, self.settings["tickerDataMultiplied"]
+                        )[:stop]
+                        rows = ALGOscan.skipFilter(profile, self.tickerDataLen)
+                        ALGOscan.profileTopK(
+                            tickerCache,
+                            profile,
+                            rows,
+                            self.settings["tickerDataMultiplied"],
+                            topResults,
+                            fileNum,
                         )
                     else:
-                        skipLen -= 1
-            except FileNotFoundError:
-                logging.error(f"File not found: {filePath}")
-            except Exception as e:
-                logging.exception(f"Unexpected error processing file {filePath}: {e}")
+                        ALGOscan.ratioTopK(
+                            tickerCache,
+                            stop,
+                            self.settings["tickerDataMultiplied"],
+                            topResults,
+                            fileNum,
+                            self.readPrefixSums(fileNum),
+                        )
+                except FileNotFoundError:
+                    logging.error(f"File not found: {filePath}")
+                except Exception as e:
+                    logging.exception(
+                        f"Unexpected error processing file {filePath}: {e}"
+                    )
+        finally:
+            del progress, counters
+            progressBlock.close()
+
+        return np.column_stack(topResults.result())
+
+    def listFiles(self):
+        """
+        Lists the ticker files in the order fileNum refers to.
+
+        Returns:
+            list: File names of the corpus.
+        """
+        if self.corpus is not None:
+            return self.corpus.files
+
+        # Sorted, so every node numbers the files the same way
+        return sorted(os.listdir(self.tickerDataPath))
 
-        return np.array(resultList) if resultList else np.empty((0, 3))
+    def readClose(self, fileNum, filePath):
+        """
+        Loads the close column of one ticker, memory-mapped when possible.
+
+        Args:
+            fileNum (int): Position of the file in listFiles.
+            filePath (str): Path of the CSV file.
+
+        Returns:
+            NumPy array: The close column.
+        """
+        if self.corpus is not None:
+            return self.corpus.column(fileNum, "close")
+        return pd.read_csv(filePath, usecols=["Close"])["Close"].to_numpy()
+
+    def readPrefixSums(self, fileNum):
+        # Stored prefix sums of the close column, None to compute them
+        if self.corpus is not None:
+            return self.corpus.prefixSums(fileNum, "close")
+        return None
 
     def findPredictions(self):
         """
@@ -171,17 +283,15 @@ class Algo:
         Returns:
             NumPy array: The segment of data used for prediction.
         """
-        tickerDataPath = "C:/Users/Simon E/Documents/Resources/Ticker_Data_Multiplied"
-
         try:
-            files = os.listdir(tickerDataPath)
+            files = self.listFiles()
         except FileNotFoundError:
             logging.error("Prediction directory not found.")
             return np.array([])
 
         try:
-            filePath = os.path.join(tickerDataPath, files[self.fileNum])
-            tickerCache = pd.read_csv(filePath)["Close"].to_numpy()
+            filePath = os.path.join(self.tickerDataPath, files[self.fileNum])
+            tickerCache = self.readClose(self.fileNum, filePath)
 
             # Segment for prediction
             tickerCacheSegment = tickerCache[
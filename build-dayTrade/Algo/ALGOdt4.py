@@ -3,10 +3,15 @@ import pandas as pd
 import numpy as np
 import multiprocessing as mp
 import logging
-import heapq
 import random
 from datetime import datetime
-from time import sleep
+
+from Algo import ALGOscan
+from Algo import ALGOcorpus
+from Algo import ALGOpool
+from Algo import ALGOprogress
+from Algo import ALGOann
+from Algo import ALGOkernel
 
 # Setting up logging with detailed formatting
 logging.basicConfig(
@@ -16,8 +21,207 @@ logging.basicConfig(
 )
 
 
+tickerDataPath = "C:/Users/Simon E/Documents/Resources/FRD500"
+
+
+def readTicker(corpus, fileId, filePath):
+    # Returns close and volume columns of one ticker and its time of day
+    # column, in minutes for the corpus and microseconds for the CSV files
+    if corpus is not None:
+        columns = ALGOpool.workerColumns(fileId)
+        return columns["close"], columns["volume"], columns.get("minuteOfDay")
+
+    tickerCache = pd.read_csv(
+        filePath,
+        usecols=["datetime", "close", "volume"],
+        dtype={"close": "float", "volume": "float"},
+        parse_dates=["datetime"],
+    )
+    close = tickerCache["close"].to_numpy()
+    volume = tickerCache["volume"].to_numpy()
+    return close, volume, ALGOscan.timeOfDay(tickerCache["datetime"])
+
+
+def readPrefixSums(corpus, fileId, close, volume):
+    # Prefix sums of close and volume, stored with the corpus index or
+    # computed once per file for every query of the batch
+    if corpus is not None and corpus.prefixes(fileId) is not None:
+        return corpus.prefixes(fileId)
+    return ALGOscan.prefixSums(close), ALGOscan.prefixSums(volume)
+
+
+def windowStarts(query, corpus, fileId, times, useIndex):
+    # Start of every window of one ticker ending on the query's anchor time
+    anchorTime = query["anchorTime"]
+    if corpus is not None:
+        anchorTime = ALGOcorpus.anchorMinute(anchorTime)
+        if useIndex:
+            return corpus.anchorStarts(
+                fileId, anchorTime, query["windowLen"], query["predictionLen"]
+            )
+
+    return ALGOscan.anchorStarts(
+        times, anchorTime, query["windowLen"], query["predictionLen"]
+    )
+
+
+def scanTask(task):
+    """
+    Scans one chunk of the corpus for every query of a batch inside a pool worker.
+
+    Args:
+        task (dict): Query vectors and parameters, see Algo.task.
+
+    Returns:
+        list: ((distances, fileIds, rows), pruneStats) of the best windows
+        found in the chunk, one per query.
+    """
+    corpus = None
+    if task["fingerprint"] is not None:
+        corpus = ALGOpool.workerCorpus(task["fingerprint"])
+    ALGOpool.attachShared(task["sharedCorpus"])
+
+    # Query vectors are read straight from the parent's shared memory blocks
+    queries = []
+    queryBlocks = []
+    progressBlock, counters = ALGOprogress.attachCounters(task["progress"])
+    try:
+        for query in task["queries"]:
+            queryBlock, vector = ALGOpool.attachArray(query["query"])
+            queryBlocks.append(queryBlock)
+
+            # Prune against everything this worker already found for the query,
+            # the progress block is unique to the batch
+            topResults = ALGOpool.workerTopK(
+                task["progress"]["name"],
+                query["query"]["name"],
+                lambda: ALGOscan.TopK(query["resultSize"]),
+            )
+            queries.append(
+                dict(
+                    query,
+                    vector=vector,
+                    topResults=topResults,
+                    pruneStats=ALGOscan.newPruneStats(),
+                )
+            )
+
+        scanFiles(task, corpus, queries, counters[task["progressSlot"]])
+    finally:
+        for query in queries:
+            del query["vector"]
+        del counters
+        for queryBlock in queryBlocks:
+            queryBlock.close()
+        progressBlock.close()
+
+    # Only the entries of this chunk, at most resultSize of them per query
+    results = []
+    for query in queries:
+        distances, fileIds, rows = query["topResults"].result()
+        inChunk = np.isin(fileIds, task["fileIds"])
+        results.append(
+            (
+                (distances[inChunk], fileIds[inChunk], rows[inChunk]),
+                query["pruneStats"],
+            )
+        )
+    return results
+
+
+def scanFiles(task, corpus, queries, progress):
+    # Reads each of the task's files once, pushes its windows into the top
+    # results of every query covering it and counts files and rows done in
+    # this task's progress slot
+    for fileId, fileName in zip(task["fileIds"], task["files"]):
+        filePath = os.path.join(task["tickerDataPath"], fileName)
+        progress[0] += 1
+        fileQueries = [query for query in queries if fileId < query["dataSize"]]
+        if not fileQueries:
+            continue
+
+        try:
+            close, volume, times = readTicker(corpus, fileId, filePath)
+        except Exception as e:
+            logging.error(f"Error reading {filePath}: {e}")
+            continue
+        progress[1] += len(close)
+
+        # Stored sums keep every path on the same window stats after appends
+        prefixes = corpus.prefixes(fileId) if corpus is not None else None
+        if task["pruning"]:
+            prefixes = readPrefixSums(corpus, fileId, close, volume)
+
+        for query in fileQueries:
+            try:
+                starts = windowStarts(query, corpus, fileId, times, task["useIndex"])
+            except Exception as e:
+                logging.error(f"Error reading {filePath}: {e}")
+                continue
+
+            # Score every window ending on the query's time of day in one pass
+            if task["pruning"]:
+                topK = ALGOscan.prunedTopK
+                if task["compiled"] and ALGOkernel.available:
+                    topK = ALGOkernel.kernelTopK
+                elif task["precision"] == "float32":
+                    topK = ALGOscan.fusedTopK
+                topK(
+                    close,
+                    volume,
+                    starts,
+                    query["vector"],
+                    query["topResults"],
+                    fileId,
+                    query["pruneStats"],
+                    prefixes,
+                )
+            else:
+                distances = ALGOscan.zScoreDistances(
+                    close, volume, starts, query["vector"], prefixes
+                )
+                query["topResults"].push(distances, fileId, starts)
+
+
+def continuationTask(task):
+    """
+    Reads one CSV ticker once and slices the continuation of every match in it.
+
+    Args:
+        task (dict): filePath, fileId, starts and lengths of the continuations.
+
+    Returns:
+        tuple: (fileId, list of continuations in the order of starts).
+    """
+    close = pd.read_csv(task["filePath"], usecols=["close"], dtype={"close": "float"})[
+        "close"
+    ].to_numpy()
+    return task["fileId"], sliceWindows(close, task["starts"], task["lengths"])
+
+
+def sliceWindows(close, starts, lengths):
+    # Continuations of every match in one ticker, as float64 arrays
+    return [
+        np.asarray(close[start : start + length], dtype=np.float64)
+        for start, length in zip(starts, lengths)
+    ]
+
+
 class Algo:
-    def __init__(self, dataSize, predictionLen, tickerDataZScores, progressQueue):
+    def __init__(
+        self,
+        dataSize,
+        predictionLen,
+        tickerDataZScores,
+        progressQueue,
+        resultSize=100,
+        pruning=True,
+        precision="float32",
+        compiled=True,
+        pool=None,
+        approximate=False,
+        priority=0,
+    ):
         """
         Initialize the Algo class with settings for processing financial data.
 
@@ -26,157 +230,408 @@ class Algo:
             predictionLen (int): The length of the prediction interval.
             tickerDataZScores (DataFrame): The pre-processed ticker data.
             progressQueue (Queue): A queue for progress updates.
+            resultSize (int): The number of closest matches to return.
+            pruning (bool): Skip windows that provably cannot reach the top results.
+            precision (str): "float32" screens windows with the fused float32
+                distance before re-scoring them, "float64" abandons them early.
+                Both return the same results.
+            compiled (bool): Scan with the numba kernel when numba is
+                installed, see ALGOkernel. Results are the same either way.
+            pool (ALGOpool): A warm worker pool to run on, started per query if None.
+            approximate (bool): Match through the approximate index when one
+                has been built, see ALGOann.
+            priority (int): Chunks of this query run before the waiting chunks
+                of concurrent queries with a higher number on the same pool.
         """
         self.settings = {
             "dataSize": dataSize,
             "predictionLen": predictionLen,
             "tickerDataZScores": tickerDataZScores,
             "progressQueue": progressQueue,
+            "resultSize": max(1, int(resultSize)),
+            "pruning": pruning,
+            "precision": precision,
+            "compiled": compiled,
+            "approximate": approximate,
+            "priority": priority,
         }
+        self.pool = pool
 
-        self.tickerDataPath = "C:/Users/Simon E/Documents/Resources/FRD500"
-        self.tickerDataLen = len(self.settings["tickerDataZScores"])
-        self.processSplitIndex = self.settings["dataSize"] // 16
+        self.tickerDataPath = pool.tickerDataPath if pool else tickerDataPath
+        self.tickerBinPath = ALGOcorpus.corpusPath(self.tickerDataPath)
+
+        # Memory-map the binary corpus when it has been built
+        self.corpus = None
+        if ALGOcorpus.Corpus.exists(self.tickerBinPath):
+            self.corpus = ALGOcorpus.Corpus(self.tickerBinPath)
+
+        # CSV files changed since the build, scan them instead
+        if self.corpus is not None and self.corpus.sourceIsStale():
+            logging.warning(
+                f"Binary corpus is stale, scanning CSV: {self.tickerBinPath}"
+            )
+            self.corpus = None
+
+        # Only jump straight to matching windows when the index is current
+        self.useIndex = self.corpus is not None and not self.corpus.indexIsStale()
+        if self.corpus is not None and not self.useIndex:
+            logging.warning(f"Time of day index is stale: {self.tickerBinPath}")
 
     def startPool(self):
-        numProcesses = mp.cpu_count()
-        manager = mp.Manager()
-        progressList = manager.list([0] * numProcesses)
-        resultsList = []
+        return self.startBatch([{}])[0]
+
+    def startBatch(self, queries):
+        """
+        Runs several queries in a single pass over the corpus.
+
+        Every file is read once and scored against each query that covers it,
+        so a watchlist of N tickers costs one scan instead of N.
+
+        Args:
+            queries (list): Dicts with tickerDataZScores, predictionLen,
+                dataSize and resultSize. Missing keys default to the settings
+                of this Algo, so queries may differ in length and anchor time.
+                A query repeated over time may bring an IncrementalMatcher
+                under "matcher" to refresh its candidates instead of scanning.
+                "approximate" picks between the exact scan and ALGOann.
+
+        Returns:
+            list: The prediction DataFrame of every query, in order.
+        """
+        queries = [self.querySettings(query) for query in queries]
+
+        pool = self.pool
+        if pool is None:
+            # Loading a shared corpus only pays off when the pool is reused
+            pool = ALGOpool.ALGOpool(self.tickerDataPath, sharedCorpus=False)
+        else:
+            pool.reused()
 
+        try:
+            return self.runQueries(pool, queries)
+        finally:
+            if self.pool is None:
+                pool.close()
+
+    def querySettings(self, query):
+        # One query of a batch, completed with the settings of this Algo
+        settings = {
+            key: query.get(key, self.settings[key])
+            for key in ("dataSize", "predictionLen", "tickerDataZScores", "resultSize")
+        }
+        settings["dataSize"] = int(settings["dataSize"])
+        settings["predictionLen"] = int(settings["predictionLen"])
+        settings["resultSize"] = max(1, int(settings["resultSize"]))
+        settings["matcher"] = query.get("matcher")
+        settings["approximate"] = bool(
+            query.get("approximate", self.settings["approximate"])
+        )
+        return settings
+
+    def queryTask(self, query, querySpec):
+        """
+        Builds the part of a worker message that describes one query.
+
+        Args:
+            query (dict): Settings of the query, see querySettings.
+            querySpec (dict): Shared memory block holding the query vector.
+
+        Returns:
+            dict: The query vector and parameters the workers need.
+        """
+        return {
+            "query": querySpec,
+            "anchorTime": ALGOscan.anchorTimeOfDay(query["tickerDataZScores"][-1, 0]),
+            "windowLen": len(query["tickerDataZScores"]),
+            "predictionLen": query["predictionLen"],
+            "resultSize": query["resultSize"],
+            "dataSize": query["dataSize"],
+        }
+
+    def task(self, fileIds, files, queryTasks, sharedSpec, progressSpec, progressSlot):
+        """
+        Builds the message one pool worker needs for a chunk of the batch.
+
+        Args:
+            fileIds (list): The files of the chunk.
+            files (list): File names of the whole corpus.
+            queryTasks (list): queryTask() of every query in the batch.
+            sharedSpec (dict): Shared memory blocks holding the corpus, or None.
+            progressSpec (dict): ProgressCounters.spec() of the batch.
+            progressSlot (int): The counter row only this chunk writes to.
+
+        Returns:
+            dict: The query vectors and parameters, without the Algo instance.
+        """
+        return {
+            "tickerDataPath": self.tickerDataPath,
+            "fileIds": [int(fileId) for fileId in fileIds],
+            "files": [files[fileId] for fileId in fileIds],
+            "fingerprint": self.corpus.fingerprint() if self.corpus else None,
+            "useIndex": self.useIndex,
+            "sharedCorpus": sharedSpec,
+            "queries": queryTasks,
+            "progress": progressSpec,
+            "progressSlot": progressSlot,
+            "pruning": self.settings["pruning"],
+            "precision": self.settings["precision"],
+            "compiled": self.settings["compiled"],
+        }
+
+    def fileSizes(self, files, fileIds):
+        # Rows per file from the manifest, bytes on disk for the CSV corpus
+        if self.corpus is not None:
+            return [self.corpus.tickers[fileId]["rows"] for fileId in fileIds]
+        return [
+            os.path.getsize(os.path.join(self.tickerDataPath, files[fileId]))
+            for fileId in fileIds
+        ]
+
+    def runQueries(self, pool, queries):
         try:
             try:
-                files = os.listdir(self.tickerDataPath)
+                files = self.listFiles()
             except FileNotFoundError:
                 logging.error(f"Directory not found: {self.tickerDataPath}")
-                return np.array([])
-            with mp.Pool(processes=numProcesses) as pool:
-                results = [
-                    pool.apply_async(self.algo, args=(processId, progressList, files))
-                    for processId in range(numProcesses)
-                ]
-
-                # Progress bar logic for the first phase
-                prevTotal = 0
-                while any(result.ready() is False for result in results):
-                    currentTotal = sum(progressList)
-                    if currentTotal != prevTotal:
-                        self.settings["progressQueue"].put(
-                            currentTotal / self.settings["dataSize"]
-                        )
-                    prevTotal = currentTotal
-                    sleep(0.1)
-
-                for result in results:
-                    processResult = result.get()
-                    if processResult:
-                        resultsList.extend(
-                            processResult
-                        )  # Append tuples to the resultsList
+                return [pd.DataFrame() for query in queries]
+
+            # Repeating queries refresh their candidates instead of scanning,
+            # approximate queries re-rank the candidates of the ANN index
+            topResults = [None] * len(queries)
+            scanned = []
+            for position, query in enumerate(queries):
+                result = None
+                if self.corpus is not None and query["matcher"] is not None:
+                    result = query["matcher"].match(
+                        self.corpus,
+                        self.useIndex,
+                        query,
+                        pool,
+                        self.settings["priority"],
+                    )
+                elif self.corpus is not None and query["approximate"]:
+                    result = ALGOann.approximateTopK(self.corpus, query)
+                    if result is None:
+                        logging.warning("No approximate index, scanning exactly")
+
+                # No index to answer from, fall back to the exact scan
+                if result is None:
+                    scanned.append(position)
+                    continue
+                topResults[position] = ALGOscan.TopK(query["resultSize"])
+                topResults[position].push(*result)
+
+            if scanned:
+                scannedResults = self.scanQueries(
+                    pool, files, [queries[position] for position in scanned]
+                )
+                for position, queryResults in zip(scanned, scannedResults):
+                    topResults[position] = queryResults
 
             # Reset the progress bar for the second phase
-            self.settings["progressQueue"].put(0)
-            progress100 = 0
-            total100 = len(resultsList) if len(resultsList) < 100 else 100
-
-            # Get the 100 smallest distances without sorting the entire list
-            top100Results = heapq.nsmallest(100, resultsList, key=lambda x: x[0])
-
-            resultsList100 = []
-            for idx, (_, filePath, i) in enumerate(top100Results):
-                # Load the file corresponding to filePath
-                tickerData = pd.read_csv(
-                    filePath,
-                    usecols=["close"],
-                    dtype={"close": "float"},
-                    skiprows=range(1, i),
-                    nrows=self.tickerDataLen + self.settings["predictionLen"],
-                ).to_numpy()
-
-                # Compute the z-score for close and volume
-                tickerDataZScores = (4 * (tickerData - np.mean(tickerData))) / np.std(
-                    tickerData
-                ).ravel()
-
-                resultsList100.append(tickerDataZScores)
-
-                # Update progress for the second phase
-                progress100 += 1
-                self.settings["progressQueue"].put(progress100 / total100)
-
-            resultsList100 = [np.squeeze(array) for array in resultsList100]
-
-            # Convert to DataFrame and transpose
-            return pd.DataFrame(resultsList100).T
+            matchCounts = [len(queryResults) for queryResults in topResults]
+            progressReporter = ALGOprogress.ProgressReporter(
+                self.settings["progressQueue"], sum(matchCounts), phase=2
+            )
+            progressReporter.update(0, force=True)
+
+            # Continuations of every query are fetched together, file by file
+            matches = [queryResults.result() for queryResults in topResults]
+            continuations = self.fetchContinuations(
+                pool,
+                files,
+                np.concatenate([fileIds for _, fileIds, _ in matches]),
+                np.concatenate([starts for _, _, starts in matches]),
+                np.repeat(
+                    [
+                        len(query["tickerDataZScores"]) + query["predictionLen"]
+                        for query in queries
+                    ],
+                    matchCounts,
+                ),
+                progressReporter,
+            )
+
+            predictions = []
+            for end, count in zip(np.cumsum(matchCounts), matchCounts):
+                resultsList100 = []
+                for tickerData in continuations[end - count : end]:
+                    # Compute the z-score for close and volume
+                    tickerDataZScores = (
+                        4 * (tickerData - np.mean(tickerData))
+                    ) / np.std(tickerData)
+
+                    resultsList100.append(tickerDataZScores)
+
+                resultsList100 = [np.squeeze(array) for array in resultsList100]
+
+                # Convert to DataFrame and transpose
+                predictions.append(pd.DataFrame(resultsList100).T)
+            return predictions
         except Exception as e:
             logging.exception("An error occurred during startPool execution: " + str(e))
-            return pd.DataFrame()
+            return [pd.DataFrame() for query in queries]
 
-    def algo(self, processId, progressList, files):
-        resultList = []  # Collects the results
+    def scanQueries(self, pool, files, queries):
+        """
+        Scans the corpus once for every query of a batch on the pool.
 
-        try:
-            files = os.listdir(self.tickerDataPath)
-        except FileNotFoundError:
-            logging.error(f"Directory not found: {self.tickerDataPath}")
-            return np.array([])
+        Args:
+            pool (ALGOpool): The pool to run on.
+            files (list): File names of the corpus.
+            queries (list): Settings of every query, see querySettings.
 
-        tickerDataTime = self.settings["tickerDataZScores"][-1, 0]
+        Returns:
+            list: The TopK of every query.
+        """
+        topResults = [ALGOscan.TopK(query["resultSize"]) for query in queries]
+        pruneStats = ALGOscan.newPruneStats()
+
+        # Every file requested by any query is scanned exactly once
+        dataSize = max(query["dataSize"] for query in queries)
+        fileIds = list(range(min(dataSize, len(files))))
+        sizes = self.fileSizes(files, fileIds)
+        chunks = ALGOpool.planChunks(fileIds, sizes, pool.processes)
+
+        # Workers count progress in shared memory, one row per chunk
+        progressCounters = ALGOprogress.ProgressCounters(len(chunks))
+        progressReporter = ALGOprogress.ProgressReporter(
+            self.settings["progressQueue"],
+            len(fileIds),
+            sum(sizes) if self.corpus is not None else None,
+        )
 
-        for x in range(self.processSplitIndex):
-            filePath = os.path.join(
-                self.tickerDataPath, files[x + self.processSplitIndex * processId]
-            )
-            try:
-                tickerCache = pd.read_csv(
-                    filePath,
-                    usecols=["datetime", "close", "volume"],
-                    dtype={"close": "float", "volume": "float"},
-                    parse_dates=["datetime"],
+        # Workers attach to the queries and corpus instead of receiving copies
+        queryBlocks = []
+        queryTasks = []
+        results = None
+        sharedSpec = None
+        try:
+            for query in queries:
+                queryBlock, querySpec = ALGOpool.shareArray(
+                    query["tickerDataZScores"][:, [1, 2]].astype(np.float64)
                 )
-            except Exception as e:
-                logging.error(f"Error reading {filePath}: {e}")
-                continue
+                queryBlocks.append(queryBlock)
+                queryTasks.append(self.queryTask(query, querySpec))
+            sharedSpec = pool.acquireShared(self.corpus)
+
+            # Idle workers pull the next chunk as soon as they finish one
+            results = pool.imap(
+                scanTask,
+                [
+                    self.task(
+                        chunk,
+                        files,
+                        queryTasks,
+                        sharedSpec,
+                        progressCounters.spec(),
+                        progressSlot,
+                    )
+                    for progressSlot, chunk in enumerate(chunks)
+                ],
+                self.settings["priority"],
+            )
 
-            # Efficient datetime conversion
-            tickerCache["time"] = tickerCache["datetime"].dt.time
-            tickerCacheTimes = tickerCache["time"].to_numpy()
+            # Progress bar logic for the first phase
+            while True:
+                try:
+                    chunkResults = results.next(timeout=ALGOprogress.updateInterval)
+                    for queryResults, (chunkResult, chunkPruneStats) in zip(
+                        topResults, chunkResults
+                    ):
+                        queryResults.push(*chunkResult)
+                        for key, count in chunkPruneStats.items():
+                            pruneStats[key] += count
+                except mp.TimeoutError:
+                    pass
+                except StopIteration:
+                    break
+                progressReporter.update(*progressCounters.totals())
+            progressReporter.update(*progressCounters.totals(), force=True)
+        finally:
+            # Chunks still waiting would attach to unlinked query blocks
+            if results is not None:
+                results.cancel()
+            pool.releaseShared(sharedSpec)
+            for queryBlock in queryBlocks:
+                queryBlock.close()
+                queryBlock.unlink()
+            progressCounters.close()
+
+        if self.settings["pruning"]:
+            logging.info(
+                f"Pruned {ALGOscan.pruningRate(pruneStats):.1%} of "
+                f"{pruneStats['candidates']} windows for {len(queries)} queries, "
+                f"{pruneStats['paa']} by their PAA lower bound and "
+                f"{pruneStats['fused']} by their float32 distance"
+            )
+        return topResults
 
-            for i in range(
-                len(tickerCache)
-                - self.tickerDataLen
-                - int(self.settings["predictionLen"])
-            ):
-                if (
-                    tickerCacheTimes[i + self.tickerDataLen - 1]
-                    == tickerDataTime.time()
-                ):
-                    # Extract the segment for close and volume
-                    tickerCacheSegmentClose = tickerCache.iloc[
-                        i : i + self.tickerDataLen, 1
-                    ].to_numpy()
-                    tickerCacheSegmentVolume = tickerCache.iloc[
-                        i : i + self.tickerDataLen, 2
-                    ].to_numpy()
+    def listFiles(self):
+        if self.corpus is not None:
+            return self.corpus.files
 
-                    # Compute the z-score for close and volume
-                    closeZScores = (
-                        4 * (tickerCacheSegmentClose - np.mean(tickerCacheSegmentClose))
-                    ) / np.std(tickerCacheSegmentClose)
-                    volumeZScores = (
-                        tickerCacheSegmentVolume - np.mean(tickerCacheSegmentVolume)
-                    ) / np.std(tickerCacheSegmentVolume)
-
-                    # Concatenate the z-scores
-                    segmentZScores = np.column_stack([closeZScores, volumeZScores])
-
-                    distance = np.linalg.norm(
-                        self.settings["tickerDataZScores"][:, [1, 2]] - segmentZScores
-                    )
-                    resultList.append((distance, filePath, i))
+        # Sorted, so fileIds refer to the same files in every batch
+        return sorted(os.listdir(self.tickerDataPath))
+
+    def fetchContinuations(
+        self, pool, files, fileIds, starts, lengths, progressReporter
+    ):
+        """
+        Reads the window and prediction of every match, opening each ticker once.
+
+        Matches are grouped by file. The binary corpus is sliced in place,
+        CSV files are parsed by the pool workers in parallel.
+
+        Args:
+            pool (ALGOpool): The pool that ran the scan.
+            files (list): File names of the corpus.
+            fileIds (NumPy array): File of every match.
+            starts (NumPy array): First row of every match.
+            lengths (NumPy array): Window plus prediction length of every match.
+            progressReporter (ProgressReporter): Counts matches fetched.
+
+        Returns:
+            list: Close prices of every match, in the order of the matches.
+        """
+        matches = {}
+        for position, fileId in enumerate(fileIds):
+            matches.setdefault(int(fileId), []).append(position)
+
+        continuations = [None] * len(fileIds)
+        done = 0
+
+        def collect(fileId, windows):
+            nonlocal done
+            for position, window in zip(matches[fileId], windows):
+                continuations[position] = window
+            done += len(windows)
+            progressReporter.update(done)
+
+        if self.corpus is not None:
+            for fileId, positions in matches.items():
+                close = self.corpus.column(fileId, "close")
+                collect(
+                    fileId,
+                    sliceWindows(close, starts[positions], lengths[positions]),
+                )
+        else:
+            tasks = [
+                {
+                    "filePath": os.path.join(self.tickerDataPath, files[fileId]),
+                    "fileId": fileId,
+                    "starts": starts[positions].tolist(),
+                    "lengths": lengths[positions].tolist(),
+                }
+                for fileId, positions in matches.items()
+            ]
+            for fileId, windows in pool.imap(
+                continuationTask, tasks, self.settings["priority"]
+            ):
+                collect(fileId, windows)
 
-            progressList[processId] += 1
-        return resultList
+        progressReporter.update(done, force=True)
+        return continuations
 
 
 class Backtester:
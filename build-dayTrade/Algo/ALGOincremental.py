@@ -0,0 +1,453 @@
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+from Algo import ALGOscan
+from Algo import ALGOcorpus
+from Algo import ALGOpool
+
+# Setting up logging with detailed formatting
+logging.basicConfig(
+    filename="algoLog.log",
+    level=logging.INFO,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+# Close z-scores are scaled by 4 and volume z-scores by 1, see ALGOscan
+channelScales = (4.0, 1.0)
+
+# Refreshes before the dot products are rebuilt from scratch
+maxRefreshes = 60
+
+# Share of bars (dropped, new or revised) or candidates a refresh may touch
+# before a rebuild is cheaper
+maxChanged = 0.25
+
+# Relative slack on the squared distance when picking windows to re-score
+rescoreSlack = 1e-7
+
+
+def windowDots(column, centre, starts, windowLen, query):
+    """
+    Computes the dot product of the windows beginning at starts with the query.
+
+    Args:
+        column (NumPy array): One column of the ticker.
+        centre (float): Value subtracted from the column, the centre of its
+            prefix sums.
+        starts (NumPy array): Start rows of the windows.
+        windowLen (int): The length of every window.
+        query (NumPy array): One channel of the query z-scores.
+
+    Returns:
+        NumPy array: The dot product of every centred window, aligned with starts.
+    """
+    dots = np.empty(len(starts), dtype=np.float64)
+    if len(starts) == 0:
+        return dots
+
+    windows = np.lib.stride_tricks.sliding_window_view(column, windowLen)
+    chunkSize = max(1, ALGOscan.chunkElements // windowLen)
+    for chunkStart in range(0, len(starts), chunkSize):
+        chunk = slice(chunkStart, chunkStart + chunkSize)
+        dots[chunk] = (windows[starts[chunk]].astype(np.float64) - centre) @ query
+    return dots
+
+
+def gather(column, centre, rows):
+    # Centred values at a 2D array of rows
+    return np.asarray(column[rows], dtype=np.float64) - centre
+
+
+def filePrefixes(corpus, fileId, channels):
+    # Stored prefix sums, or computed like the scan does without them
+    prefixes = corpus.prefixes(fileId)
+    if prefixes is None:
+        prefixes = tuple(ALGOscan.prefixSums(column) for column in channels)
+    return prefixes
+
+
+def candidateStarts(corpus, fileId, minuteOfDay, plan):
+    # Every window of one ticker ending on the anchor minute
+    if plan["useIndex"]:
+        return corpus.anchorStarts(
+            fileId, plan["anchorMinute"], plan["windowLen"], plan["predictionLen"]
+        )
+    return ALGOscan.anchorStarts(
+        minuteOfDay, plan["anchorMinute"], plan["windowLen"], plan["predictionLen"]
+    )
+
+
+def fileDots(corpus, fileId, columns, plan, vectors):
+    """
+    Finds the candidates of one ticker and their dot products with the query.
+
+    Args:
+        corpus (Corpus): The binary corpus.
+        fileId (int): Position of the ticker in the manifest.
+        columns (dict): close, volume and minuteOfDay of the ticker.
+        plan (dict): useIndex, anchorMinute, windowLen and predictionLen.
+        vectors (NumPy array): Close and volume z-scores of the query.
+
+    Returns:
+        tuple: (starts, dots) with one column of dots per channel, or None
+        when the ticker lacks a column.
+    """
+    if not {"close", "volume", "minuteOfDay"} <= set(columns):
+        return None
+
+    channels = (columns["close"], columns["volume"])
+    prefixes = filePrefixes(corpus, fileId, channels)
+    starts = candidateStarts(corpus, fileId, columns["minuteOfDay"], plan)
+    dots = np.column_stack(
+        [
+            windowDots(column, centre, starts, len(vectors), vectors[:, channel])
+            for channel, (column, (centre, _)) in enumerate(zip(channels, prefixes))
+        ]
+    )
+    return starts, dots.reshape(len(starts), 2)
+
+
+def dotsTask(task):
+    """
+    Computes the candidates of a chunk of tickers inside a pool worker.
+
+    Args:
+        task (dict): fingerprint, sharedCorpus, fileIds, plan and vectors,
+            see IncrementalMatcher.poolDots.
+
+    Returns:
+        list: (fileId, starts, dots) of every ticker of the chunk, see fileDots.
+    """
+    corpus = ALGOpool.workerCorpus(task["fingerprint"])
+    ALGOpool.attachShared(task["sharedCorpus"])
+
+    results = []
+    for fileId in task["fileIds"]:
+        result = fileDots(
+            corpus,
+            fileId,
+            ALGOpool.workerColumns(fileId),
+            task["plan"],
+            task["vectors"],
+        )
+        if result is not None:
+            results.append((fileId,) + result)
+    return results
+
+
+class IncrementalMatcher:
+    def __init__(self):
+        """
+        Keeps the candidates of one repeating query between refreshes.
+
+        A refresh of a query whose window slid or grew by a few bars updates
+        the dot product of every candidate window in O(dropped + new bars)
+        instead of rescanning the corpus. Window sums come from the stored
+        prefix sums the scan uses, so only the dot products are kept. The best
+        windows are then re-scored with the same distance as the scan, so
+        results match a full query.
+        """
+        self.key = None
+        self.files = {}
+        self.refreshes = 0
+        self.rebuilds = 0
+
+    def match(self, corpus, useIndex, query, pool=None, priority=0):
+        """
+        Finds the closest windows of a query, reusing the previous candidates.
+
+        Args:
+            corpus (Corpus): The binary corpus to match against.
+            useIndex (bool): Look candidates up in the time of day index.
+            query (dict): tickerDataZScores, predictionLen, dataSize and resultSize.
+            pool (ALGOpool): Workers to rebuild the candidates on, in this
+                process if None.
+            priority (int): Priority of the rebuild on the pool, see ALGOpool.imap.
+
+        Returns:
+            tuple: (distances, fileIds, rows) of the top results, as TopK.result().
+        """
+        startTime = time.perf_counter()
+        times = pd.DatetimeIndex(query["tickerDataZScores"][:, 0]).asi8
+        vectors = query["tickerDataZScores"][:, [1, 2]].astype(np.float64)
+        key = (
+            corpus.fingerprint(),
+            query["dataSize"],
+            query["predictionLen"],
+            query["resultSize"],
+        )
+
+        self.corpus = corpus
+        self.plan = {
+            "useIndex": useIndex,
+            "anchorMinute": ALGOcorpus.anchorMinute(
+                ALGOscan.anchorTimeOfDay(query["tickerDataZScores"][-1, 0])
+            ),
+            "windowLen": len(times),
+            "predictionLen": query["predictionLen"],
+        }
+
+        if self.refresh(key, times, vectors):
+            self.refreshes += 1
+            mode = "Refreshed"
+        else:
+            self.rebuild(key, query["dataSize"], vectors, pool, priority)
+            mode = "Rebuilt"
+        self.times = times
+        self.vectors = vectors
+
+        result = self.topK(vectors, query["resultSize"])
+        logging.info(
+            f"{mode} {sum(len(state['starts']) for state in self.files.values())} "
+            f"candidates in {time.perf_counter() - startTime:.3f}s"
+        )
+        return result
+
+    def rebuild(self, key, dataSize, vectors, pool, priority):
+        self.key = key
+        self.refreshes = 0
+        self.rebuilds += 1
+        self.files = {}
+
+        fileIds = list(range(min(dataSize, len(self.corpus))))
+        if pool is None:
+            results = []
+            for fileId in fileIds:
+                result = fileDots(
+                    self.corpus, fileId, self.corpus.open(fileId), self.plan, vectors
+                )
+                if result is not None:
+                    results.append((fileId,) + result)
+        else:
+            results = self.poolDots(pool, fileIds, vectors, priority)
+
+        # Columns and stored prefix sums stay memory-mapped
+        for fileId, starts, dots in sorted(results, key=lambda result: result[0]):
+            columns = self.corpus.open(fileId)
+            channels = (columns["close"], columns["volume"])
+            self.files[fileId] = {
+                "channels": channels,
+                "prefixes": filePrefixes(self.corpus, fileId, channels),
+                "starts": starts,
+                "dots": dots,
+            }
+
+    def poolDots(self, pool, fileIds, vectors, priority):
+        """
+        Computes the candidates of every ticker on the pool, see dotsTask.
+
+        Returns:
+            list: (fileId, starts, dots) of every ticker with the needed columns.
+        """
+        sizes = [self.corpus.tickers[fileId]["rows"] for fileId in fileIds]
+        chunks = ALGOpool.planChunks(fileIds, sizes, pool.processes)
+
+        results = None
+        sharedSpec = pool.acquireShared(self.corpus)
+        try:
+            results = pool.imap(
+                dotsTask,
+                [
+                    {
+                        "fingerprint": self.corpus.fingerprint(),
+                        "sharedCorpus": sharedSpec,
+                        "fileIds": chunk,
+                        "plan": self.plan,
+                        "vectors": vectors,
+                    }
+                    for chunk in chunks
+                ],
+                priority,
+            )
+            return [
+                fileResult for chunkResults in results for fileResult in chunkResults
+            ]
+        finally:
+            # Chunks still waiting would attach to a released shared corpus
+            if results is not None:
+                results.cancel()
+            pool.releaseShared(sharedSpec)
+
+    def refresh(self, key, times, vectors):
+        """
+        Moves every candidate to the new query window if that is cheaper than
+        a rebuild.
+
+        Returns:
+            bool: False when the candidates have to be rebuilt.
+        """
+        if key != self.key or self.refreshes >= maxRefreshes:
+            return False
+
+        # The new window has to continue the old one: drop bars at the front,
+        # keep the rest and add new bars at the back
+        oldTimes = self.times
+        drop = int(np.searchsorted(oldTimes, times[0]))
+        overlap = len(oldTimes) - drop
+        added = len(times) - overlap
+        if (
+            drop >= len(oldTimes)
+            or oldTimes[drop] != times[0]
+            or added < 0
+            or overlap < 3
+            or not np.array_equal(oldTimes[drop:], times[:overlap])
+        ):
+            return False
+
+        # Both z-scores are affine in the same prices, q' = alpha * q + beta.
+        # The last old bar may have been revised, so it is left out of the fit
+        # and corrected like every other bar that does not follow the map
+        oldOverlap = self.vectors[drop:]
+        newOverlap = vectors[:overlap]
+        oldStd = oldOverlap[:-1].std(axis=0)
+        if not np.all(oldStd > 0):
+            return False
+        alpha = newOverlap[:-1].std(axis=0) / oldStd
+        beta = newOverlap[:-1].mean(axis=0) - alpha * oldOverlap[:-1].mean(axis=0)
+        residual = newOverlap - (alpha * oldOverlap + beta)
+        revised = [
+            np.flatnonzero(np.abs(residual[:, channel]) > 1e-9) for channel in range(2)
+        ]
+
+        touched = drop + added + max(len(rows) for rows in revised)
+        if touched > maxChanged * len(times):
+            return False
+
+        dropRange = np.arange(drop)
+        addRange = np.arange(added)
+        candidates = 0
+        rebuilt = 0
+        files = {}
+        for fileId, state in self.files.items():
+            oldStarts = state["starts"]
+            starts = candidateStarts(
+                self.corpus,
+                fileId,
+                self.corpus.column(fileId, "minuteOfDay"),
+                self.plan,
+            )
+            moved = oldStarts + drop
+            kept = np.isin(moved, starts)
+            fresh = starts[~np.isin(starts, moved)]
+            keptStarts = oldStarts[kept]
+            candidates += len(starts)
+            rebuilt += len(fresh)
+
+            dots = []
+            for channel, (column, (centre, sums)) in enumerate(
+                zip(state["channels"], state["prefixes"])
+            ):
+                query = self.vectors[:, channel]
+
+                # Take the dropped bars out of the old window
+                dropped = gather(column, centre, keptStarts[:, None] + dropRange)
+                dot = state["dots"][kept, channel] - dropped @ query[:drop]
+
+                # Map the overlap into the new query and fix revised bars
+                overlapSum = (
+                    sums[keptStarts + len(oldTimes), 0] - sums[keptStarts + drop, 0]
+                )
+                dot = alpha[channel] * dot + beta[channel] * overlapSum
+                rows = revised[channel]
+                if len(rows):
+                    values = gather(column, centre, keptStarts[:, None] + drop + rows)
+                    dot += values @ residual[rows, channel]
+
+                # Add the new bars
+                if added:
+                    values = gather(
+                        column, centre, keptStarts[:, None] + len(oldTimes) + addRange
+                    )
+                    dot += values @ vectors[overlap:, channel]
+
+                freshDots = windowDots(
+                    column, centre, fresh, len(times), vectors[:, channel]
+                )
+                dots.append(np.concatenate((dot, freshDots)))
+
+            # Keep candidates sorted by start row
+            allStarts = np.concatenate((moved[kept], fresh))
+            order = np.argsort(allStarts, kind="stable")
+            files[fileId] = dict(
+                state,
+                starts=allStarts[order],
+                dots=np.column_stack(dots)[order].reshape(len(allStarts), 2),
+            )
+
+        # Too many windows had to be summed from scratch, e.g. the anchor moved
+        # onto a different trading session
+        if rebuilt > maxChanged * max(candidates, 1):
+            return False
+        self.files = files
+        return True
+
+    def distances(self, state, vectors):
+        # Squared distance of every candidate from its dot products and the
+        # prefix sums, the same value ALGOscan.statDistances computes up to
+        # rounding. Flat windows are found exactly like ALGOscan.rollingStats
+        windowLen = len(vectors)
+        starts = state["starts"]
+        squared = np.zeros(len(starts), dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for channel, scale in enumerate(channelScales):
+                _, sums = state["prefixes"][channel]
+                total = sums[starts + windowLen, 0] - sums[starts, 0]
+                totalSq = sums[starts + windowLen, 1] - sums[starts, 1]
+                dot = state["dots"][:, channel]
+                query = vectors[:, channel]
+
+                centredMean = total / windowLen
+                variance = np.maximum(
+                    totalSq / windowLen - centredMean * centredMean, 0.0
+                )
+                stds = np.sqrt(variance)
+                flat = variance <= np.finfo(np.float64).eps * (totalSq / windowLen)
+
+                squared += (
+                    query @ query
+                    - 2 * scale / stds * (dot - centredMean * query.sum())
+                    + scale * scale * windowLen
+                )
+
+                # Flat windows have no z-score
+                squared[flat] = np.nan
+        return squared
+
+    def topK(self, vectors, resultSize):
+        """
+        Re-scores every candidate that could be in the top results with the
+        scan's own distance and returns the top results.
+        """
+        # Flat windows score inf in the scan too, which keeps them while it
+        # has fewer than resultSize windows
+        squared = {}
+        for fileId, state in self.files.items():
+            distances = self.distances(state, vectors)
+            squared[fileId] = np.where(np.isnan(distances), np.inf, distances)
+        everything = np.concatenate([np.empty(0)] + list(squared.values()))
+
+        # Anything within rounding of the k-th best might still beat it
+        threshold = np.inf
+        if len(everything) > resultSize:
+            kth = np.partition(everything, resultSize - 1)[resultSize - 1]
+            scale = sum(
+                vectors[:, channel] @ vectors[:, channel]
+                + channelScales[channel] ** 2 * len(vectors)
+                for channel in range(2)
+            )
+            threshold = kth + rescoreSlack * scale
+
+        topResults = ALGOscan.TopK(resultSize)
+        for fileId, state in self.files.items():
+            starts = state["starts"][squared[fileId] <= threshold]
+            close, volume = state["channels"]
+            topResults.push(
+                ALGOscan.zScoreDistances(
+                    close, volume, starts, vectors, state["prefixes"]
+                ),
+                fileId,
+                starts,
+            )
+        return topResults.result()
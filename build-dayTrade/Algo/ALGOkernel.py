@@ -0,0 +1,179 @@
+import time
+import logging
+import numpy as np
+
+from Algo import ALGOscan
+
+# Numba is optional, without it ALGOdt4 stays on the vectorised NumPy path
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Setting up logging with detailed formatting
+logging.basicConfig(
+    filename="algoLog.log",
+    level=logging.INFO,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+
+def abandonScan(close, volume, starts, query, stats, threshold, k, slack):
+    """
+    Scores the windows of one file point by point with early abandoning.
+
+    A window is abandoned as soon as its running sum passes the k-th best
+    squared distance seen so far, counting the k windows already better than
+    threshold. Written as plain loops so numba can compile it.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        volume (NumPy array): Volume column of the ticker file.
+        starts (NumPy array): Start rows of the candidate windows.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        stats (NumPy array): windowStats of the candidates, shape (4, len(starts)).
+        threshold (float): Squared distance of the current k-th best window.
+        k (int): The number of windows kept.
+        slack (float): Relative slack on the abandoning limit.
+
+    Returns:
+        NumPy array: Squared distances, inf for abandoned and NaN for flat windows.
+    """
+    windowLen = query.shape[0]
+    distances = np.full(len(starts), np.inf)
+
+    # Bounded top-k of squared distances, worst is its largest entry
+    best = np.full(k, threshold)
+    worst = threshold
+
+    for i in range(len(starts)):
+        start = starts[i]
+        closeMean = stats[0, i]
+        closeStd = stats[1, i]
+        volumeMean = stats[2, i]
+        volumeStd = stats[3, i]
+        if not (closeStd > 0 and volumeStd > 0):
+            distances[i] = np.nan
+            continue
+
+        limit = worst * (1 + slack)
+        total = 0.0
+        for j in range(windowLen):
+            closeDiff = query[j, 0] - 4 * (close[start + j] - closeMean) / closeStd
+            volumeDiff = query[j, 1] - (volume[start + j] - volumeMean) / volumeStd
+            total += closeDiff * closeDiff + volumeDiff * volumeDiff
+            if total > limit:
+                break
+
+        if total > limit:
+            continue
+        distances[i] = total
+
+        if total < worst:
+            largest = 0
+            for j in range(1, k):
+                if best[j] > best[largest]:
+                    largest = j
+            best[largest] = total
+
+            worst = best[0]
+            for j in range(1, k):
+                if best[j] > worst:
+                    worst = best[j]
+
+    return distances
+
+
+available = numba is not None
+if available:
+    compiledScan = numba.njit(cache=True, nogil=True)(abandonScan)
+else:
+    compiledScan = abandonScan
+
+
+def warmUp():
+    """
+    Compiles the kernel for float32 corpus and float64 CSV columns.
+
+    Returns:
+        float: Seconds spent compiling, or loading the compiled kernel from
+        the numba cache, 0 without numba.
+    """
+    if not available:
+        return 0.0
+
+    startTime = time.perf_counter()
+    query = np.zeros((2, 2), dtype=np.float64)
+    stats = np.ones((4, 1), dtype=np.float64)
+    starts = np.zeros(1, dtype=np.int64)
+    for dtype in (np.float32, np.float64):
+        column = np.arange(2, dtype=dtype)
+        compiledScan(column, column, starts, query, stats, np.inf, 1, 0.0)
+
+    compileTime = time.perf_counter() - startTime
+    logging.info(f"Compiled scan kernel in {compileTime:.2f}s")
+    return compileTime
+
+
+def kernelTopK(
+    close, volume, starts, query, topResults, fileId, pruneStats, prefixes=None
+):
+    """
+    Pushes the windows of one file into topResults through the compiled kernel.
+
+    After the PAA lower bound, abandonScan rejects windows that cannot reach
+    the k-th best. Its sums are added in a different order than statDistances,
+    so the windows within slack of the k-th best are re-scored with
+    statDistances and results are identical to prunedTopK.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        volume (NumPy array): Volume column of the ticker file.
+        starts (NumPy array): Start rows of the candidate windows.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        topResults (TopK): The running top-k of the worker.
+        fileId (int): The file the candidates belong to.
+        pruneStats (dict): Counters updated in place, see ALGOscan.newPruneStats.
+        prefixes (tuple): prefixSums of close and volume, or None.
+    """
+    if len(starts) == 0:
+        return
+
+    pruneStats["candidates"] += len(starts)
+    stats = ALGOscan.windowStats(close, volume, starts, len(query), prefixes)
+    limit = topResults.threshold**2 * (1 + ALGOscan.pruneSlack)
+
+    alive = np.arange(len(starts))
+    if prefixes is not None and np.isfinite(limit):
+        lowerBounds = ALGOscan.paaLowerBounds(prefixes, starts, query, stats)
+        alive = np.flatnonzero(~(lowerBounds * (1 - ALGOscan.paaSlack) > limit))
+        pruneStats["paa"] += len(starts) - len(alive)
+
+    # Plain ndarray views of memory-mapped or shared columns
+    squared = compiledScan(
+        np.asarray(close),
+        np.asarray(volume),
+        starts[alive],
+        np.ascontiguousarray(query, dtype=np.float64),
+        np.stack([stat[alive] for stat in stats]),
+        topResults.threshold**2,
+        topResults.k,
+        ALGOscan.pruneSlack,
+    )
+
+    # Windows the kernel finished, cut to the k-th best of this file
+    finished = squared[np.isfinite(squared)]
+    if len(finished) >= topResults.k:
+        limit = min(limit, np.partition(finished, topResults.k - 1)[topResults.k - 1])
+    keep = squared <= limit * (1 + ALGOscan.pruneSlack)
+    pruneStats["abandoned"] += len(alive) - int(keep.sum())
+    pruneStats["scored"] += int(keep.sum())
+
+    alive = alive[keep]
+    topResults.push(
+        ALGOscan.statDistances(
+            close, volume, starts[alive], query, tuple(stat[alive] for stat in stats)
+        ),
+        fileId,
+        starts[alive],
+    )
@@ -0,0 +1,548 @@
+import os
+import time
+import heapq
+import queue
+import logging
+import itertools
+import threading
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+
+from Algo import ALGOcorpus
+from Algo import ALGOkernel
+
+# Setting up logging with detailed formatting
+logging.basicConfig(
+    filename="algoLog.log",
+    level=logging.INFO,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+# Per-process state of a warm worker, filled in by initWorker
+workerState = {}
+
+# Columns a shared corpus keeps in memory for the ALGOdt4 scan
+sharedColumns = ("close", "volume", "minuteOfDay")
+
+# Chunks planned per worker, so fast workers can pull more of them
+chunksPerProcess = 4
+
+# Batches a worker keeps the running top-ks of, one per lane scanning at once
+# with room for a batch still finishing
+maxWorkerBatches = 4
+
+
+def planChunks(fileIds, sizes, processes):
+    """
+    Splits files into chunks of roughly equal work for the pool to hand out.
+
+    Files are taken largest first, so big tickers start early and the last
+    chunks left for idle workers are small.
+
+    Args:
+        fileIds (list): The files the query scans, each exactly once.
+        sizes (list): Row count (or any size estimate) of every file.
+        processes (int): Number of workers in the pool.
+
+    Returns:
+        list: Lists of file ids, one per chunk.
+    """
+    sizes = np.asarray(sizes, dtype=np.float64)
+    target = sizes.sum() / (processes * chunksPerProcess)
+
+    chunks = []
+    chunk = []
+    chunkSize = 0.0
+    for position in np.argsort(-sizes, kind="stable"):
+        chunk.append(fileIds[position])
+        chunkSize += sizes[position]
+        if chunkSize >= target:
+            chunks.append(chunk)
+            chunk = []
+            chunkSize = 0.0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def initWorker(tickerDataPath, sharedSpec=None):
+    """
+    Runs once in every worker process when the pool starts.
+
+    Args:
+        tickerDataPath (str): Directory of the CSV corpus the worker scans.
+        sharedSpec (dict): SharedCorpus.spec() to attach to, if any.
+    """
+    workerState["tickerDataPath"] = tickerDataPath
+    workerState["tickerBinPath"] = ALGOcorpus.corpusPath(tickerDataPath)
+    workerState["shared"] = None
+    workerState["sharedBlocks"] = []
+    workerState["topK"] = {}
+    loadCorpus()
+    attachShared(sharedSpec)
+
+    # Compile the scan kernel now instead of during the first query
+    workerState["compileTime"] = ALGOkernel.warmUp()
+
+
+def loadCorpus():
+    # (Re)open the binary corpus and forget every column mapped so far
+    workerState["corpus"] = None
+    workerState["fingerprint"] = None
+    workerState["columns"] = {}
+
+    if ALGOcorpus.Corpus.exists(workerState["tickerBinPath"]):
+        corpus = ALGOcorpus.Corpus(workerState["tickerBinPath"])
+        workerState["corpus"] = corpus
+        workerState["fingerprint"] = corpus.fingerprint()
+
+
+def workerCorpus(fingerprint):
+    """
+    Returns the worker's corpus, reloading it if the parent sees a newer one.
+
+    Args:
+        fingerprint (str): Corpus.fingerprint() of the corpus the parent planned on.
+
+    Returns:
+        Corpus: The corpus, or None when no binary corpus exists.
+    """
+    if fingerprint != workerState["fingerprint"]:
+        loadCorpus()
+    return workerState["corpus"]
+
+
+def workerTopK(batchId, queryId, createTopK):
+    """
+    Returns the running top-k this worker keeps for one query across chunks.
+
+    Its threshold lets later chunks prune against everything the worker has
+    already seen for the query. Every query of the last maxWorkerBatches
+    batches keeps its top-k, however many queries a watchlist batch holds.
+
+    Args:
+        batchId (str): Identifies the batch the chunk belongs to.
+        queryId (str): Identifies the query within the batch.
+        createTopK (callable): Builds an empty top-k for a new query.
+    """
+    batches = workerState["topK"]
+    if batchId not in batches:
+        if len(batches) >= maxWorkerBatches:
+            del batches[next(iter(batches))]
+        batches[batchId] = {}
+
+    batch = batches[batchId]
+    if queryId not in batch:
+        batch[queryId] = createTopK()
+    return batch[queryId]
+
+
+def attachShared(spec):
+    """
+    Attaches the worker to the shared corpus described by spec, zero-copy.
+
+    Args:
+        spec (dict): SharedCorpus.spec() of the parent, or None.
+    """
+    if spec is None or (
+        workerState["shared"] is not None and workerState["shared"]["id"] == spec["id"]
+    ):
+        return
+
+    detachShared()
+    views = {}
+    for name in sharedColumns:
+        block = shared_memory.SharedMemory(name=spec["blocks"][name])
+        workerState["sharedBlocks"].append(block)
+        views[name] = np.ndarray(
+            (spec["totalRows"],), dtype=spec["dtypes"][name], buffer=block.buf
+        )
+
+    workerState["shared"] = {"id": spec["id"], "offsets": spec["offsets"]}
+    workerState["shared"]["views"] = views
+
+
+def detachShared():
+    # Views have to go before the blocks can be closed
+    workerState["shared"] = None
+    for block in workerState["sharedBlocks"]:
+        block.close()
+    workerState["sharedBlocks"] = []
+
+
+def workerColumns(fileId):
+    """
+    Returns the columns of one ticker, from shared memory when it was loaded
+    there and memory-mapped once per worker otherwise.
+    """
+    shared = workerState["shared"]
+    if shared is not None and shared["offsets"][fileId, 1] >= 0:
+        start, rows = shared["offsets"][fileId]
+        return {
+            name: view[start : start + rows] for name, view in shared["views"].items()
+        }
+
+    if fileId not in workerState["columns"]:
+        workerState["columns"][fileId] = workerState["corpus"].open(fileId)
+    return workerState["columns"][fileId]
+
+
+def attachArray(spec):
+    """
+    Attaches to an array the parent put in shared memory with shareArray.
+
+    Returns:
+        tuple: (block, array). Delete the array before closing the block.
+    """
+    block = shared_memory.SharedMemory(name=spec["name"])
+    array = np.ndarray(spec["shape"], dtype=spec["dtype"], buffer=block.buf)
+    return block, array
+
+
+def shareArray(array):
+    """
+    Copies an array into a new shared memory block.
+
+    Returns:
+        tuple: (block, spec). The caller unlinks the block when it is done.
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    spec = {"name": block.name, "shape": array.shape, "dtype": array.dtype.str}
+    return block, spec
+
+
+class SharedCorpus:
+    def __init__(self, corpus, budget=None):
+        """
+        Loads the scan columns of a corpus into shared memory blocks.
+
+        Every column of every ticker goes into one block per column, so all
+        workers read the same pages instead of each holding a copy.
+
+        Args:
+            corpus (Corpus): The binary corpus to load.
+            budget (int): Maximum bytes to load, remaining tickers stay memory-mapped.
+        """
+        self.fingerprint = corpus.fingerprint()
+        self.dtypes = {
+            name: np.dtype(corpus.manifest["dtypes"][name]).str
+            for name in sharedColumns
+        }
+        rowBytes = sum(np.dtype(dtype).itemsize for dtype in self.dtypes.values())
+
+        # Tickers that do not fit the budget keep offset -1
+        self.offsets = np.full((len(corpus), 2), -1, dtype=np.int64)
+        totalRows = 0
+        for fileId, ticker in enumerate(corpus.tickers):
+            if not set(sharedColumns) <= set(ticker["columns"]):
+                continue
+            if budget is not None and (totalRows + ticker["rows"]) * rowBytes > budget:
+                break
+            self.offsets[fileId] = (totalRows, ticker["rows"])
+            totalRows += ticker["rows"]
+        self.totalRows = totalRows
+
+        self.blocks = {}
+        for name in sharedColumns:
+            block = shared_memory.SharedMemory(
+                create=True,
+                size=max(totalRows * np.dtype(self.dtypes[name]).itemsize, 1),
+            )
+            self.blocks[name] = block
+            view = np.ndarray((totalRows,), dtype=self.dtypes[name], buffer=block.buf)
+            for fileId, (start, rows) in enumerate(self.offsets):
+                if rows > 0:
+                    view[start : start + rows] = corpus.column(fileId, name)
+            del view
+
+        logging.info(
+            f"Loaded {totalRows} rows of {len(corpus)} tickers into shared memory"
+        )
+
+    def spec(self):
+        # What a worker needs to attach, small enough to send with every task
+        return {
+            "id": self.blocks["close"].name,
+            "blocks": {name: block.name for name, block in self.blocks.items()},
+            "dtypes": self.dtypes,
+            "offsets": self.offsets,
+            "totalRows": self.totalRows,
+        }
+
+    def close(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+
+class PriorityResults:
+    def __init__(self, count):
+        """
+        Results of the chunks of one PriorityDispatcher.imap call, iterated
+        like multiprocessing's imap_unordered.
+
+        Args:
+            count (int): The number of chunks submitted.
+        """
+        self.remaining = count
+        self.queue = queue.Queue()
+        self.cancelled = False
+
+    def put(self, failed, value):
+        self.queue.put((failed, value))
+
+    def next(self, timeout=None):
+        """
+        Waits for the next finished chunk.
+
+        Raises:
+            StopIteration: Once every chunk was returned.
+            multiprocessing.TimeoutError: When no chunk finished in time.
+        """
+        if self.remaining == 0:
+            raise StopIteration
+        try:
+            failed, value = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            raise mp.TimeoutError
+        self.remaining -= 1
+        if failed:
+            raise value
+        return value
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+    def cancel(self):
+        # Chunks not handed to a worker yet are dropped
+        self.cancelled = True
+
+
+class PriorityDispatcher:
+    def __init__(self, pool, slots):
+        """
+        Hands chunks of concurrent batches to the pool, most urgent first.
+
+        At most slots chunks are in the pool at a time, the rest wait here.
+        A batch submitted with a higher priority therefore starts as soon as
+        a worker finishes its current chunk, ahead of the chunks of batches
+        already running.
+
+        Args:
+            pool (multiprocessing.Pool): The worker pool.
+            slots (int): Chunks handed to the pool at once, one per worker.
+        """
+        self.pool = pool
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.waiting = []
+        self.running = 0
+        self.sequence = itertools.count()
+
+    def imap(self, func, tasks, priority=0):
+        """
+        Queues one chunk per task.
+
+        Args:
+            func (function): Runs a task in a worker.
+            tasks (list): The tasks of the batch.
+            priority (int): Lower runs first, equal priorities in order.
+
+        Returns:
+            PriorityResults: The results as chunks finish.
+        """
+        results = PriorityResults(len(tasks))
+        with self.lock:
+            for task in tasks:
+                heapq.heappush(
+                    self.waiting, (priority, next(self.sequence), func, task, results)
+                )
+        self.dispatch()
+        return results
+
+    def dispatch(self):
+        with self.lock:
+            while self.running < self.slots and self.waiting:
+                _, _, func, task, results = heapq.heappop(self.waiting)
+                if results.cancelled:
+                    continue
+                self.running += 1
+                self.pool.apply_async(
+                    func,
+                    (task,),
+                    callback=lambda value, results=results: self.finished(
+                        results, False, value
+                    ),
+                    error_callback=lambda error, results=results: self.finished(
+                        results, True, error
+                    ),
+                )
+
+    def finished(self, results, failed, value):
+        # Runs in the pool's result thread, the freed slot takes the next chunk
+        with self.lock:
+            self.running -= 1
+        results.put(failed, value)
+        self.dispatch()
+
+
+def ping(_):
+    return os.getpid(), workerState["compileTime"]
+
+
+class ALGOpool:
+    def __init__(
+        self, tickerDataPath, processes=None, sharedCorpus=True, sharedBytes=None
+    ):
+        """
+        Starts a pool of worker processes that stays up between ALGOqueries.
+
+        Workers import numpy/pandas and open the corpus once, so every query only
+        ships its query vector and parameters.
+
+        Args:
+            tickerDataPath (str): Directory of the CSV corpus the workers scan.
+            processes (int): Number of workers, defaults to the number of cores.
+            sharedCorpus (bool): Load the binary corpus into shared memory.
+            sharedBytes (int): Memory budget of the shared corpus, unlimited if None.
+        """
+        self.tickerDataPath = tickerDataPath
+        self.processes = processes or mp.cpu_count()
+        self.sharedCorpus = sharedCorpus
+        self.sharedBytes = sharedBytes
+        self.shared = None
+        self.lock = threading.RLock()
+
+        # Batches still running on each shared corpus by its id, and the
+        # corpora a newer one replaced that such batches still read
+        self.sharedUsers = {}
+        self.retiredShared = {}
+
+        startTime = time.perf_counter()
+
+        # Workers must share this process' tracker, one of their own would
+        # unlink blocks the parent still owns when the worker exits
+        resource_tracker.ensure_running()
+
+        # Load the shared corpus first so workers attach while starting up
+        tickerBinPath = ALGOcorpus.corpusPath(tickerDataPath)
+        corpus = None
+        if ALGOcorpus.Corpus.exists(tickerBinPath):
+            corpus = ALGOcorpus.Corpus(tickerBinPath)
+
+        self.pool = mp.Pool(
+            processes=self.processes,
+            initializer=initWorker,
+            initargs=(tickerDataPath, self.sharedSpec(corpus)),
+        )
+
+        # Wait until every worker is up so the startup cost is paid here
+        workers = self.pool.map(ping, range(self.processes), chunksize=1)
+        self.startupTime = time.perf_counter() - startTime
+        self.compileTime = max(compileTime for _, compileTime in workers)
+
+        # Concurrent batches share the workers chunk by chunk
+        self.dispatcher = PriorityDispatcher(self.pool, self.processes)
+
+        self.queries = 0
+        logging.info(
+            f"Started {self.processes} ALGO workers in {self.startupTime:.2f}s, "
+            f"{self.compileTime:.2f}s of it compiling the scan kernel"
+        )
+
+    def imap(self, func, tasks, priority=0):
+        """
+        Runs tasks on the workers like imap_unordered, ahead of the waiting
+        chunks of batches with a lower priority, see PriorityDispatcher.
+        """
+        return self.dispatcher.imap(func, tasks, priority)
+
+    def reused(self):
+        """
+        Records a query served by the warm pool.
+
+        Returns:
+            float: The startup time the query did not have to pay.
+        """
+        with self.lock:
+            self.queries += 1
+        logging.info(
+            f"Query {self.queries} on warm pool saved {self.startupTime:.2f}s "
+            f"({self.queries * self.startupTime:.2f}s in total)"
+        )
+        return self.startupTime
+
+    def sharedSpec(self, corpus):
+        """
+        Returns the shared corpus spec, reloading it when the corpus changed
+        since it was loaded.
+
+        The shared corpus it replaces is closed once no batch that acquired
+        it is running anymore, their chunks may still attach to it.
+
+        Args:
+            corpus (Corpus): The corpus the query runs on, or None.
+
+        Returns:
+            dict: SharedCorpus.spec(), or None when nothing is shared.
+        """
+        if not self.sharedCorpus or corpus is None:
+            return None
+
+        with self.lock:
+            if self.shared is None or self.shared.fingerprint != corpus.fingerprint():
+                if self.shared is not None:
+                    self.retireShared(self.shared)
+                self.shared = SharedCorpus(corpus, self.sharedBytes)
+            return self.shared.spec()
+
+    def acquireShared(self, corpus):
+        """
+        Returns the shared corpus spec for one batch, see sharedSpec. The
+        batch hands it back with releaseShared when its chunks are done.
+        """
+        with self.lock:
+            spec = self.sharedSpec(corpus)
+            if spec is not None:
+                self.sharedUsers[spec["id"]] = self.sharedUsers.get(spec["id"], 0) + 1
+            return spec
+
+    def releaseShared(self, spec):
+        if spec is None:
+            return
+        with self.lock:
+            self.sharedUsers[spec["id"]] -= 1
+            if self.sharedUsers[spec["id"]] == 0:
+                del self.sharedUsers[spec["id"]]
+                if spec["id"] in self.retiredShared:
+                    self.retiredShared.pop(spec["id"]).close()
+
+    def retireShared(self, shared):
+        # Closed now when no batch reads it, else by the last releaseShared
+        sharedId = shared.spec()["id"]
+        if self.sharedUsers.get(sharedId, 0) > 0:
+            self.retiredShared[sharedId] = shared
+        else:
+            shared.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        if self.shared is not None:
+            self.shared.close()
+        for shared in self.retiredShared.values():
+            shared.close()
+        self.retiredShared = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
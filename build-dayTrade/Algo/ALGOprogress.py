@@ -0,0 +1,119 @@
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+# Columns of the counter array, one row per slot
+counterColumns = ("files", "rows")
+
+# Seconds between two progress messages
+updateInterval = 0.1
+
+
+def attachCounters(spec):
+    """
+    Attaches a worker to the counters the parent created with ProgressCounters.
+
+    Every slot is written by one worker only, so increments need no lock.
+
+    Args:
+        spec (dict): ProgressCounters.spec() of the parent.
+
+    Returns:
+        tuple: (block, counters). Delete the counters before closing the block.
+    """
+    block = shared_memory.SharedMemory(name=spec["name"])
+    counters = np.ndarray(spec["shape"], dtype=np.int64, buffer=block.buf)
+    return block, counters
+
+
+def progressFraction(progress):
+    # Messages are either a plain fraction or a ProgressReporter dict
+    if isinstance(progress, dict):
+        return progress["fraction"]
+    return progress
+
+
+class ProgressCounters:
+    def __init__(self, slots):
+        """
+        Creates a zeroed array of counters in shared memory.
+
+        Args:
+            slots (int): Number of independent writers, e.g. one per task.
+        """
+        shape = (max(slots, 1), len(counterColumns))
+        self.block = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(shape)) * 8
+        )
+        self.counters = np.ndarray(shape, dtype=np.int64, buffer=self.block.buf)
+        self.counters[...] = 0
+
+    def spec(self):
+        return {"name": self.block.name, "shape": self.counters.shape}
+
+    def totals(self):
+        """Returns (files, rows) summed over every slot."""
+        files, rows = self.counters.sum(axis=0)
+        return int(files), int(rows)
+
+    def close(self):
+        del self.counters
+        self.block.close()
+        self.block.unlink()
+
+
+class ProgressReporter:
+    def __init__(self, progressQueue, totalFiles, totalRows=None, phase=1):
+        """
+        Turns counter totals into progress messages, at most one per updateInterval.
+
+        Messages are dicts with phase, fraction, filesDone, totalFiles,
+        rowsScanned and eta (seconds left, None until something is done).
+
+        Args:
+            progressQueue (Queue): Where the messages go.
+            totalFiles (int): Files the phase covers.
+            totalRows (int): Rows the phase covers, if known up front.
+            phase (int): 1 for the scan, 2 for the continuations.
+        """
+        self.progressQueue = progressQueue
+        self.totalFiles = max(totalFiles, 1)
+        self.totalRows = totalRows
+        self.phase = phase
+        self.startTime = time.perf_counter()
+        self.lastUpdate = None
+        self.lastTotals = None
+
+    def update(self, files, rows=0, force=False):
+        """
+        Puts a message on the queue if the totals changed and the last
+        message is older than updateInterval, or always when force is set.
+        """
+        now = time.perf_counter()
+        if not force and (
+            (files, rows) == self.lastTotals
+            or (self.lastUpdate is not None and now - self.lastUpdate < updateInterval)
+        ):
+            return
+
+        # Rows give a smoother fraction than files when the total is known
+        if self.totalRows:
+            fraction = min(rows / self.totalRows, 1.0)
+        else:
+            fraction = min(files / self.totalFiles, 1.0)
+
+        elapsed = now - self.startTime
+        eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+
+        self.progressQueue.put(
+            {
+                "phase": self.phase,
+                "fraction": fraction,
+                "filesDone": files,
+                "totalFiles": self.totalFiles,
+                "rowsScanned": rows,
+                "eta": eta,
+            }
+        )
+        self.lastUpdate = now
+        self.lastTotals = (files, rows)
@@ -0,0 +1,886 @@
+import numpy as np
+import pandas as pd
+
+# Upper bound on the number of values gathered into one candidate block
+chunkElements = 2**22
+
+# Candidates per pruning step, query points added per early-abandon step, and
+# relative slack on the pruning threshold
+pruneChunk = 256
+pruneBlock = 64
+pruneSlack = 1e-9
+
+# PAA segments per channel of the lower-bound prefilter, and relative slack on
+# the bound since it is summed in a different order than the exact distance
+paaSegments = 32
+paaSlack = 1e-6
+
+# ALGOdt3 bounds every row of a file, so fewer segments keep that pass cheap,
+# and absolute slack on that bound relative to the query norm, its rounding
+# does not shrink with the distance of a near-exact match
+ratioSegments = 16
+ratioSlack = 1e-12
+
+# Error of a squared ratioProfile distance relative to the squared norms it
+# cancels, the FFT rounds every sliding dot product a little differently
+profileTolerance = 1e-12
+
+# Values gathered per fused float32 step, small enough to stay in cache, and
+# the unit roundoff of float32
+fusedElements = 2**16
+float32Roundoff = 2.0**-24
+
+
+def timeOfDay(datetimes):
+    """
+    Converts a column of datetimes into microseconds since midnight.
+
+    Args:
+        datetimes (Series): The datetime column of a ticker file.
+
+    Returns:
+        NumPy array: int64 time of day for every row.
+    """
+    datetimes = pd.to_datetime(datetimes)
+    sinceMidnight = datetimes - datetimes.dt.normalize()
+    return sinceMidnight.to_numpy().astype("timedelta64[us]").astype(np.int64)
+
+
+def anchorTimeOfDay(tickerDataTime):
+    """
+    Converts the last timestamp of a query into microseconds since midnight.
+
+    Args:
+        tickerDataTime (Timestamp): The time of the last row of the query.
+
+    Returns:
+        int: The time of day every matching window has to end on.
+    """
+    anchorTime = pd.Timestamp(tickerDataTime).time()
+    return (
+        (anchorTime.hour * 60 + anchorTime.minute) * 60 + anchorTime.second
+    ) * 1000000 + anchorTime.microsecond
+
+
+def anchorStarts(times, anchorTime, windowLen, predictionLen):
+    """
+    Finds every window start whose last row falls on the query's time of day.
+
+    Args:
+        times (NumPy array): Time of day of every row in the file.
+        anchorTime (int): Time of day of the last row of the query.
+        windowLen (int): The length of the query.
+        predictionLen (int): The number of rows required after each window.
+
+    Returns:
+        NumPy array: Sorted start rows of the candidate windows.
+    """
+    stop = len(times) - windowLen - int(predictionLen)
+    if stop <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    return np.flatnonzero(times[windowLen - 1 : windowLen - 1 + stop] == anchorTime)
+
+
+def prefixSums(values):
+    """
+    Computes the cumulative sums of a column centred on its overall mean.
+
+    Centring keeps the cancellation in E[x^2] - E[x]^2 small for volume. The
+    corpus stores these next to its columns, see ALGOcorpus.buildIndex.
+
+    Args:
+        values (NumPy array): One column of the ticker file.
+
+    Returns:
+        tuple: (centre, sums) where sums[i] holds the sum and the sum of
+        squares of the first i centred values, shape (len(values) + 1, 2).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    centre = values.mean() if len(values) else 0.0
+    centred = values - centre
+
+    sums = np.zeros((len(values) + 1, 2), dtype=np.float64)
+    sums[1:, 0] = np.cumsum(centred)
+    sums[1:, 1] = np.cumsum(centred * centred)
+    return centre, sums
+
+
+def rollingStats(values, starts, windowLen, prefix=None):
+    """
+    Computes the mean and population std of the windows beginning at starts.
+
+    Args:
+        values (NumPy array): One column of the ticker file.
+        starts (NumPy array): Start rows of the windows.
+        windowLen (int): The length of every window.
+        prefix (tuple): prefixSums of values, computed here if None.
+
+    Returns:
+        tuple: (means, stds) as float64 arrays aligned with starts.
+    """
+    centre, sums = prefixSums(values) if prefix is None else prefix
+
+    windowSum = sums[starts + windowLen, 0] - sums[starts, 0]
+    windowSumSq = sums[starts + windowLen, 1] - sums[starts, 1]
+
+    centredMean = windowSum / windowLen
+    variance = np.maximum(windowSumSq / windowLen - centredMean * centredMean, 0.0)
+    stds = np.sqrt(variance)
+
+    # Windows that are flat within rounding have no defined z-score
+    means = centredMean + centre
+    stds[variance <= np.finfo(np.float64).eps * (windowSumSq / windowLen)] = 0.0
+    return means, stds
+
+
+def windowStats(close, volume, starts, windowLen, prefixes=None):
+    """
+    Computes the rolling mean and std of both channels for every candidate.
+
+    Args:
+        prefixes (tuple): prefixSums of close and volume, or None.
+
+    Returns:
+        tuple: (closeMeans, closeStds, volumeMeans, volumeStds) aligned with starts.
+    """
+    closePrefix, volumePrefix = prefixes or (None, None)
+    return rollingStats(close, starts, windowLen, closePrefix) + rollingStats(
+        volume, starts, windowLen, volumePrefix
+    )
+
+
+def paaBounds(windowLen, segments=paaSegments):
+    # Edges of the PAA segments, as even as the window length allows
+    return np.linspace(0, windowLen, min(segments, windowLen) + 1).astype(np.int64)
+
+
+def segmentMeans(prefix, starts, bounds):
+    """
+    Averages the windows beginning at starts over every PAA segment.
+
+    Args:
+        prefix (tuple): prefixSums of the column.
+        starts (NumPy array): Start rows of the windows.
+        bounds (NumPy array): Segment edges, see paaBounds.
+
+    Returns:
+        NumPy array: Segment means, shape (len(starts), len(bounds) - 1).
+    """
+    centre, sums = prefix
+    segmentSums = (
+        sums[starts[:, None] + bounds[1:], 0] - sums[starts[:, None] + bounds[:-1], 0]
+    )
+    return segmentSums / np.diff(bounds) + centre
+
+
+def paaLowerBounds(prefixes, starts, query, stats):
+    """
+    Lower-bounds the squared z-score distance of every candidate from PAA.
+
+    Within a segment of w points, sum((q - z)^2) >= w * (mean(q) - mean(z))^2,
+    and the segment means of z follow from the prefix sums without touching
+    the window itself.
+
+    Args:
+        prefixes (tuple): prefixSums of close and volume.
+        starts (NumPy array): Start rows of the candidate windows.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        stats (tuple): windowStats of the candidates.
+
+    Returns:
+        NumPy array: Squared lower bounds aligned with starts, NaN for flat windows.
+    """
+    bounds = paaBounds(len(query))
+    widths = np.diff(bounds)
+    closeMeans, closeStds, volumeMeans, volumeStds = stats
+
+    lowerBounds = np.zeros(len(starts), dtype=np.float64)
+    chunkSize = max(1, chunkElements // len(widths))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for channel, (prefix, means, stds, scale) in enumerate(
+            zip(prefixes, (closeMeans, volumeMeans), (closeStds, volumeStds), (4, 1))
+        ):
+            queryMeans = np.add.reduceat(query[:, channel], bounds[:-1]) / widths
+            for chunkStart in range(0, len(starts), chunkSize):
+                chunk = slice(chunkStart, chunkStart + chunkSize)
+                zScores = (
+                    scale
+                    * (segmentMeans(prefix, starts[chunk], bounds) - means[chunk, None])
+                    / stds[chunk, None]
+                )
+                lowerBounds[chunk] += (queryMeans - zScores) ** 2 @ widths
+    return lowerBounds
+
+
+def statDistances(close, volume, starts, query, stats):
+    """
+    Computes the z-score distance of every candidate from precomputed stats.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        volume (NumPy array): Volume column of the ticker file.
+        starts (NumPy array): Start rows of the candidate windows.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        stats (tuple): windowStats of the candidates.
+
+    Returns:
+        NumPy array: The distance of every candidate, aligned with starts.
+    """
+    windowLen = len(query)
+    distances = np.empty(len(starts), dtype=np.float64)
+    if len(starts) == 0:
+        return distances
+
+    closeMeans, closeStds, volumeMeans, volumeStds = stats
+    closeWindows = np.lib.stride_tricks.sliding_window_view(close, windowLen)
+    volumeWindows = np.lib.stride_tricks.sliding_window_view(volume, windowLen)
+
+    chunkSize = max(1, chunkElements // windowLen)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for chunkStart in range(0, len(starts), chunkSize):
+            chunk = slice(chunkStart, chunkStart + chunkSize)
+            chunkStarts = starts[chunk]
+
+            # Same operation order as the per-window z-score
+            closeZScores = (
+                4 * (closeWindows[chunkStarts] - closeMeans[chunk, None])
+            ) / closeStds[chunk, None]
+            volumeZScores = (
+                volumeWindows[chunkStarts] - volumeMeans[chunk, None]
+            ) / volumeStds[chunk, None]
+
+            closeDiff = query[:, 0] - closeZScores
+            volumeDiff = query[:, 1] - volumeZScores
+            distances[chunk] = np.sqrt(
+                np.einsum("ij,ij->i", closeDiff, closeDiff)
+                + np.einsum("ij,ij->i", volumeDiff, volumeDiff)
+            )
+
+    return distances
+
+
+def zScoreDistances(close, volume, starts, query, prefixes=None):
+    """
+    Computes the z-score distance between the query and every candidate window.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        volume (NumPy array): Volume column of the ticker file.
+        starts (NumPy array): Start rows of the candidate windows.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        prefixes (tuple): prefixSums of close and volume, or None.
+
+    Returns:
+        NumPy array: The distance of every candidate, aligned with starts.
+    """
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.float64)
+
+    stats = windowStats(close, volume, starts, len(query), prefixes)
+    return statDistances(close, volume, starts, query, stats)
+
+
+def newPruneStats():
+    """Counters of how many candidates each pruning stage rejected."""
+    return {
+        "candidates": 0,
+        "paa": 0,
+        "lowerBound": 0,
+        "abandoned": 0,
+        "fused": 0,
+        "scored": 0,
+    }
+
+
+def pruningRate(pruneStats):
+    # Share of candidates rejected before a full distance was computed
+    if pruneStats["candidates"] == 0:
+        return 0.0
+    pruned = pruneStats["candidates"] - pruneStats["scored"]
+    return pruned / pruneStats["candidates"]
+
+
+def partialDistances(close, volume, starts, query, stats, points):
+    """
+    Sums the squared z-score differences over a subset of the query.
+
+    Args:
+        points (NumPy array): Flat indices into query, point * 2 + channel.
+
+    Returns:
+        NumPy array: The partial squared distance of every candidate.
+    """
+    closeMeans, closeStds, volumeMeans, volumeStds = stats
+    closePoints = points[points % 2 == 0] // 2
+    volumePoints = points[points % 2 == 1] // 2
+
+    closeZScores = (
+        4 * (close[starts[:, None] + closePoints] - closeMeans[:, None])
+    ) / closeStds[:, None]
+    volumeZScores = (
+        volume[starts[:, None] + volumePoints] - volumeMeans[:, None]
+    ) / volumeStds[:, None]
+
+    closeDiff = query[closePoints, 0] - closeZScores
+    volumeDiff = query[volumePoints, 1] - volumeZScores
+    return np.einsum("ij,ij->i", closeDiff, closeDiff) + np.einsum(
+        "ij,ij->i", volumeDiff, volumeDiff
+    )
+
+
+def prunedDistances(
+    close, volume, starts, query, stats, threshold, pruneStats, lowerBounds=None
+):
+    """
+    Computes exact distances only for candidates that can beat threshold.
+
+    PAA lower bounds, when given, reject candidates first. A lower bound from
+    the first and last point of both channels rejects the next ones. The rest
+    of the points are then added in blocks, largest query values first, and
+    candidates are abandoned as soon as their partial sum passes threshold.
+    Survivors are re-scored with statDistances so their distances are
+    identical to the unpruned path.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        volume (NumPy array): Volume column of the ticker file.
+        starts (NumPy array): Start rows of the candidate windows.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        stats (tuple): windowStats of the candidates.
+        threshold (float): Distance of the current k-th best window.
+        pruneStats (dict): Counters updated in place, see newPruneStats.
+        lowerBounds (NumPy array): paaLowerBounds of the candidates, or None.
+
+    Returns:
+        NumPy array: Distances aligned with starts, inf for pruned candidates.
+    """
+    windowLen = len(query)
+    pruneStats["candidates"] += len(starts)
+    if not np.isfinite(threshold) or len(starts) == 0:
+        pruneStats["scored"] += len(starts)
+        return statDistances(close, volume, starts, query, stats)
+
+    # Slack keeps rounding in the reordered sums from rejecting a tie
+    limit = threshold * threshold * (1 + pruneSlack)
+    distances = np.full(len(starts), np.inf)
+
+    boundPoints = np.unique([0, 1, 2 * windowLen - 2, 2 * windowLen - 1])
+    flatQuery = np.abs(query.ravel())
+    flatQuery[boundPoints] = -1
+    order = np.argsort(-flatQuery, kind="stable")[: 2 * windowLen - len(boundPoints)]
+
+    alive = np.arange(len(starts))
+    if lowerBounds is not None:
+        alive = np.flatnonzero(~(lowerBounds * (1 - paaSlack) > limit))
+        pruneStats["paa"] += len(starts) - len(alive)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        partial = partialDistances(
+            close,
+            volume,
+            starts[alive],
+            query,
+            tuple(stat[alive] for stat in stats),
+            boundPoints,
+        )
+        keep = ~(partial > limit)
+        pruneStats["lowerBound"] += len(alive) - int(keep.sum())
+        alive, partial = alive[keep], partial[keep]
+
+        for blockStart in range(0, len(order), pruneBlock):
+            if len(alive) == 0:
+                break
+
+            blockStats = tuple(stat[alive] for stat in stats)
+            partial += partialDistances(
+                close,
+                volume,
+                starts[alive],
+                query,
+                blockStats,
+                order[blockStart : blockStart + pruneBlock],
+            )
+            keep = ~(partial > limit)
+            pruneStats["abandoned"] += len(alive) - int(keep.sum())
+            alive, partial = alive[keep], partial[keep]
+
+    pruneStats["scored"] += len(alive)
+    distances[alive] = statDistances(
+        close,
+        volume,
+        starts[alive],
+        query,
+        tuple(stat[alive] for stat in stats),
+    )
+    return distances
+
+
+def fusedDistances(close, volume, starts, query, stats):
+    """
+    Computes float32 squared z-score distances and a bound on their error.
+
+    With z = k (w - m) / s the z-scores of a window, k the channel scale and
+    q' the query channel centred on its mean, sum((q - z)^2) expands to
+    q.q - 2 k (q'.(w - m)) / s + k^2 L. Each window costs one float32 dot
+    product on its values centred in place, without z-score or difference
+    arrays.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        volume (NumPy array): Volume column of the ticker file.
+        starts (NumPy array): Start rows of the candidate windows.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        stats (tuple): windowStats of the candidates.
+
+    Returns:
+        tuple: (squared, error) where the squared distance statDistances
+        computes lies within squared +- error, NaN for flat windows.
+    """
+    windowLen = len(query)
+    squared = np.zeros(len(starts), dtype=np.float64)
+    error = np.zeros(len(starts), dtype=np.float64)
+    if len(starts) == 0:
+        return squared, error
+
+    # Rounding of a float32 dot product of length L, plus the float32 casts
+    gamma = (windowLen + 2) * float32Roundoff
+    gamma /= 1 - gamma
+
+    closeMeans, closeStds, volumeMeans, volumeStds = stats
+    chunkSize = max(1, fusedElements // windowLen)
+    dots = np.empty(len(starts), dtype=np.float64)
+    for column, means, stds, scale, channel in (
+        (close, closeMeans, closeStds, 4, 0),
+        (volume, volumeMeans, volumeStds, 1, 1),
+    ):
+        values = query[:, channel].astype(np.float64)
+        centred = (values - values.mean()).astype(np.float32)
+        centredNorm = float(np.linalg.norm(centred))
+        windows = np.lib.stride_tricks.sliding_window_view(column, windowLen)
+
+        for chunkStart in range(0, len(starts), chunkSize):
+            chunk = slice(chunkStart, chunkStart + chunkSize)
+            block = windows[starts[chunk]].astype(np.float32, copy=False)
+            block -= means[chunk, None].astype(np.float32)
+            dots[chunk] = block @ centred
+
+        # ||w - m|| is sqrt(L) s, the float32 mean is off by up to u |m|, and
+        # float64 columns lose up to u |w| when cast
+        blockNorm = np.sqrt(windowLen) * (stds + float32Roundoff * np.abs(means))
+        dotError = gamma * centredNorm * blockNorm
+        if column.dtype != np.float32:
+            dotError += (
+                float32Roundoff
+                * centredNorm
+                * np.sqrt(windowLen * (stds * stds + means * means))
+            )
+
+        constant = values @ values + scale * scale * windowLen
+        with np.errstate(divide="ignore", invalid="ignore"):
+            squared += constant - 2 * scale * dots / stds
+            error += 2 * scale * dotError / stds + pruneSlack * constant
+
+    return squared, error
+
+
+def fusedTopK(
+    close, volume, starts, query, topResults, fileId, pruneStats, prefixes=None
+):
+    """
+    Pushes the windows of one file into topResults through the float32 path.
+
+    After the PAA lower bound, fusedDistances rejects every window that
+    provably cannot reach the k-th best. The rest are re-scored with
+    statDistances, so results are identical to prunedTopK.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        volume (NumPy array): Volume column of the ticker file.
+        starts (NumPy array): Start rows of the candidate windows.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        topResults (TopK): The running top-k of the worker.
+        fileId (int): The file the candidates belong to.
+        pruneStats (dict): Counters updated in place, see newPruneStats.
+        prefixes (tuple): prefixSums of close and volume, or None.
+    """
+    if len(starts) == 0:
+        return
+
+    pruneStats["candidates"] += len(starts)
+    stats = windowStats(close, volume, starts, len(query), prefixes)
+    limit = topResults.threshold**2 * (1 + pruneSlack)
+
+    alive = np.arange(len(starts))
+    if prefixes is not None and np.isfinite(limit):
+        lowerBounds = paaLowerBounds(prefixes, starts, query, stats)
+        alive = np.flatnonzero(~(lowerBounds * (1 - paaSlack) > limit))
+        pruneStats["paa"] += len(starts) - len(alive)
+
+    aliveStats = tuple(stat[alive] for stat in stats)
+    squared, error = fusedDistances(close, volume, starts[alive], query, aliveStats)
+
+    # The k-th best upper bound of this file also caps the k-th best overall
+    upper = np.where(np.isnan(squared), np.inf, squared + error)
+    if len(upper) >= topResults.k:
+        limit = min(limit, np.partition(upper, topResults.k - 1)[topResults.k - 1])
+
+    keep = ~(squared - error > limit)
+    pruneStats["fused"] += len(alive) - int(keep.sum())
+    pruneStats["scored"] += int(keep.sum())
+
+    alive = alive[keep]
+    topResults.push(
+        statDistances(
+            close, volume, starts[alive], query, tuple(stat[alive] for stat in stats)
+        ),
+        fileId,
+        starts[alive],
+    )
+
+
+def prunedTopK(
+    close, volume, starts, query, topResults, fileId, pruneStats, prefixes=None
+):
+    """
+    Pushes the windows of one file into topResults with early abandoning.
+
+    Candidates are handled in small chunks so the threshold tightens as the
+    top-k fills up within the file. With prefix sums the PAA lower bound of
+    every candidate is checked before any of its points are read.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        volume (NumPy array): Volume column of the ticker file.
+        starts (NumPy array): Start rows of the candidate windows.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        topResults (TopK): The running top-k of the worker.
+        fileId (int): The file the candidates belong to.
+        pruneStats (dict): Counters updated in place, see newPruneStats.
+        prefixes (tuple): prefixSums of close and volume, or None.
+    """
+    if len(starts) == 0:
+        return
+
+    stats = windowStats(close, volume, starts, len(query), prefixes)
+    lowerBounds = None
+    if prefixes is not None:
+        lowerBounds = paaLowerBounds(prefixes, starts, query, stats)
+    for chunkStart in range(0, len(starts), pruneChunk):
+        chunk = slice(chunkStart, chunkStart + pruneChunk)
+        distances = prunedDistances(
+            close,
+            volume,
+            starts[chunk],
+            query,
+            tuple(stat[chunk] for stat in stats),
+            topResults.threshold,
+            pruneStats,
+            None if lowerBounds is None else lowerBounds[chunk],
+        )
+        topResults.push(distances, fileId, starts[chunk])
+
+
+def scanFile(close, volume, times, query, anchorTime, predictionLen):
+    """
+    Scores every window of one ticker file that ends on the query's time of day.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        volume (NumPy array): Volume column of the ticker file.
+        times (NumPy array): Time of day of every row, see timeOfDay.
+        query (NumPy array): Close and volume z-scores of the query, shape (L, 2).
+        anchorTime (int): Time of day of the last row of the query.
+        predictionLen (int): The number of rows required after each window.
+
+    Returns:
+        tuple: (distances, starts) for every candidate window.
+    """
+    starts = anchorStarts(times, anchorTime, len(query), predictionLen)
+    return zScoreDistances(close, volume, starts, query), starts
+
+
+class TopK:
+    def __init__(self, k):
+        """
+        Bounded top-k of candidate windows, kept as compact arrays.
+
+        Ties are broken by (fileId, row) so merging per-worker results gives the
+        same order heapq.nsmallest gave over the full list. Windows without a
+        defined distance (NaN) are never kept.
+
+        Args:
+            k (int): The number of windows to keep.
+        """
+        self.k = int(k)
+        self.distances = np.empty(0, dtype=np.float64)
+        self.fileIds = np.empty(0, dtype=np.int32)
+        self.rows = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.distances)
+
+    @property
+    def threshold(self):
+        # Distance a candidate has to beat to get in
+        if len(self.distances) < self.k:
+            return np.inf
+        return self.distances[-1]
+
+    def push(self, distances, fileIds, rows):
+        """
+        Merges candidate windows into the top-k.
+
+        Args:
+            distances (NumPy array): Distances of the candidates.
+            fileIds (NumPy array or int): File of every candidate.
+            rows (NumPy array): Start row of every candidate.
+        """
+        distances = np.asarray(distances, dtype=np.float64)
+        keep = distances <= self.threshold
+        if not keep.any():
+            return
+
+        distances = np.concatenate((self.distances, distances[keep]))
+        fileIds = np.concatenate(
+            (self.fileIds, np.broadcast_to(fileIds, keep.shape)[keep])
+        ).astype(np.int32)
+        rows = np.concatenate((self.rows, np.asarray(rows)[keep])).astype(np.int64)
+
+        if len(distances) > self.k:
+            # Cut down to everything tied with the k-th best before sorting
+            kth = np.partition(distances, self.k - 1)[self.k - 1]
+            keep = distances <= kth
+            distances, fileIds, rows = distances[keep], fileIds[keep], rows[keep]
+
+        order = np.lexsort((rows, fileIds, distances))[: self.k]
+        self.distances = distances[order]
+        self.fileIds = fileIds[order]
+        self.rows = rows[order]
+
+    def result(self):
+        """Returns (distances, fileIds, rows) sorted from best to worst."""
+        return self.distances, self.fileIds, self.rows
+
+
+def ratioProfile(close, query):
+    """
+    Computes the distance of the query to every window divided by its last value.
+
+    With c the last value of window w, ||q - w / c||^2 expands to
+    q.q - 2 (q.w) / c + (w.w) / c^2. The sliding dot products q.w come from one
+    FFT convolution and w.w from cumulative sums, so a file costs O(n log n).
+    The cancellation leaves small distances with a rounding error bounded
+    through profileTolerance, see profileTopK.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        query (NumPy array): The query scaled to end on 1.
+
+    Returns:
+        NumPy array: Distance of the window starting at every row i, for
+        i in 0..len(close) - len(query).
+    """
+    close = np.asarray(close, dtype=np.float64)
+    query = np.ravel(query).astype(np.float64)
+    windowLen = len(query)
+    if len(close) < windowLen:
+        return np.empty(0, dtype=np.float64)
+
+    size = 1 << int(np.ceil(np.log2(len(close) + windowLen - 1)))
+    dots = np.fft.irfft(
+        np.fft.rfft(close, size) * np.fft.rfft(query[::-1], size), size
+    )[windowLen - 1 : len(close)]
+
+    cumulativeSq = np.concatenate(([0.0], np.cumsum(close * close)))
+    windowSq = cumulativeSq[windowLen:] - cumulativeSq[:-windowLen]
+    last = close[windowLen - 1 :]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distanceSq = query @ query - 2 * dots / last + windowSq / (last * last)
+    return np.sqrt(np.maximum(distanceSq, 0.0))
+
+
+def skipFilter(profile, windowLen):
+    """
+    Replays the ALGOdt3 skip and break heuristics on a distance profile.
+
+    Walking from the first row, a window further than windowLen / 50 ends the
+    file, and one further than windowLen / 2000 skips the next windowLen / 5
+    windows.
+
+    Args:
+        profile (NumPy array): Distances from ratioProfile.
+        windowLen (int): The length of the query.
+
+    Returns:
+        NumPy array: The rows the heuristics visit.
+    """
+    breakDistance = windowLen / 50
+    skipDistance = windowLen / 1000 * 0.5
+    skipLen = int(windowLen / 5)
+
+    visited = []
+    i = 0
+    while i < len(profile):
+        distance = profile[i]
+        if distance > breakDistance:
+            break
+
+        visited.append(i)
+        i += skipLen + 1 if distance > skipDistance else 1
+
+    return np.array(visited, dtype=np.int64)
+
+
+def profileTopK(close, profile, rows, query, topResults, fileId):
+    """
+    Pushes the windows of a ratioProfile at rows into topResults, re-scored
+    with ratioDistances.
+
+    The profile cancels squared norms of about len(query), so for large
+    prices its smallest distances lose most of their digits. It only picks
+    the windows that could reach the top results.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        profile (NumPy array): Distances from ratioProfile.
+        rows (NumPy array): Sorted rows to push, e.g. from skipFilter.
+        query (NumPy array): The query scaled to end on 1.
+        topResults (TopK): The running top-k of the worker.
+        fileId (int): The file the windows belong to.
+
+    Returns:
+        int: The number of windows scored exactly.
+    """
+    query = np.ravel(query).astype(np.float64)
+    distances = profile[rows]
+    sortable = np.where(np.isnan(distances), np.inf, distances)
+
+    # Largest error of every distance, from ||w / c|| <= ||q|| + distance
+    slack = np.sqrt(profileTolerance) * (2 * np.sqrt(query @ query) + sortable)
+
+    # Score the most promising windows first to set a threshold
+    seed = min(len(rows), topResults.k - len(topResults))
+    seedRows = np.empty(0, dtype=np.int64)
+    if seed > 0:
+        seedRows = rows[np.sort(np.argpartition(sortable, seed - 1)[:seed])]
+        topResults.push(ratioDistances(close, seedRows, query), fileId, seedRows)
+
+    survivors = rows[~(sortable - slack > topResults.threshold)]
+    survivors = survivors[~np.isin(survivors, seedRows)]
+    topResults.push(ratioDistances(close, survivors, query), fileId, survivors)
+    return len(seedRows) + len(survivors)
+
+
+def ratioDistances(close, starts, query):
+    """
+    Computes the ratioProfile distance of the windows beginning at starts.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        starts (NumPy array): Start rows of the windows.
+        query (NumPy array): The query scaled to end on 1.
+
+    Returns:
+        NumPy array: The distance of every window, aligned with starts.
+    """
+    query = np.ravel(query).astype(np.float64)
+    windowLen = len(query)
+    windows = np.lib.stride_tricks.sliding_window_view(close, windowLen)
+
+    distances = np.empty(len(starts), dtype=np.float64)
+    chunkSize = max(1, chunkElements // windowLen)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for chunkStart in range(0, len(starts), chunkSize):
+            chunk = slice(chunkStart, chunkStart + chunkSize)
+            chunkWindows = windows[starts[chunk]].astype(np.float64)
+            difference = query - chunkWindows / chunkWindows[:, -1:]
+            distances[chunk] = np.sqrt(np.einsum("ij,ij->i", difference, difference))
+    return distances
+
+
+def ratioLowerBounds(prefix, close, stop, query):
+    """
+    Lower-bounds the ratioProfile distance of every window from PAA.
+
+    Args:
+        prefix (tuple): prefixSums of close.
+        close (NumPy array): Close column of the ticker file.
+        stop (int): Windows beginning at rows 0..stop - 1 are bounded.
+        query (NumPy array): The query scaled to end on 1.
+
+    Returns:
+        NumPy array: Lower bounds of the windows, in row order.
+    """
+    query = np.ravel(query).astype(np.float64)
+    bounds = paaBounds(len(query), ratioSegments)
+    widths = np.diff(bounds)
+    queryMeans = np.add.reduceat(query, bounds[:-1]) / widths
+
+    # Every row starts a window, so each segment is a shifted slice of the sums
+    centre, sums = prefix
+    cumulative = np.ascontiguousarray(sums[: bounds[-1] + stop, 0])
+    last = np.asarray(close[len(query) - 1 : len(query) - 1 + stop], dtype=np.float64)
+
+    lowerBounds = np.zeros(stop, dtype=np.float64)
+    ratios = np.empty(stop, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for segment, width in enumerate(widths):
+            np.subtract(
+                cumulative[bounds[segment + 1] : bounds[segment + 1] + stop],
+                cumulative[bounds[segment] : bounds[segment] + stop],
+                out=ratios,
+            )
+            ratios /= width
+            ratios += centre
+            ratios /= last
+            ratios -= queryMeans[segment]
+            ratios *= ratios
+            ratios *= width
+            lowerBounds += ratios
+    return np.sqrt(lowerBounds)
+
+
+def ratioTopK(close, stop, query, topResults, fileId, prefix=None):
+    """
+    Pushes the windows of one file into topResults with a PAA prefilter.
+
+    The windows with the lowest lower bounds are scored first to set the
+    k-th best distance. Then only windows whose bound can beat it are scored.
+
+    Args:
+        close (NumPy array): Close column of the ticker file.
+        stop (int): Windows beginning at rows 0..stop - 1 are candidates.
+        query (NumPy array): The query scaled to end on 1.
+        topResults (TopK): The running top-k of the worker.
+        fileId (int): The file the candidates belong to.
+        prefix (tuple): prefixSums of close, computed here if None.
+
+    Returns:
+        int: The number of windows scored exactly.
+    """
+    if stop <= 0:
+        return 0
+
+    prefix = prefixSums(close) if prefix is None else prefix
+    lowerBounds = ratioLowerBounds(prefix, close, stop, query)
+    sortable = np.where(np.isnan(lowerBounds), np.inf, lowerBounds)
+
+    # Fill the top results with the most promising windows to set a threshold
+    seed = min(stop, topResults.k - len(topResults))
+    rows = np.empty(0, dtype=np.int64)
+    if seed > 0:
+        rows = np.sort(np.argpartition(sortable, seed - 1)[:seed])
+        topResults.push(ratioDistances(close, rows, query), fileId, rows)
+
+    slack = ratioSlack * np.linalg.norm(np.ravel(query).astype(np.float64))
+    limit = topResults.threshold * (1 + paaSlack) + slack
+    survivors = np.flatnonzero(~(lowerBounds > limit))
+    survivors = survivors[~np.isin(survivors, rows)]
+    for chunkStart in range(0, len(survivors), pruneChunk):
+        chunk = survivors[chunkStart : chunkStart + pruneChunk]
+        limit = topResults.threshold * (1 + paaSlack) + slack
+        chunk = chunk[~(lowerBounds[chunk] > limit)]
+        topResults.push(ratioDistances(close, chunk, query), fileId, chunk)
+    return len(rows) + len(survivors)
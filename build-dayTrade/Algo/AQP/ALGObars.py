@@ -0,0 +1,355 @@
+import os
+import re
+import time
+import logging
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+# yfinance is only needed by YahooProvider, FileProvider works offline
+try:
+    import yfinance as yf
+except ImportError:
+    yf = None
+
+# Set the logging level for yfinance to WARNING or higher
+yfinanceLogger = logging.getLogger("yfinance")
+yfinanceLogger.setLevel(logging.WARNING)
+
+# Setting up logging with detailed formatting
+logging.basicConfig(
+    filename="algoLog.log",
+    level=logging.INFO,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+# Directory the bar cache persists to, one file per ticker and interval
+barCachePath = "barCache"
+
+# Seconds after which a cached ticker is downloaded whole again, 1-minute
+# bars further back than a week are not served by Yahoo Finance
+maxTailAge = 6 * 24 * 3600
+
+# Tickers downloaded at once by BarCache.prefetch
+prefetchWorkers = 8
+
+# Columns every provider returns
+barColumns = ["Datetime", "Close", "Volume"]
+
+
+class FailedDownload(Exception):
+    """Exception raised when bars could not be downloaded."""
+
+    def __init__(self, message="Failed to download data after several attempts"):
+        self.message = message
+        super().__init__(self.message)
+
+
+def periodDays(period):
+    """
+    Converts a yfinance period like "5d" into a number of trading days.
+
+    Args:
+        period (str): The period, in days or weeks.
+
+    Returns:
+        int: The number of trading days the period covers.
+    """
+    match = re.fullmatch(r"(\d+)(d|wk)", period)
+    if match is None:
+        raise ValueError(f"Unsupported period: {period}")
+    return int(match[1]) * (5 if match[2] == "wk" else 1)
+
+
+def lastDays(bars, days):
+    """Returns the bars of the last days trading days, like a yfinance period."""
+    dates = bars["Datetime"].dt.normalize()
+    firstDate = dates.drop_duplicates().nlargest(days).min()
+    return bars[dates >= firstDate].reset_index(drop=True)
+
+
+def mergeBars(cached, new):
+    # Newer bars replace cached ones of the same minute, a bar can still change
+    bars = pd.concat([cached, new], ignore_index=True)
+    bars = bars.drop_duplicates("Datetime", keep="last")
+    return bars.sort_values("Datetime", ignore_index=True)
+
+
+class YahooProvider:
+    """Downloads bars from Yahoo Finance."""
+
+    def fetch(self, ticker, interval, period=None, start=None):
+        """
+        Downloads the bars of one ticker.
+
+        Args:
+            ticker (str): The ticker symbol.
+            interval (str): Bar interval, like "1m".
+            period (str): How far back to download, used when start is None.
+            start (Timestamp): Download the bars from this time on instead.
+
+        Returns:
+            DataFrame: Datetime in exchange time, Close and Volume.
+        """
+        if yf is None:
+            raise ImportError("yfinance is required to download bars")
+
+        tickerData = yf.Ticker(ticker).history(
+            period=None if start is not None else period,
+            start=start,
+            interval=interval,
+            prepost=False,
+            repair=True,
+        )
+
+        # Get rid of the timezone offset, times stay in exchange time
+        tickerData.index = tickerData.index.tz_localize(None)
+        tickerData = tickerData.reset_index()
+        tickerData = tickerData.rename(columns={tickerData.columns[0]: "Datetime"})
+        return tickerData[barColumns]
+
+
+class FileProvider:
+    def __init__(self, path, now=None):
+        """
+        Serves bars from CSV files instead of downloading them, for testing
+        offline.
+
+        Args:
+            path (str): Directory holding one <ticker>.csv per ticker, with
+                Datetime, Close and Volume columns.
+            now (Timestamp): Bars after now are not served yet, None for all.
+        """
+        self.path = path
+        self.now = now
+
+        # (ticker, interval, period, start) of every fetch
+        self.calls = []
+
+    def fetch(self, ticker, interval, period=None, start=None):
+        self.calls.append((ticker, interval, period, start))
+
+        bars = pd.read_csv(os.path.join(self.path, ticker + ".csv"))
+        bars.columns = [column.capitalize() for column in bars.columns]
+        bars["Datetime"] = pd.to_datetime(bars["Datetime"])
+        if self.now is not None:
+            bars = bars[bars["Datetime"] <= self.now]
+
+        if start is not None:
+            return bars[bars["Datetime"] >= start][barColumns].reset_index(drop=True)
+        return lastDays(bars, periodDays(period))[barColumns]
+
+
+class BarCache:
+    def __init__(
+        self,
+        provider=None,
+        path=barCachePath,
+        maxAge=15,
+        fetchPeriod="5d",
+        keepDays=10,
+        maxAttempts=10,
+        backoff=0.5,
+        maxBackoff=30,
+    ):
+        """
+        Keeps the bars of every ticker and interval in memory and on disk, so
+        a query only downloads the bars that arrived since the last one.
+
+        Args:
+            provider: Where bars come from, YahooProvider if None.
+            path (str): Directory the cache persists to, None for memory only.
+            maxAge (float): Seconds cached bars are served without checking for
+                newer ones.
+            fetchPeriod (str): The shortest period downloaded when a ticker is
+                not cached, so the 1d query after a 5d one is a cache hit.
+            keepDays (int): Trading days kept per ticker.
+            maxAttempts (int): Downloads tried before giving up.
+            backoff (float): Seconds waited after the first failed download,
+                doubled after every further one.
+            maxBackoff (float): Longest wait between two downloads.
+        """
+        self.provider = provider or YahooProvider()
+        self.path = path
+        self.settings = {
+            "maxAge": maxAge,
+            "fetchPeriod": fetchPeriod,
+            "keepDays": keepDays,
+            "maxAttempts": maxAttempts,
+            "backoff": backoff,
+            "maxBackoff": maxBackoff,
+        }
+
+        # (ticker, interval) -> {"bars", "days", "fetchedAt"}
+        self.entries = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    def bars(self, ticker, period, interval="1m", maxAge=None):
+        """
+        Returns the bars of one ticker over a period, downloading only what
+        the cache is missing.
+
+        Args:
+            ticker (str): The ticker symbol.
+            period (str): The period, like "1d" or "5d".
+            interval (str): Bar interval.
+            maxAge (float): Overrides the maxAge setting, inf to read prefetched
+                bars without checking for newer ones.
+
+        Returns:
+            DataFrame: Datetime, Close and Volume, like yf.download returns them.
+        """
+        key = (ticker, interval)
+        days = periodDays(period)
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+
+        # Other tickers are fetched concurrently, the same one only once
+        with lock:
+            entry = self.entries.get(key) or self.load(key)
+            if (
+                entry is None
+                or entry["days"] < days
+                or time.time() - entry["fetchedAt"] > maxTailAge
+            ):
+                entry = self.fetchPeriod(key, days)
+            elif time.time() - entry["fetchedAt"] > (
+                self.settings["maxAge"] if maxAge is None else maxAge
+            ):
+                entry = self.fetchTail(key, entry)
+            self.entries[key] = entry
+
+        return lastDays(entry["bars"], days)
+
+    def prefetch(self, tickers, period, interval="1m", workers=prefetchWorkers):
+        """
+        Brings the bars of several tickers up to date at once, so the queries
+        that follow read them from the cache.
+
+        Args:
+            tickers (list): The ticker symbols.
+            period (str): The longest period the queries will ask for.
+            interval (str): Bar interval.
+            workers (int): Tickers downloaded concurrently.
+
+        Returns:
+            list: The tickers whose download failed.
+        """
+        tickers = list(dict.fromkeys(tickers))
+        if not tickers:
+            return []
+
+        def fetch(ticker):
+            try:
+                self.bars(ticker, period, interval)
+            except FailedDownload:
+                return ticker
+            except Exception as e:
+                logging.error(f"Error prefetching {ticker}: {e}")
+                return ticker
+
+        startTime = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(workers, len(tickers))) as executor:
+            failed = [ticker for ticker in executor.map(fetch, tickers) if ticker]
+
+        logging.info(
+            f"Prefetched {len(tickers) - len(failed)} of {len(tickers)} tickers "
+            f"in {time.perf_counter() - startTime:.2f}s"
+        )
+        return failed
+
+    def fetchPeriod(self, key, days):
+        # Downloads a whole period, at least fetchPeriod long
+        days = max(days, periodDays(self.settings["fetchPeriod"]))
+        bars = self.download(*key, period=f"{days}d")
+        entry = {"bars": bars, "days": days, "fetchedAt": time.time()}
+        self.save(key, entry)
+        return entry
+
+    def fetchTail(self, key, entry):
+        # Downloads the bars from the last cached one on
+        try:
+            tail = self.download(
+                *key, start=entry["bars"]["Datetime"].iloc[-1], allowEmpty=True
+            )
+        except FailedDownload:
+            logging.warning(f"Serving cached bars of {key[0]}, tail download failed")
+            return entry
+
+        # Every day the tail starts adds to the days covered
+        bars = mergeBars(entry["bars"], tail)
+        newDays = (
+            bars["Datetime"].dt.normalize().nunique()
+            - entry["bars"]["Datetime"].dt.normalize().nunique()
+        )
+        entry = {
+            "bars": lastDays(bars, self.settings["keepDays"]),
+            "days": min(entry["days"] + newDays, self.settings["keepDays"]),
+            "fetchedAt": time.time(),
+        }
+        self.save(key, entry)
+        return entry
+
+    def download(self, ticker, interval, period=None, start=None, allowEmpty=False):
+        """
+        Fetches bars from the provider with exponential backoff.
+
+        Args:
+            ticker (str): The ticker symbol.
+            interval (str): Bar interval.
+            period (str): How far back to download, used when start is None.
+            start (Timestamp): Download the bars from this time on instead.
+            allowEmpty (bool): Accept no bars, a tail can be empty.
+
+        Returns:
+            DataFrame: The bars the provider returned.
+
+        Raises:
+            FailedDownload: When every attempt failed or returned no bars.
+        """
+        for attempt in range(self.settings["maxAttempts"]):
+            try:
+                bars = self.provider.fetch(ticker, interval, period=period, start=start)
+                if allowEmpty or not bars.empty:
+                    return bars
+                error = "no bars returned"
+            except Exception as e:
+                error = e
+            logging.warning(
+                f"Download of {ticker} failed, attempt {attempt + 1}: {error}"
+            )
+
+            if attempt + 1 < self.settings["maxAttempts"]:
+                time.sleep(
+                    min(
+                        self.settings["backoff"] * 2**attempt,
+                        self.settings["maxBackoff"],
+                    )
+                )
+        raise FailedDownload(f"Failed to download {ticker} after several attempts")
+
+    def cacheFile(self, key):
+        return os.path.join(self.path, f"{key[0]}_{key[1]}.pkl")
+
+    def load(self, key):
+        # Reads an entry persisted by an earlier run, None if there is none
+        if self.path is None or not os.path.isfile(self.cacheFile(key)):
+            return None
+        try:
+            entry = pd.read_pickle(self.cacheFile(key))
+        except Exception as e:
+            logging.error(f"Error reading cached bars of {key[0]}: {e}")
+            return None
+        return entry
+
+    def save(self, key, entry):
+        # Replaced whole, so a crash never leaves a partial cache file
+        if self.path is None:
+            return
+        tempPath = self.cacheFile(key) + ".tmp"
+        pd.to_pickle(entry, tempPath)
+        os.replace(tempPath, self.cacheFile(key))
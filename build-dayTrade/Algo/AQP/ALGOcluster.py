@@ -0,0 +1,269 @@
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from Algo import ALGOdt3
+from Algo.AQP import ALGOnode
+
+# Setting up logging with detailed formatting
+logging.basicConfig(
+    filename="algoLog.log",
+    level=logging.INFO,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+# Seconds a node that failed is left out of queries before it is tried again
+retryAfter = 60
+
+# A range is handed to idle nodes once it ran slowFactor times longer than the
+# throughput of its node predicts, plus slowGrace seconds
+slowFactor = 2
+slowGrace = 1.0
+
+# Weight of the latest query in the throughput of a node
+throughputWeight = 0.5
+
+# Seconds between two checks for slow ranges
+checkInterval = 0.1
+
+
+def splitRange(firstFile, fileCount, weights):
+    """
+    Splits a range of files into consecutive, disjoint ranges.
+
+    Args:
+        firstFile (int): The first file of the range.
+        fileCount (int): Files in the range.
+        weights (dict): Node name -> share of the range, in any unit.
+
+    Returns:
+        dict: Node name -> (firstFile, fileCount), nodes left without files
+        are left out.
+    """
+    names = list(weights)
+    bounds = np.cumsum([0] + [weights[name] for name in names], dtype=float)
+    bounds = np.round(bounds / bounds[-1] * fileCount).astype(int)
+
+    ranges = {}
+    for name, start, end in zip(names, bounds[:-1], bounds[1:]):
+        if end > start:
+            ranges[name] = (firstFile + int(start), int(end - start))
+    return ranges
+
+
+def mergeMatches(parts, resultSize):
+    """
+    Merges the closest windows of several nodes into the closest overall.
+
+    Args:
+        parts (list): (matches, predictions) of every node, see
+            ALGOdt3.findMatches, in file order.
+        resultSize (int): The number of windows kept.
+
+    Returns:
+        tuple: (matches, predictions) of the resultSize closest windows.
+    """
+    matches = np.vstack([partMatches for partMatches, _ in parts])
+    predictions = np.hstack([partPredictions for _, partPredictions in parts])
+
+    # Stable, so ties keep file order like a single node
+    order = np.argsort(matches[:, 0], kind="stable")[:resultSize]
+    return matches[order], predictions[:, order]
+
+
+class LocalNode:
+    def __init__(self, progressQueue, pool=None):
+        """
+        Runs ranges on this machine, next to the remote nodes.
+
+        Args:
+            progressQueue (Queue): A queue for progress updates.
+            pool (Pool): See ALGOdt3.Algo.
+        """
+        self.address = "local"
+        self.progressQueue = progressQueue
+        self.pool = pool
+
+    def query(
+        self,
+        firstFile,
+        fileCount,
+        predictionLen,
+        tickerDataMultiplied,
+        resultSize=100,
+        progress=None,
+    ):
+        """See ALGOnode.NodeClient.query, progress goes to progressQueue."""
+        algoSettings = ALGOdt3.Algo(
+            fileCount,
+            predictionLen,
+            tickerDataMultiplied,
+            self.progressQueue,
+            pool=self.pool,
+            firstFile=firstFile,
+            resultSize=resultSize,
+        )
+        return algoSettings.findMatches()
+
+
+class Coordinator:
+    def __init__(self, nodes):
+        """
+        Splits every query into disjoint ranges of files, one per node, sized
+        by the throughput each node reached on earlier queries.
+
+        A node that fails is left out for retryAfter seconds and its range is
+        split between the others. A range running well past what its node's
+        throughput predicts is split between the nodes that are done.
+
+        Args:
+            nodes (dict): Node name -> LocalNode, ALGOnode.NodePool or
+                anything else with their query method.
+        """
+        self.nodes = nodes
+
+        # Node name -> files per second, and time until a failed node is used
+        self.throughput = {}
+        self.downUntil = {}
+
+        # Ranges handed to other nodes keep their thread until they return
+        self.executor = ThreadPoolExecutor(4 * len(nodes))
+
+        # Future -> node name of every range handed to other nodes that its
+        # node is still scanning, the node gets no new range until it is done
+        self.abandoned = {}
+        self.lock = threading.Lock()
+
+    def available(self):
+        now = time.time()
+        return [name for name in self.nodes if self.downUntil.get(name, 0) <= now]
+
+    def scanning(self):
+        # Nodes still busy with a range handed to other nodes
+        with self.lock:
+            return set(self.abandoned.values())
+
+    def free(self, names):
+        # The nodes to give files to, busy ones only when no other is left
+        scanning = self.scanning()
+        return [name for name in names if name not in scanning] or names
+
+    def abandon(self, future, name):
+        with self.lock:
+            self.abandoned[future] = name
+        future.add_done_callback(self.abandonDone)
+
+    def abandonDone(self, future):
+        with self.lock:
+            self.abandoned.pop(future, None)
+
+    def weights(self, names):
+        # Nodes not measured yet count as fast as the average measured one
+        known = [self.throughput[name] for name in names if name in self.throughput]
+        default = np.mean(known) if known else 1.0
+        return {name: self.throughput.get(name, default) for name in names}
+
+    def measure(self, name, fileCount, seconds):
+        if fileCount == 0 or seconds <= 0:
+            return
+        rate = fileCount / seconds
+        if name in self.throughput:
+            rate = (1 - throughputWeight) * self.throughput[name] + (
+                throughputWeight * rate
+            )
+        self.throughput[name] = rate
+
+    def query(self, fileCount, predictionLen, tickerDataMultiplied, resultSize=100):
+        """
+        Runs one query over the first fileCount files, split between the
+        available nodes.
+
+        Args:
+            fileCount (int): Files scanned over all nodes.
+            predictionLen (int): The length of the prediction interval.
+            tickerDataMultiplied (Series): The query, ending in 1.
+            resultSize (int): The number of closest windows kept.
+
+        Returns:
+            DataFrame: The predictions of the closest windows over all nodes,
+            like ALGOdt3.startPool.
+
+        Raises:
+            ALGOnode.NodeError: When every node failed.
+        """
+        names = self.available()
+        if not names:
+            raise ALGOnode.NodeError("No algo node is available")
+
+        # Future -> (node name, file range, start time) of every running range
+        running = {}
+        parts = []
+
+        def submit(ranges):
+            for name, fileRange in ranges.items():
+                future = self.executor.submit(
+                    self.nodes[name].query,
+                    *fileRange,
+                    predictionLen,
+                    tickerDataMultiplied,
+                    resultSize,
+                )
+                running[future] = (name, fileRange, time.perf_counter())
+
+        submit(splitRange(0, int(fileCount), self.weights(self.free(names))))
+
+        while running:
+            done, _ = wait(running, timeout=checkInterval, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, fileRange, startTime = running.pop(future)
+                try:
+                    parts.append((fileRange, future.result()))
+                    self.measure(name, fileRange[1], time.perf_counter() - startTime)
+                except Exception as e:
+                    logging.error(f"Algo node {name} failed, leaving it out: {e}")
+                    self.downUntil[name] = time.time() + retryAfter
+                    if name in names:
+                        names.remove(name)
+                    if not names:
+                        raise ALGOnode.NodeError("Every algo node failed")
+
+                    # The files of the failed node go to the others
+                    submit(splitRange(*fileRange, self.weights(self.free(names))))
+
+            self.rebalance(running, names, submit)
+
+        if not parts:
+            return pd.DataFrame()
+        parts.sort(key=lambda part: part[0][0])
+        matches, predictions = mergeMatches([result for _, result in parts], resultSize)
+        return pd.DataFrame(predictions)
+
+    def rebalance(self, running, names, submit):
+        # Hands slow ranges to the nodes that have nothing left to scan
+        busy = {name for name, _, _ in running.values()} | self.scanning()
+        idle = [name for name in names if name not in busy]
+        if not idle:
+            return
+
+        now = time.perf_counter()
+        for future, (name, fileRange, startTime) in list(running.items()):
+            if name not in self.throughput:
+                continue
+            expected = fileRange[1] / self.throughput[name]
+            if now - startTime <= slowFactor * expected + slowGrace:
+                continue
+
+            # The slow node's answer is ignored, its throughput so far counts.
+            # It stays busy until it returns
+            logging.warning(
+                f"Algo node {name} is slow, moving files {fileRange[0]} to "
+                f"{sum(fileRange)} to {idle}"
+            )
+            del running[future]
+            self.abandon(future, name)
+            self.measure(name, fileRange[1], now - startTime)
+            submit(splitRange(*fileRange, self.weights(idle)))
+            return
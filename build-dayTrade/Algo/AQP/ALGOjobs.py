@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import pandas as pd
+from collections import deque
+from concurrent.futures import Future
+
+# Lanes of the AQP, most urgent first: exit checks of open positions, queries
+# from the GUI, then AutoTrade watchlist scans
+lanes = ("position", "manual", "watchlist")
+
+
+class ALGOjob:
+    def __init__(self, ALGOquery):
+        """
+        Handle of one submitted ALGOquery, completed by the AQP.
+
+        Args:
+            ALGOquery (Series): The query, including its ALGOqueryID.
+        """
+        self.ALGOquery = ALGOquery
+        self.ALGOqueryID = int(ALGOquery["ALGOqueryID"])
+        self.future = Future()
+
+    def result(self, timeout=None):
+        """
+        Waits for the query to be completed.
+
+        Args:
+            timeout (float): Seconds to wait, None to wait until it is done.
+
+        Returns:
+            tuple: (averageResult, tickerDataZScores) of the query.
+        """
+        return self.future.result(timeout)
+
+    async def wait(self):
+        """Awaits the query from an event loop, see result."""
+        return await asyncio.wrap_future(self.future)
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        # Only a query the AQP has not taken yet can be cancelled
+        return self.future.cancel()
+
+
+class JobQueue:
+    def __init__(self):
+        """
+        Queue of ALGOqueries between the GUI or AutoTrade and the AQP.
+
+        Submitting wakes the AQP at once and completing a job wakes whoever
+        waits on it, nothing polls. Every lane queues separately.
+        """
+        self.condition = threading.Condition()
+        self.pending = {lane: deque() for lane in lanes}
+        self.nextID = 0
+
+        # (loop, event) of every takeAsync waiting for a submit
+        self.waiters = []
+
+    def __len__(self):
+        with self.condition:
+            return sum(len(pending) for pending in self.pending.values())
+
+    def submit(self, ALGOqueries, lane="manual"):
+        """
+        Queues several ALGOqueries, the AQP takes them as one batch when the
+        lane is idle.
+
+        Args:
+            ALGOqueries (list): Dicts with ticker, duration, dataSize,
+                resultSize and the options of every query.
+            lane (str): One of lanes.
+
+        Returns:
+            list: ALGOjob of every query, in order.
+        """
+        if lane not in lanes:
+            raise ValueError(f"Unknown lane: {lane}")
+
+        with self.condition:
+            jobs = []
+            for ALGOquery in ALGOqueries:
+                jobs.append(
+                    ALGOjob(
+                        pd.Series(dict(ALGOquery, ALGOqueryID=self.nextID, lane=lane))
+                    )
+                )
+                self.nextID += 1
+
+            self.pending[lane].extend(jobs)
+            self.condition.notify_all()
+            for loop, event in self.waiters:
+                loop.call_soon_threadsafe(event.set)
+            self.waiters = []
+        return jobs
+
+    def take(self, lane, timeout=None):
+        """
+        Waits for queued jobs of one lane and takes every one of them.
+
+        Args:
+            lane (str): One of lanes.
+            timeout (float): Seconds to wait, None to wait for a job.
+
+        Returns:
+            list: The jobs taken, cancelled ones left out, empty on timeout.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending[lane], timeout)
+            jobs = list(self.pending[lane])
+            self.pending[lane].clear()
+        return [job for job in jobs if job.future.set_running_or_notify_cancel()]
+
+    async def takeAsync(self, lane):
+        """
+        Awaits queued jobs of one lane without blocking the event loop.
+
+        Args:
+            lane (str): One of lanes.
+
+        Returns:
+            list: The jobs taken, cancelled ones left out, never empty.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            # Registered under the lock, so no submit can slip in between
+            with self.condition:
+                waiting = not self.pending[lane]
+                if waiting:
+                    event = asyncio.Event()
+                    self.waiters.append((loop, event))
+            if waiting:
+                await event.wait()
+
+            jobs = self.take(lane, timeout=0)
+            if jobs:
+                return jobs
+
+    @staticmethod
+    def finish(job, averageResult, tickerDataZScores):
+        # Wakes every caller waiting on the job
+        job.future.set_result((averageResult, tickerDataZScores))
+
+    @staticmethod
+    def fail(job, error):
+        if not job.done():
+            job.future.set_exception(error)
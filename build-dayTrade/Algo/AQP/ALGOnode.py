@@ -0,0 +1,499 @@
+import os
+import time
+import queue
+import socket
+import struct
+import logging
+import argparse
+import threading
+import socketserver
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+
+from Algo import ALGOdt3
+
+# Setting up logging with detailed formatting
+logging.basicConfig(
+    filename="algoLog.log",
+    level=logging.INFO,
+    format="%(asctime)s:%(levelname)s:%(message)s",
+)
+
+# Port the matcher daemon listens on
+defaultPort = 5150
+
+# Every message starts with magic, protocol version, message type and the
+# length of the payload that follows
+headerFormat = struct.Struct("!4sBBI")
+protocolMagic = b"ALGO"
+protocolVersion = 1
+
+# Message types
+pingMessage = 0
+pongMessage = 1
+queryMessage = 2
+progressMessage = 3
+resultMessage = 4
+errorMessage = 5
+
+# Query payload: firstFile, fileCount, predictionLen and resultSize, then
+# tickerDataMultiplied
+queryFormat = struct.Struct("!IIII")
+
+# Progress payload: fraction, filesDone and totalFiles
+progressFormat = struct.Struct("!dII")
+
+# Result payload: number of matches and prediction rows, then the matches
+# (distance, fileNum, location) and the predictions, both row by row
+resultFormat = struct.Struct("!II")
+
+# Arrays travel as little-endian float64
+arrayType = np.dtype("<f8")
+
+# Errors of a connection the node closed, a timeout is not one of them
+closedErrors = (ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+
+
+class NodeError(Exception):
+    """Exception raised when a node could not answer a query."""
+
+    def __init__(self, message="The algo node failed to answer the query"):
+        self.message = message
+        super().__init__(self.message)
+
+
+def parseAddress(address):
+    """
+    Parses a node address given on the command line.
+
+    Args:
+        address (str): "host:port", ":port", or the path of a Unix socket.
+
+    Returns:
+        The path of a Unix socket, or a (host, port) tuple.
+    """
+    if "/" in address or ":" not in address:
+        return address
+    host, port = address.rsplit(":", 1)
+    return (host or "0.0.0.0", int(port))
+
+
+def sendMessage(sock, messageType, payload=b""):
+    # Header and payload in one send, a frame is never split by the sender
+    sock.sendall(
+        headerFormat.pack(protocolMagic, protocolVersion, messageType, len(payload))
+        + payload
+    )
+
+
+def receiveExactly(sock, size):
+    # Reads size bytes, a closed connection raises ConnectionResetError
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionResetError("Connection closed by the other side")
+        received += count
+    return buffer
+
+
+def receiveMessage(sock):
+    """
+    Reads one message.
+
+    Returns:
+        tuple: (messageType, payload).
+
+    Raises:
+        ConnectionError: When the connection closed or the header is invalid,
+            ConnectionResetError for a closed one.
+    """
+    magic, version, messageType, size = headerFormat.unpack(
+        receiveExactly(sock, headerFormat.size)
+    )
+    if magic != protocolMagic or version != protocolVersion:
+        raise ConnectionError(f"Unsupported message header: {magic!r} v{version}")
+    return messageType, receiveExactly(sock, size)
+
+
+def encodeQuery(firstFile, fileCount, predictionLen, tickerDataMultiplied, resultSize):
+    return (
+        queryFormat.pack(
+            int(firstFile), int(fileCount), int(predictionLen), int(resultSize)
+        )
+        + np.ascontiguousarray(tickerDataMultiplied, dtype=arrayType).tobytes()
+    )
+
+
+def decodeQuery(payload):
+    firstFile, fileCount, predictionLen, resultSize = queryFormat.unpack_from(payload)
+    tickerDataMultiplied = np.frombuffer(
+        payload, dtype=arrayType, offset=queryFormat.size
+    )
+    return (
+        firstFile,
+        fileCount,
+        predictionLen,
+        pd.Series(tickerDataMultiplied),
+        resultSize,
+    )
+
+
+def encodeResult(matches, predictions):
+    return (
+        resultFormat.pack(len(matches), predictions.shape[0])
+        + np.ascontiguousarray(matches, dtype=arrayType).tobytes()
+        + np.ascontiguousarray(predictions, dtype=arrayType).tobytes()
+    )
+
+
+def decodeResult(payload):
+    count, predictionRows = resultFormat.unpack_from(payload)
+    values = np.frombuffer(payload, dtype=arrayType, offset=resultFormat.size)
+    matches = values[: count * 3].reshape(count, 3).copy()
+    predictions = values[count * 3 :].reshape(predictionRows, count).copy()
+    return matches, predictions
+
+
+class ProgressStream:
+    def __init__(self, sock):
+        """
+        Stands in for the progressQueue of ALGOdt3, every message goes to the
+        client as a progress message.
+
+        Args:
+            sock (socket): The connection of the query.
+        """
+        self.sock = sock
+        self.connected = True
+
+    def put(self, message):
+        if not self.connected:
+            return
+        try:
+            sendMessage(
+                self.sock,
+                progressMessage,
+                progressFormat.pack(
+                    message["fraction"], message["filesDone"], message["totalFiles"]
+                ),
+            )
+        except OSError:
+            # The scan finishes anyway, the client is gone
+            self.connected = False
+
+
+class NodeHandler(socketserver.BaseRequestHandler):
+    # One connection, answered message by message until the client closes it
+
+    def setup(self):
+        if self.request.family in (socket.AF_INET, socket.AF_INET6):
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        while True:
+            try:
+                messageType, payload = receiveMessage(self.request)
+            except (ConnectionError, OSError):
+                return
+
+            try:
+                if messageType == pingMessage:
+                    sendMessage(self.request, pongMessage)
+                elif messageType == queryMessage:
+                    sendMessage(self.request, resultMessage, self.runQuery(payload))
+                else:
+                    sendMessage(
+                        self.request,
+                        errorMessage,
+                        f"Unknown message type {messageType}".encode(),
+                    )
+            except OSError:
+                return
+            except Exception as e:
+                logging.exception(f"Error answering algo node query: {e}")
+                try:
+                    sendMessage(self.request, errorMessage, str(e).encode())
+                except OSError:
+                    return
+
+    def runQuery(self, payload):
+        firstFile, fileCount, predictionLen, tickerDataMultiplied, resultSize = (
+            decodeQuery(payload)
+        )
+
+        startTime = time.perf_counter()
+        algoSettings = ALGOdt3.Algo(
+            fileCount,
+            predictionLen,
+            tickerDataMultiplied,
+            ProgressStream(self.request),
+            pool=self.server.pool,
+            firstFile=firstFile,
+            resultSize=resultSize,
+        )
+        matches, predictions = algoSettings.findMatches()
+        logging.info(
+            f"Answered query of files {firstFile} to {firstFile + fileCount} in "
+            f"{time.perf_counter() - startTime:.2f}s"
+        )
+        return encodeResult(matches, predictions)
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+
+    class ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class NodeServer:
+    def __init__(self, address, processes=None):
+        """
+        Matcher daemon of one algo node. Workers stay up between queries and
+        every connection is served by its own thread until the client closes
+        it.
+
+        Args:
+            address: (host, port) to listen on over TCP, or the path of a Unix
+                socket.
+            processes (int): Worker processes, cpu_count if None.
+        """
+        self.address = address
+
+        # Started before any connection thread, so workers fork a clean
+        # process. They report progress through blocks this process unlinks,
+        # so they must use its resource tracker
+        resource_tracker.ensure_running()
+        self.pool = mp.Pool(processes=processes or mp.cpu_count())
+
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = ThreadingUnixServer(address, NodeHandler)
+        else:
+            self.server = ThreadingTCPServer(address, NodeHandler)
+        self.server.pool = self.pool
+
+    def serveForever(self):
+        logging.info(f"Algo node listening on {self.address}")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        # Called from another thread, serveForever returns and closes
+        self.server.shutdown()
+
+    def close(self):
+        self.server.server_close()
+        self.pool.terminate()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class NodeClient:
+    def __init__(self, address, timeout=None):
+        """
+        Persistent connection to one algo node, opened on first use.
+
+        Args:
+            address: (host, port) or the path of a Unix socket.
+            timeout (float): Seconds to wait for the node, None to wait forever.
+        """
+        self.address = address
+        self.timeout = timeout
+        self.sock = None
+
+        # Whether the node answered anything to the current request
+        self.answered = False
+
+    def connect(self):
+        # A connection that could not be opened leaves sock None
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(self.timeout)
+                sock.connect(self.address)
+            except OSError:
+                sock.close()
+                raise
+        else:
+            sock = socket.create_connection(self.address, self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def request(self, messageType, payload=b"", progress=None):
+        """
+        Sends one message and waits for the answer.
+
+        A reused connection the node closed since the last request is opened
+        again once and the message sent again. Every other error, a timeout
+        of a node that is still scanning included, closes the connection and
+        is raised, so no query runs twice on a node.
+
+        Args:
+            messageType (int): The message type.
+            payload (bytes): The payload.
+            progress (callable): Called with (fraction, filesDone, totalFiles)
+                for every progress message of the node.
+
+        Returns:
+            tuple: (messageType, payload) of the answer.
+        """
+        reused = self.sock is not None
+        if not reused:
+            self.connect()
+        try:
+            return self.exchange(messageType, payload, progress)
+        except closedErrors:
+            self.close()
+            # A node reports progress as soon as it starts a query, closed
+            # before any answer means it never took the message
+            if not reused or self.answered:
+                raise
+        except BaseException:
+            self.close()
+            raise
+
+        self.connect()
+        try:
+            return self.exchange(messageType, payload, progress)
+        except BaseException:
+            self.close()
+            raise
+
+    def exchange(self, messageType, payload, progress):
+        self.answered = False
+        sendMessage(self.sock, messageType, payload)
+        while True:
+            answerType, answer = receiveMessage(self.sock)
+            self.answered = True
+            if answerType != progressMessage:
+                return answerType, answer
+            if progress is not None:
+                progress(*progressFormat.unpack(answer))
+
+    def ping(self):
+        """Returns the round trip time to the node in seconds."""
+        startTime = time.perf_counter()
+        answerType, answer = self.request(pingMessage)
+        if answerType != pongMessage:
+            raise NodeError(f"Unexpected answer to ping: {answerType}")
+        return time.perf_counter() - startTime
+
+    def query(
+        self,
+        firstFile,
+        fileCount,
+        predictionLen,
+        tickerDataMultiplied,
+        resultSize=100,
+        progress=None,
+    ):
+        """
+        Runs ALGOdt3 on the node over a range of files.
+
+        Args:
+            firstFile (int): The first file the node scans.
+            fileCount (int): Files the node scans.
+            predictionLen (int): The length of the prediction interval.
+            tickerDataMultiplied (Series): The query, ending in 1.
+            resultSize (int): The number of closest windows returned.
+            progress (callable): See request.
+
+        Returns:
+            tuple: (matches, predictions) of the node, see ALGOdt3.findMatches.
+        """
+        answerType, answer = self.request(
+            queryMessage,
+            encodeQuery(
+                firstFile, fileCount, predictionLen, tickerDataMultiplied, resultSize
+            ),
+            progress,
+        )
+        if answerType == errorMessage:
+            raise NodeError(bytes(answer).decode(errors="replace"))
+        if answerType != resultMessage:
+            raise NodeError(f"Unexpected answer to query: {answerType}")
+        return decodeResult(answer)
+
+
+class NodePool:
+    def __init__(self, address, maxConnections=4, timeout=None):
+        """
+        Pool of NodeClients to one node, so concurrent queries each get a
+        connection and later ones reuse it.
+
+        Args:
+            address: (host, port) or the path of a Unix socket.
+            maxConnections (int): Connections open at once.
+            timeout (float): See NodeClient.
+        """
+        self.address = address
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(maxConnections)
+
+    @contextmanager
+    def client(self):
+        # A client that failed is closed instead of going back to the pool
+        with self.slots:
+            try:
+                client = self.idle.get_nowait()
+            except queue.Empty:
+                client = NodeClient(self.address, self.timeout)
+            try:
+                yield client
+            except BaseException:
+                client.close()
+                raise
+            self.idle.put(client)
+
+    def ping(self):
+        with self.client() as client:
+            return client.ping()
+
+    def query(self, *args, **kwargs):
+        """See NodeClient.query."""
+        with self.client() as client:
+            return client.query(*args, **kwargs)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Algo node matcher daemon")
+    parser.add_argument("command", choices=["serve", "ping"])
+    parser.add_argument("address", help="host:port, :port or the path of a Unix socket")
+    parser.add_argument("--tickerDataPath", default=ALGOdt3.tickerDataPath)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        ALGOdt3.tickerDataPath = args.tickerDataPath
+        NodeServer(parseAddress(args.address), args.processes).serveForever()
+    elif args.command == "ping":
+        client = NodeClient(parseAddress(args.address), timeout=5)
+        print(f"{args.address} answered in {client.ping() * 1000:.1f}ms")
+        client.close()
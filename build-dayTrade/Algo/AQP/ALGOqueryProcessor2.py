@@ -1,68 +1,117 @@
 import pandas as pd
-import yfinance as yf
-import customtkinter as tk
-import queue
-import threading
-import time
+import asyncio
 import logging
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 from Algo import ALGOdt4
+from Algo import ALGOpool
+from Algo import ALGOincremental
+from Algo.AQP import ALGObars
+from Algo.AQP import ALGOjobs
 
-# Set the logging level for yfinance to WARNING or higher
-yfinanceLogger = logging.getLogger("yfinance")
-yfinanceLogger.setLevel(logging.WARNING)
+# Repeating queries whose candidates are kept between refreshes
+maxMatchers = 4
 
 
 class AQP:
-    def __init__(self, main):
+    def __init__(self, main, barCache=None):
         self.main = main
-        self.AQcheck()
 
-    def AQcheck(self):
-        while True:
-            if self.main.ALGOqueryQueue.shape[0] != 0:
-                # Evaluate query
-                self.retreveQueryData(self.main.ALGOqueryQueue.iloc[0])
-            time.sleep(0.1)
+        # Bars are downloaded once per ticker, later queries fetch the tail
+        self.barCache = barCache or ALGObars.BarCache()
 
-    def retreveQueryData(self, ALGOquery):
-        ticker = ALGOquery["ticker"]
-        duration = ALGOquery["duration"]
-        dataSize = ALGOquery["dataSize"]
-        ALGOqueryID = int(ALGOquery["ALGOqueryID"])
+        # Workers stay up between queries with the corpus already open
+        self.ALGOpool = ALGOpool.ALGOpool(ALGOdt4.tickerDataPath)
 
-        successfulDownload = False
-        attempts = 0
-        maxAttempts = 10
-        while not successfulDownload and attempts < maxAttempts:
-            try:
-                # Download the data
-                tickerData = yf.download(
-                    ticker,
-                    group_by="Ticker",
-                    period=duration,
-                    interval="1m",
-                    prepost=False,
-                    repair=True,
-                )
+        # Candidates of repeating queries, like ALGOat3 hold checks
+        self.matchers = {}
 
-                # Reset the index to convert the datetime index to a column and get rid of timezone offest
-                tickerData.index.tz_localize(None)
-                tickerData.reset_index(inplace=True)
+        # Each lane waits on its own scan, the pool workers do the CPU work
+        self.scanExecutor = ThreadPoolExecutor(len(ALGOjobs.lanes))
+
+        asyncio.run(self.AQcheck())
+
+    async def AQcheck(self):
+        # Every lane runs on its own, so a position check never waits for a
+        # scan to end, only for a worker to finish its current chunk
+        await asyncio.gather(*(self.serveLane(lane) for lane in ALGOjobs.lanes))
+
+    async def serveLane(self, lane):
+        # The next batch downloads while the current one is scanned
+        downloaded = asyncio.Queue(maxsize=1)
+        await asyncio.gather(
+            self.downloadBatches(lane, downloaded), self.scanBatches(lane, downloaded)
+        )
 
-                # Keep only the 'Datetime' and 'Close' columns
-                tickerData = tickerData[["Datetime", "Close", "Volume"]]
-                if not tickerData.empty:
-                    successfulDownload = True
+    async def downloadBatches(self, lane, downloaded):
+        while True:
+            # Sleeps until queries are submitted, then takes all of them
+            jobs = await self.main.ALGOjobs.takeAsync(lane)
+
+            # Download every query of the batch at once
+            results = await asyncio.gather(
+                *(self.retreveQueryData(job) for job in jobs), return_exceptions=True
+            )
+            pendingQueries = []
+            for job, result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Error retrieving ALGOquery data: {result}")
+                    self.main.ALGOjobs.fail(job, result)
+                else:
+                    pendingQueries.append(result)
+
+            if pendingQueries:
+                await downloaded.put(pendingQueries)
+
+    async def scanBatches(self, lane, downloaded):
+        loop = asyncio.get_running_loop()
+        while True:
+            pendingQueries = await downloaded.get()
+            try:
+                # Evaluate every waiting query in one pass over the corpus
+                results = await loop.run_in_executor(
+                    self.scanExecutor, self.queryALGO, pendingQueries, lane
+                )
+                for pending, result in zip(pendingQueries, results):
+                    self.finishQuery(pending, result)
             except Exception as e:
-                print(f"ERROR: {e}")
-                attempts += 1
-        if not successfulDownload:
+                logging.exception(f"Error processing ALGOqueries: {e}")
+                for pending in pendingQueries:
+                    self.main.ALGOevents.put(
+                        {"event": "failed", "ALGOquery": pending["ALGOquery"]}
+                    )
+                    self.main.ALGOjobs.fail(pending["job"], e)
+
+    async def retreveQueryData(self, job):
+        """
+        Downloads the data of one ALGOquery and tells the GUI it is queued.
+
+        Args:
+            job (ALGOjob): The job of the query.
+
+        Returns:
+            dict: The job, query, its z-scores, prediction length and matcher.
+        """
+        ALGOquery = job.ALGOquery
+        ticker = ALGOquery["ticker"]
+        duration = ALGOquery["duration"]
+
+        try:
+            # Datetime, Close and Volume, from the cache where possible.
+            # Prefetched queries take the cached bars as they are
+            tickerData = await asyncio.to_thread(
+                self.barCache.bars,
+                ticker,
+                duration,
+                maxAge=float("inf") if ALGOquery.get("cached") == True else None,
+            )
+        except ALGObars.FailedDownload:
             print("FAILED TO DOWNLOAD DATA AFTER SEVERAL ATTEMPTS")
+            raise
 
         # Extract the segment for close and volume
-        tickerDataTimeframe = tickerData["Datetime"].to_numpy()
+        tickerDataTimeframe = tickerData["Datetime"].to_numpy(dtype=object)
         tickerDataClose = tickerData["Close"].to_numpy()
         tickerDataVolume = tickerData["Volume"].to_numpy()
 
@@ -82,89 +131,73 @@ class AQP:
         # Algo predicts 15% of downloaded data length into the future
         predictionLen = tickerData.shape[0] // 5
 
-        # Configure radiobutton text
-        text = ticker + " - " + duration + "\nIn Queue"
-        self.AQradioButton = tk.CTkRadioButton(
-            self.main.graphHistoryFrame,
-            text=text,
-            variable=self.main.AQbuttonVar,
-            value=ALGOqueryID,
-            command=self.main.loadALGOquery,
-            state="disabled",
+        # The GUI adds the radiobutton from its own thread
+        self.main.ALGOevents.put({"event": "queued", "ALGOquery": ALGOquery})
+
+        return {
+            "job": job,
+            "ALGOquery": ALGOquery,
+            "tickerDataZScores": tickerDataZScores,
+            "predictionLen": predictionLen,
+            "matcher": self.matcher(ALGOquery),
+        }
+
+    def queryALGO(self, pendingQueries, lane):
+        """
+        Runs one batch on the pool, in a thread of scanExecutor.
+
+        Returns:
+            list: The prediction DataFrame of every query, in order.
+        """
+        # Call algo once for the whole batch, ahead of less urgent lanes
+        algoSettings = ALGOdt4.Algo(
+            None,
+            None,
+            None,
+            self.main.progressQueue,
+            pool=self.ALGOpool,
+            priority=ALGOjobs.lanes.index(lane),
         )
-        self.AQradioButton.grid(row=ALGOqueryID, column=0, padx=10, pady=(0, 10))
-
-        self.queryALGO(
-            ticker,
-            duration,
-            dataSize,
-            tickerDataZScores,
-            predictionLen,
-            ALGOquery,
+        results = algoSettings.startBatch(
+            [
+                {
+                    "dataSize": int(pending["ALGOquery"]["dataSize"]),
+                    "predictionLen": pending["predictionLen"],
+                    "tickerDataZScores": pending["tickerDataZScores"],
+                    "resultSize": int(pending["ALGOquery"]["resultSize"]),
+                    "matcher": pending["matcher"],
+                    "approximate": pending["ALGOquery"].get("approximate") == True,
+                }
+                for pending in pendingQueries
+            ]
         )
 
-    def queryALGO(
-        self,
-        ticker,
-        duration,
-        dataSize,
-        tickerDataZScores,
-        predictionLen,
-        ALGOquery,
-    ):
-        def queryLocalMachine():
-            # Call algo
-            algoSettings = ALGOdt4.Algo(
-                int(dataSize),
-                predictionLen,
-                tickerDataZScores,
-                self.main.progressQueue,
-            )
-
-            # Return result
-            workerResultQueue.put(algoSettings.startPool())
-
-        # Dataframe to store results from algo
-        averageResult = pd.DataFrame()
-
-        # Queue for results from worker
-        workerResultQueue = queue.Queue()
-
-        # Start local algo instance and wait for completion
-        localMachineThread = threading.Thread(target=queryLocalMachine)
-        localMachineThread.start()
-        localMachineThread.join()
-
         # Number of workers. average result should have 100 columns (100 results)
-        for result in range(1):
-            averageResult = pd.concat([averageResult, workerResultQueue.get()], axis=1)
-
-        # Turn on radiobutton
-        self.AQradioButton.configure(text=ticker + " - " + duration, state="normal")
-
-        # Remove AQ from ALGOqueryQueue
-        self.main.ALGOqueryQueue = self.main.ALGOqueryQueue[1:]
-
-        # Add AQ to history
-        self.main.ALGOqueryHistory = pd.concat(
-            [self.main.ALGOqueryHistory, ALGOquery.to_frame().T], ignore_index=True
+        return [pd.concat([pd.DataFrame(), result], axis=1) for result in results]
+
+    def matcher(self, ALGOquery):
+        # Returns the IncrementalMatcher of a query marked incremental
+        if ALGOquery.get("incremental") != True:
+            return None
+
+        key = (ALGOquery["ticker"], ALGOquery["duration"], ALGOquery["dataSize"])
+        if key not in self.matchers:
+            if len(self.matchers) >= maxMatchers:
+                del self.matchers[next(iter(self.matchers))]
+            self.matchers[key] = ALGOincremental.IncrementalMatcher()
+        return self.matchers[key]
+
+    def finishQuery(self, pending, averageResult):
+        # The GUI shows the result from its own thread, a caller waiting on
+        # the job like ALGOat3 is woken at once
+        self.main.ALGOevents.put(
+            {
+                "event": "done",
+                "ALGOquery": pending["ALGOquery"],
+                "averageResult": averageResult,
+                "tickerDataZScores": pending["tickerDataZScores"],
+            }
+        )
+        self.main.ALGOjobs.finish(
+            pending["job"], averageResult, pending["tickerDataZScores"]
         )
-
-        # Delete data after threshold to prevent unecissary space use
-        self.main.ALGOqueryButtonHistory.append(self.AQradioButton)
-        if len(self.main.ALGOqueryButtonHistory) > 50:
-            self.main.ALGOqueryResultHistory[
-                len(self.main.ALGOqueryResultHistory) - 50
-            ] = 0
-            self.main.ALGOqueryDataHistory[len(self.main.ALGOqueryDataHistory) - 50] = 0
-            self.main.ALGOqueryButtonHistory.pop(0).destroy()
-
-            self.main.ALGOqueryHistory = self.main.ALGOqueryHistory.drop(
-                self.main.ALGOqueryHistory.index[0]
-            )
-
-        # Append AQ dataFrames for future use
-        self.main.ALGOqueryResultHistory.append(averageResult)
-        self.main.ALGOqueryDataHistory.append(tickerDataZScores[:, 1])
-
-        self.AQradioButton.invoke()
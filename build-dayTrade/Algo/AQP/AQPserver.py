@@ -1,244 +1,181 @@
 import pandas as pd
-import yfinance as yf
-import customtkinter as tk
-import queue
-import threading
-import time
+import numpy as np
+import asyncio
 import logging
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker
 
-import subprocess
-import json
+from Algo.AQP import ALGOnode
+from Algo.AQP import ALGOcluster
+from Algo.AQP import ALGObars
+from Algo.AQP import ALGOjobs
 
-from Algo import ALGOdt3
+# Matcher daemons of the other algo nodes, see ALGOnode
+nodeAddresses = [
+    ("192.168.50.234", ALGOnode.defaultPort),
+    ("192.168.50.235", ALGOnode.defaultPort),
+]
 
-# Set the logging level for yfinance to WARNING or higher
-yfinanceLogger = logging.getLogger("yfinance")
-yfinanceLogger.setLevel(logging.WARNING)
+# Seconds without a message before a node counts as down, a scanning node
+# reports progress every ALGOprogress.updateInterval
+nodeTimeout = 30
+
+# ALGOdt3 matches 5-minute closes
+barInterval = "5m"
 
 
 class AQP:
-    def __init__(self, main):
+    def __init__(self, main, barCache=None):
         self.main = main
-        self.AQcheck()
-
-    def AQcheck(self):
-        while True:
-            if self.main.ALGOqueryQueue.shape[0] != 0:
-                # Evaluate query
-                self.retreveQueryData(self.main.ALGOqueryQueue.iloc[0])
-            time.sleep(0.1)
-
-    def retreveQueryData(self, ALGOquery):
-        ticker = ALGOquery["ticker"]
-        duration = ALGOquery["duration"]
-        dataSize = ALGOquery["dataSize"]
-        ALGOqueryID = int(ALGOquery["ALGOqueryID"])
-
-        successfulDownload = False
-        attempts = 0
-        maxAttempts = 10
-        while not successfulDownload and attempts < maxAttempts:
-            try:
-                tickerData = yf.download(
-                    ticker,
-                    group_by="Ticker",
-                    period=duration,
-                    interval="5m",
-                    prepost=False,
-                    repair=True,
-                ).reset_index()["Close"]
-                if not tickerData.empty:
-                    successfulDownload = True
-            except Exception as e:
-                print(attempts)
-                print(f"ERROR: {e}")
-                attempts += 1
-        if not successfulDownload:
-            print("FAILED TO DOWNLOAD DATA AFTER SEVERAL ATTEMPTS")
 
-        # Multiply data to end with "1"
-        multiplyFactor = 1 / tickerData.iloc[-1]
-        tickerDataMultiplied = tickerData.mul(multiplyFactor)
-
-        # Algo predicts 20% of downloaded data length into the future
-        predictionLen = tickerDataMultiplied.shape[0] / 5
-
-        # Configure radiobutton text
-        text = ticker + " - " + duration + "\nIn Queue"
-        self.AQradioButton = tk.CTkRadioButton(
-            self.main.graphHistoryFrame,
-            text=text,
-            variable=self.main.AQbuttonVar,
-            value=ALGOqueryID,
-            command=self.main.loadALGOquery,
-            state="disabled",
-        )
-        self.AQradioButton.grid(row=ALGOqueryID, column=0, padx=10, pady=(0, 10))
-
-        self.queryALGO(
-            ticker,
-            duration,
-            dataSize,
-            tickerData,
-            tickerDataMultiplied,
-            predictionLen,
-            ALGOquery,
+        # Bars are downloaded once per ticker, later queries fetch the tail
+        self.barCache = barCache or ALGObars.BarCache()
+
+        # Local workers stay up between queries, so the throughput measured
+        # for this machine is scanning and not pool startup. They report
+        # progress through blocks this process unlinks
+        resource_tracker.ensure_running()
+        self.localPool = mp.Pool(processes=mp.cpu_count())
+
+        # Connections to the nodes stay open between queries, the coordinator
+        # splits the files between this machine and the nodes
+        nodes = {
+            "local": ALGOcluster.LocalNode(self.main.progressQueue, pool=self.localPool)
+        }
+        for address in nodeAddresses:
+            nodes[address[0]] = ALGOnode.NodePool(address, timeout=nodeTimeout)
+        self.coordinator = ALGOcluster.Coordinator(nodes)
+
+        # Every query runs on all nodes, one at a time so the coordinator
+        # measures each node's throughput on its own
+        self.scanExecutor = ThreadPoolExecutor(1)
+
+        asyncio.run(self.AQcheck())
+
+    async def AQcheck(self):
+        # Lanes download on their own, their scans take turns on the nodes
+        await asyncio.gather(*(self.serveLane(lane) for lane in ALGOjobs.lanes))
+
+    async def serveLane(self, lane):
+        # The next batch downloads while the current one is scanned
+        downloaded = asyncio.Queue(maxsize=1)
+        await asyncio.gather(
+            self.downloadBatches(lane, downloaded), self.scanBatches(downloaded)
         )
 
-    def queryALGO(
-        self,
-        ticker,
-        duration,
-        dataSize,
-        tickerData,
-        tickerDataMultiplied,
-        predictionLen,
-        ALGOquery,
-    ):
-        def queryNode0():
-            # Call algo
-            algoSettings = ALGOdt3.Algo(
-                int(dataSize),
-                predictionLen,
-                tickerDataMultiplied,
-                self.main.progressQueue,
+    async def downloadBatches(self, lane, downloaded):
+        while True:
+            # Sleeps until queries are submitted, then takes all of them
+            jobs = await self.main.ALGOjobs.takeAsync(lane)
+
+            results = await asyncio.gather(
+                *(self.retreveQueryData(job) for job in jobs), return_exceptions=True
             )
+            pendingQueries = []
+            for job, result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Error retrieving ALGOquery data: {result}")
+                    self.main.ALGOjobs.fail(job, result)
+                else:
+                    pendingQueries.append(result)
 
-            # Return result
-            nodeResultQueue.put(algoSettings.startPool())
+            if pendingQueries:
+                await downloaded.put(pendingQueries)
 
-        def queryNode1():
-            ip = "192.168.50.234"
+    async def scanBatches(self, downloaded):
+        loop = asyncio.get_running_loop()
+        while True:
+            pendingQueries = await downloaded.get()
+            for pending in pendingQueries:
+                try:
+                    averageResult = await loop.run_in_executor(
+                        self.scanExecutor, self.queryALGO, pending
+                    )
+                    self.finishQuery(pending, averageResult)
+                except Exception as e:
+                    logging.exception(f"Error processing ALGOquery: {e}")
+                    self.main.ALGOevents.put(
+                        {"event": "failed", "ALGOquery": pending["ALGOquery"]}
+                    )
+                    self.main.ALGOjobs.fail(pending["job"], e)
 
-            # Serialize the data to a JSON string
-            serialized_data = json.dumps(
-                {
-                    "dataSize": int(dataSize * 0.2),
-                    "predictionLen": predictionLen,
-                    "dataPercent": 0.65,
-                    "tickerDataMultiplied": list(tickerDataMultiplied),
-                }
-            )
+    async def retreveQueryData(self, job):
+        """
+        Downloads the closes of one ALGOquery and tells the GUI it is queued.
 
-            # Modify the command to include your Linode program path and enclose the JSON data in single quotes
-            command = [
-                "ssh",
-                f"{username}@{ip}",
-                "python3",
-                programPath,
-                f"'{serialized_data}'",  # Enclose the JSON data in single quotes
-            ]
+        Args:
+            job (ALGOjob): The job of the query.
 
-            try:
-                serverOutput = subprocess.run(
-                    command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
+        Returns:
+            dict: The job, query, its closes ending in 1 and prediction length.
+        """
+        ALGOquery = job.ALGOquery
+        ticker = ALGOquery["ticker"]
+        duration = ALGOquery["duration"]
 
-                if serverOutput.returncode == 0:
-                    nodeResultQueue.put(
-                        pd.read_json(serverOutput.stdout, orient="records")
-                    )
-                else:
-                    print("Error executing the command with algo node 1.")
-                    print("Error output:")
-                    print(serverOutput.stderr)
-            except subprocess.CalledProcessError:
-                print(
-                    "Unable to establish an SSH connection with algo node 1. Please check your credentials."
-                )
-
-        def queryNode2():
-            ip = "192.168.50.235"
-
-            # Serialize the data to a JSON string
-            serialized_data = json.dumps(
-                {
-                    "dataSize": int(dataSize * 0.15),
-                    "predictionLen": predictionLen,
-                    "dataPercent": 0.65,
-                    "tickerDataMultiplied": list(tickerDataMultiplied),
-                }
+        try:
+            # Prefetched queries take the cached bars as they are
+            tickerData = await asyncio.to_thread(
+                self.barCache.bars,
+                ticker,
+                duration,
+                interval=barInterval,
+                maxAge=float("inf") if ALGOquery.get("cached") == True else None,
             )
+        except ALGObars.FailedDownload:
+            print("FAILED TO DOWNLOAD DATA AFTER SEVERAL ATTEMPTS")
+            raise
 
-            # Modify the command to include your Linode program path and enclose the JSON data in single quotes
-            command = [
-                "ssh",
-                f"{username}@{ip}",
-                "python3",
-                programPath,
-                f"'{serialized_data}'",  # Enclose the JSON data in single quotes
-            ]
+        # Multiply data to end with "1"
+        tickerDataClose = tickerData["Close"]
+        tickerDataMultiplied = tickerDataClose.mul(1 / tickerDataClose.iloc[-1])
 
-            try:
-                serverOutput = subprocess.run(
-                    command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-                )
+        # Algo predicts 20% of downloaded data length into the future
+        predictionLen = tickerDataMultiplied.shape[0] / 5
 
-                if serverOutput.returncode == 0:
-                    nodeResultQueue.put(
-                        pd.read_json(serverOutput.stdout, orient="records")
-                    )
-                else:
-                    print("Error executing the command with algo node 1.")
-                    print("Error output:")
-                    print(serverOutput.stderr)
-            except subprocess.CalledProcessError:
-                print(
-                    "Unable to establish an SSH connection with algo node 1. Please check your credentials."
-                )
-
-        # Declare algo connection varibales
-        username = "simon"
-        programPath = "BuyIn/algoDeploy1.py"
-
-        nodeResultQueue = queue.Queue()
-        averageResult = pd.DataFrame()
-
-        # Initiate queryNode threads
-        queryNode0Thread = threading.Thread(target=queryNode0)
-        queryNode1Thread = threading.Thread(target=queryNode1)
-        queryNode2Thread = threading.Thread(target=queryNode2)
-
-        # Start threads
-        queryNode0Thread.start()
-        queryNode1Thread.start()
-        queryNode2Thread.start()
-
-        # Wait for all nodes to complete
-        queryNode0Thread.join()
-        queryNode1Thread.join()
-        queryNode2Thread.join()
-
-        # Number of nodes. average result should have 100 columns (100 results)
-        for result in range(3):
-            averageResult = pd.concat([averageResult, nodeResultQueue.get()], axis=1)
-
-        # Turn on radiobutton
-        self.AQradioButton.configure(text=ticker + " - " + duration, state="normal")
-
-        # Remove AQ from ALGOqueryQueue
-        self.main.ALGOqueryQueue = self.main.ALGOqueryQueue[1:]
-
-        # Add AQ to history
-        self.main.ALGOqueryHistory = self.main.ALGOqueryHistory.append(
-            ALGOquery, ignore_index=True
+        # The GUI adds the radiobutton from its own thread
+        self.main.ALGOevents.put({"event": "queued", "ALGOquery": ALGOquery})
+
+        return {
+            "job": job,
+            "ALGOquery": ALGOquery,
+            "tickerDataMultiplied": tickerDataMultiplied.reset_index(drop=True),
+            "tickerDataTimeframe": tickerData["Datetime"].to_numpy(dtype=object),
+            "predictionLen": predictionLen,
+        }
+
+    def queryALGO(self, pending):
+        """
+        Runs one query on every node, in the thread of scanExecutor.
+
+        Returns:
+            DataFrame: The predictions of the 100 closest windows over all
+            nodes.
+        """
+        return self.coordinator.query(
+            int(pending["ALGOquery"]["dataSize"]),
+            pending["predictionLen"],
+            pending["tickerDataMultiplied"],
         )
 
-        # Delete data after threshold to prevent unecissary space use
-        self.main.ALGOqueryButtonHistory.append(self.AQradioButton)
-        if len(self.main.ALGOqueryButtonHistory) > 50:
-            self.main.ALGOqueryResultHistory[
-                len(self.main.ALGOqueryResultHistory) - 50
-            ] = 0
-            self.main.ALGOqueryDataHistory[len(self.main.ALGOqueryDataHistory) - 50] = 0
-            self.main.ALGOqueryButtonHistory.pop(0).destroy()
-
-            self.main.ALGOqueryHistory = self.main.ALGOqueryHistory.drop(
-                self.main.ALGOqueryHistory.index[0]
-            )
-
-        # Append AQ dataFrames for future use
-        self.main.ALGOqueryResultHistory.append(averageResult)
-        self.main.ALGOqueryDataHistory.append(tickerData)
+    def finishQuery(self, pending, averageResult):
+        # Datetime and the closes ending in 1, in the place of the z-scores of
+        # ALGOqueryProcessor2 so the GUI plots them against the predictions
+        tickerData = np.column_stack(
+            [
+                pending["tickerDataTimeframe"],
+                pending["tickerDataMultiplied"].to_numpy(),
+            ]
+        )
 
-        self.AQradioButton.invoke()
+        # The GUI shows the result from its own thread
+        self.main.ALGOevents.put(
+            {
+                "event": "done",
+                "ALGOquery": pending["ALGOquery"],
+                "averageResult": averageResult,
+                "tickerDataZScores": tickerData,
+            }
+        )
+        self.main.ALGOjobs.finish(pending["job"], averageResult, tickerData)
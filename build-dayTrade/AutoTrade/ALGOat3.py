@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 import pytz
 
 from StockTrader import stockTrader
+from Algo.AQP import ALGObars
 
 # Setting up logging with detailed formatting
 logging.basicConfig(
@@ -15,6 +16,9 @@ logging.basicConfig(
     format="%(asctime)s:%(levelname)s:%(message)s",
 )
 
+# Seconds to wait before repeating a failed hold check
+holdRetryDelay = 1
+
 
 class AutoTrade:
     repeat = True
@@ -54,20 +58,27 @@ class AutoTrade:
         instructionFile = pd.read_csv(self.settings["path"])
 
         while self.repeat == True:
+            watchlistResults = {}
             for index, row in instructionFile.iterrows():
                 if self.repeat == True:
                     ticker = row["ticker"]
-                    dataSize = row["dataSize"]
+
+                    if index not in watchlistResults:
+                        # One pass over the corpus for the rest of the watchlist
+                        watchlistResults = self.watchlistQueries(
+                            instructionFile.loc[index:]
+                        )
 
                     print(f"PROCESSING: {ticker}")
-                    averageResult, tickerDataZscores = self.ALGOquery(
-                        ticker, "1d", dataSize
-                    )
+                    if None in watchlistResults[index].values():
+                        # Queried again on the next pass over the watchlist
+                        print(f"FAILED QUERY: {ticker}")
+                        continue
+
+                    averageResult, tickerDataZscores = watchlistResults[index]["1d"]
 
                     if averageResult.iloc[-1] > tickerDataZscores[-1, 1]:
-                        averageResult, tickerDataZscores = self.ALGOquery(
-                            ticker, "5d", dataSize
-                        )
+                        averageResult, tickerDataZscores = watchlistResults[index]["5d"]
                         if averageResult.iloc[-1] > tickerDataZscores[-1, 1]:
                             # Check if market is open
                             if marketOpenCheck() == True:
@@ -94,18 +105,33 @@ class AutoTrade:
                                     if self.repeat == True:
                                         holdExceptions = 0
 
-                                        averageResult, tickerDataZscores = (
-                                            self.ALGOquery(ticker, "1d", dataSize)
-                                        )
+                                        # Both durations in one pass, refreshed
+                                        # from the previous hold check
+                                        holdResults = self.watchlistQueries(
+                                            instructionFile.loc[[index]],
+                                            incremental=True,
+                                        )[index]
+                                        if None in holdResults.values():
+                                            # The position stays open until
+                                            # a check goes through
+                                            logging.error(
+                                                f"FAILED HOLD CHECK OF {ticker}, RETRYING"
+                                            )
+                                            time.sleep(holdRetryDelay)
+                                            continue
+
+                                        averageResult, tickerDataZscores = holdResults[
+                                            "1d"
+                                        ]
                                         if (
                                             averageResult.iloc[-1]
                                             < tickerDataZscores[-1, 1]
                                         ):
                                             holdExceptions += 1
 
-                                        averageResult, tickerDataZscores = (
-                                            self.ALGOquery(ticker, "5d", dataSize)
-                                        )
+                                        averageResult, tickerDataZscores = holdResults[
+                                            "5d"
+                                        ]
                                         if (
                                             averageResult.iloc[-1]
                                             < tickerDataZscores[-1, 1]
@@ -142,6 +168,9 @@ class AutoTrade:
 
                                         hold = False
 
+                                # Signals of the rest of the watchlist are stale now
+                                watchlistResults = {}
+
                             else:
                                 logging.info(
                                     f"FAILED LONG BUY OF {ticker} BY MARKET CLOSURE"
@@ -149,9 +178,7 @@ class AutoTrade:
                                 print(f"FAILED LONG BUY OF {ticker} BY MARKET CLOSURE")
 
                     elif averageResult.iloc[-1] < tickerDataZscores[-1, 1]:
-                        averageResult, tickerDataZscores = self.ALGOquery(
-                            ticker, "5d", dataSize
-                        )
+                        averageResult, tickerDataZscores = watchlistResults[index]["5d"]
                         if averageResult.iloc[-1] < tickerDataZscores[-1, 1]:
                             # Check if market is open
                             if marketOpenCheck() == True:
@@ -179,18 +206,33 @@ class AutoTrade:
                                     if self.repeat == True:
                                         holdExceptions = 0
 
-                                        averageResult, tickerDataZscores = (
-                                            self.ALGOquery(ticker, "1d", dataSize)
-                                        )
+                                        # Both durations in one pass, refreshed
+                                        # from the previous hold check
+                                        holdResults = self.watchlistQueries(
+                                            instructionFile.loc[[index]],
+                                            incremental=True,
+                                        )[index]
+                                        if None in holdResults.values():
+                                            # The position stays open until
+                                            # a check goes through
+                                            logging.error(
+                                                f"FAILED HOLD CHECK OF {ticker}, RETRYING"
+                                            )
+                                            time.sleep(holdRetryDelay)
+                                            continue
+
+                                        averageResult, tickerDataZscores = holdResults[
+                                            "1d"
+                                        ]
                                         if (
                                             averageResult.iloc[-1]
                                             > tickerDataZscores[-1, 1]
                                         ):
                                             holdExceptions += 1
 
-                                        averageResult, tickerDataZscores = (
-                                            self.ALGOquery(ticker, "5d", dataSize)
-                                        )
+                                        averageResult, tickerDataZscores = holdResults[
+                                            "5d"
+                                        ]
                                         if (
                                             averageResult.iloc[-1]
                                             > tickerDataZscores[-1, 1]
@@ -227,6 +269,9 @@ class AutoTrade:
 
                                         hold = False
 
+                                # Signals of the rest of the watchlist are stale now
+                                watchlistResults = {}
+
                             else:
                                 logging.info(
                                     f"FAILED SHORT BUY OF {ticker} BY MARKET CLOSURE"
@@ -239,23 +284,87 @@ class AutoTrade:
 
         print("ALGOat TERMINATED")
 
-    def ALGOquery(self, ticker, duration, dataSize):
-        ALGOquery = pd.DataFrame(
-            {
-                "ticker": [ticker],
-                "duration": [duration],
-                "dataSize": [dataSize],
-                "resultSize": [100],
-                "ALGOqueryID": [self.main.ALGOqueryID],
-            }
+    def watchlistQueries(self, instructions, incremental=False):
+        """
+        Queries the 1d and 5d matches of several watchlist rows in one batch.
+
+        Args:
+            instructions (DataFrame): Rows of the instruction file.
+            incremental (bool): Let the AQP refresh the previous matches of
+                the same queries instead of scanning the corpus again.
+
+        Returns:
+            dict: Row index -> {"1d": result, "5d": result}, see ALGOqueries.
+        """
+        durations = ("1d", "5d")
+
+        # Download every ticker of the batch up front, its queries then read
+        # the cache. Hold checks download their own fresh bars
+        if not incremental:
+            self.main.barCache.prefetch(
+                instructions["ticker"], max(durations, key=ALGObars.periodDays)
+            )
+
+        results = iter(
+            self.ALGOqueries(
+                [
+                    (row["ticker"], duration, row["dataSize"])
+                    for _, row in instructions.iterrows()
+                    for duration in durations
+                ],
+                incremental,
+                cached=not incremental,
+                lane="position" if incremental else "watchlist",
+            )
         )
-        self.main.ALGOqueryID += 1
+        return {
+            index: {duration: next(results) for duration in durations}
+            for index in instructions.index
+        }
 
-        self.main.ALGOqueryQueue = pd.concat([self.main.ALGOqueryQueue, ALGOquery])
+    def ALGOqueries(self, requests, incremental=False, cached=False, lane="watchlist"):
+        """
+        Queues several ALGOqueries at once so the AQP runs them as one batch.
+
+        Args:
+            requests (list): (ticker, duration, dataSize) of every query.
+            incremental (bool): See watchlistQueries.
+            cached (bool): Read the prefetched bars instead of checking for
+                newer ones.
+            lane (str): The AQP lane, see ALGOjobs.lanes.
+
+        Returns:
+            list: (averageResult, tickerDataZScores) of every query, in order,
+            None for a query that failed.
+        """
+        jobs = self.main.ALGOjobs.submit(
+            [
+                {
+                    "ticker": ticker,
+                    "duration": duration,
+                    "dataSize": dataSize,
+                    "resultSize": 100,
+                    "incremental": incremental,
+                    "cached": cached,
+                }
+                for ticker, duration, dataSize in requests
+            ],
+            lane,
+        )
 
-        # Wait for AQ to be completed
-        while self.main.ALGOqueryQueue.shape[0] != 0:
-            time.sleep(0.1)
+        # Each job wakes this thread as soon as its AQ is completed
+        results = []
+        for job in jobs:
+            try:
+                averageResult, tickerDataZScores = job.result()
+            except Exception as e:
+                # A failed download or scan is left to the caller to retry
+                logging.error(f"ALGOquery of {job.ALGOquery['ticker']} failed: {e}")
+                print(e)
+                results.append(None)
+                continue
+            results.append((averageResult.mean(axis=1), tickerDataZScores))
+        return results
 
-        print(self.main.ALGOqueryDataHistory)
-        return self.main.ALGOqueryResultHistory[-1].mean(axis=1)
+    def ALGOquery(self, ticker, duration, dataSize):
+        return self.ALGOqueries([(ticker, duration, dataSize)], lane="manual")[0]
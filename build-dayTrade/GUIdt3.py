@@ -5,12 +5,12 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import pandas as pd
 import warnings
 
-import multiprocessing as mp
 import threading
 import queue
 import sys
 
 from AutoTrade import ALGOat3
+from Algo import ALGOprogress
 from Algo.AQP import ALGOqueryProcesor
 
 # Suppress FutureWarnings
@@ -41,9 +41,8 @@ class App(tk.CTk):
 
                 while True:  # Keep checking progression in the queue
                     progress = self.progressQueue.get_nowait()
-                    if progress:
-                        # Update the progress bar with the current value of self.progressValue
-                        self.progressBar.set(progress)
+                    # Update the progress bar with the current value of self.progressValue
+                    self.progressBar.set(ALGOprogress.progressFraction(progress))
             except queue.Empty:
                 pass
             finally:
@@ -80,9 +79,8 @@ class App(tk.CTk):
         self.progressBar.grid(row=3, columnspan=3, sticky="ew")
         self.progressBar.set(0)
 
-        # Shared queue of progress updates
-        manager = mp.Manager()
-        self.progressQueue = manager.Queue()
+        # Queue of progress updates, filled by the AQP thread
+        self.progressQueue = queue.Queue()
 
         # Initilize AQP
         AQthread = threading.Thread(target=lambda: ALGOqueryProcesor.AQP(self))
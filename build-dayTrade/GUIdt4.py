@@ -5,13 +5,15 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import pandas as pd
 import warnings
 
-import multiprocessing as mp
 import threading
 import queue
 import sys
 
 from AutoTrade import ALGOat3
+from Algo import ALGOprogress
 from Algo.AQP import ALGOqueryProcessor2
+from Algo.AQP import ALGObars
+from Algo.AQP import ALGOjobs
 
 # Suppress FutureWarnings
 warnings.simplefilter(action="ignore", category=FutureWarning)
@@ -29,6 +31,16 @@ class stdoutRedirector(object):
         pass
 
 
+def progressText(progress):
+    # Files, rows and time left of an ALGOprogress message
+    text = f"{progress['filesDone']}/{progress['totalFiles']} files"
+    if progress["rowsScanned"]:
+        text += f", {progress['rowsScanned']:,} rows"
+    if progress["eta"] is not None and progress["fraction"] < 1:
+        text += f", {progress['eta']:.0f}s left"
+    return text
+
+
 class App(tk.CTk):
     def __init__(self):
         super().__init__()
@@ -39,11 +51,14 @@ class App(tk.CTk):
                 self.liveAlgoLogUpdates.insert(tk.END, open("algoLog.log").read())
                 self.liveAlgoLogUpdates.see(tk.END)
 
+                self.showALGOevents()
+
                 while True:  # Keep checking progression in the queue
                     progress = self.progressQueue.get_nowait()
-                    if progress:
-                        # Update the progress bar with the current value of self.progressValue
-                        self.progressBar.set(progress)
+                    # Update the progress bar with the current value of self.progressValue
+                    self.progressBar.set(ALGOprogress.progressFraction(progress))
+                    if isinstance(progress, dict):
+                        self.progressLabel.configure(text=progressText(progress))
             except queue.Empty:
                 pass
             finally:
@@ -52,14 +67,8 @@ class App(tk.CTk):
         # Declare int var to use for graph history radiobutton
         self.AQbuttonVar = tk.IntVar()
 
-        self.ALGOqueryQueue = pd.DataFrame(
-            columns=[
-                "ticker",
-                "duration",
-                "dataSize",
-                "resultSize",
-            ]
-        )
+        # ALGOqueries waiting for the AQP, see ALGOjobs
+        self.ALGOjobs = ALGOjobs.JobQueue()
         self.ALGOqueryHistory = pd.DataFrame(
             columns=[
                 "ticker",
@@ -69,23 +78,33 @@ class App(tk.CTk):
             ]
         )
 
-        self.ALGOqueryResultHistory = []
-        self.ALGOqueryDataHistory = []
+        # Results of the last 50 AQs by ALGOqueryID
+        self.ALGOqueryResultHistory = {}
+        self.ALGOqueryDataHistory = {}
         self.ALGOqueryButtonHistory = []
 
-        self.ALGOqueryID = 0
+        # Queued, finished and failed AQs, filled by the AQP thread. Only this
+        # thread touches the widgets, see showALGOevents
+        self.ALGOevents = queue.Queue()
+        self.ALGOqueryPendingButtons = {}
 
         # Declare progressBar and set it to 0
         self.progressBar = tk.CTkProgressBar(self, height=10)
         self.progressBar.grid(row=3, columnspan=3, sticky="ew")
         self.progressBar.set(0)
+        self.progressLabel = tk.CTkLabel(self, text="", height=14)
+        self.progressLabel.grid(row=4, columnspan=3, sticky="w", padx=10)
 
-        # Shared queue of progress updates
-        manager = mp.Manager()
-        self.progressQueue = manager.Queue()
+        # Queue of progress updates, filled by the AQP thread
+        self.progressQueue = queue.Queue()
+
+        # Bars shared by the AQP and the AutoTrade prefetch
+        self.barCache = ALGObars.BarCache()
 
         # Initilize AQP
-        AQthread = threading.Thread(target=lambda: ALGOqueryProcessor2.AQP(self))
+        AQthread = threading.Thread(
+            target=lambda: ALGOqueryProcessor2.AQP(self, self.barCache)
+        )
         AQthread.start()
 
         self.configureWindow()
@@ -93,9 +112,8 @@ class App(tk.CTk):
         self.declareGraph()
         self.declareTabView()
 
-        # Run function to check for progress updates inside other thread
-        updateProgressBarThread = threading.Thread(target=updateApp)
-        updateProgressBarThread.start()
+        # Check for progress updates and AQP events on the GUI thread
+        self.after(100, updateApp)
 
     def configureWindow(self):
         # Set title and resizing properties
@@ -162,10 +180,17 @@ class App(tk.CTk):
                     self.spDurationBox.get(),
                     self.spDataSizeSlider.get(),
                     self.spResultSizeSlider.get(),
+                    self.spApproximateSwitch.get(),
                 ),
             )
             self.spButton.grid(row=2, column=0, padx=10, pady=(10, 0))
 
+            # Trade exactness for speed through the approximate index
+            self.spApproximateSwitch = tk.CTkSwitch(
+                self.tabview.tab("Stock Predict"), text="Approximate"
+            )
+            self.spApproximateSwitch.grid(row=3, column=0, padx=10, pady=(10, 0))
+
             self.spDataSizeLabel = tk.CTkLabel(
                 self.tabview.tab("Stock Predict"), text="Database Size - Result Size"
             )
@@ -259,24 +284,96 @@ class App(tk.CTk):
             sticky="nsew",
         )
 
-    def ALGOquery(self, ticker, duration, dataSize, resultSize):
-        ALGOquery = pd.DataFrame(
-            {
-                "ticker": [ticker],
-                "duration": [duration],
-                "dataSize": [dataSize],
-                "resultSize": [resultSize],
-                "ALGOqueryID": [self.ALGOqueryID],
-            }
+    def ALGOquery(self, ticker, duration, dataSize, resultSize, approximate=False):
+        # The AQP shows the result once done, nothing waits on the job here
+        return self.ALGOjobs.submit(
+            [
+                {
+                    "ticker": ticker,
+                    "duration": duration,
+                    "dataSize": dataSize,
+                    "resultSize": resultSize,
+                    "approximate": bool(approximate),
+                }
+            ]
+        )[0]
+
+    def showALGOevents(self):
+        # Shows every AQP event that arrived since the last update
+        while True:
+            try:
+                event = self.ALGOevents.get_nowait()
+            except queue.Empty:
+                return
+
+            ALGOquery = event["ALGOquery"]
+            ALGOqueryID = int(ALGOquery["ALGOqueryID"])
+            if event["event"] == "queued":
+                self.ALGOqueryPendingButtons[ALGOqueryID] = self.addALGOqueryButton(
+                    ALGOquery
+                )
+            elif event["event"] == "done":
+                self.finishALGOquery(
+                    ALGOquery, event["averageResult"], event["tickerDataZScores"]
+                )
+            elif event["event"] == "failed":
+                AQradioButton = self.ALGOqueryPendingButtons.pop(ALGOqueryID, None)
+                if AQradioButton is not None:
+                    AQradioButton.destroy()
+
+    def addALGOqueryButton(self, ALGOquery):
+        # Disabled radiobutton of an AQ waiting to be scanned
+        ALGOqueryID = int(ALGOquery["ALGOqueryID"])
+        text = ALGOquery["ticker"] + " - " + ALGOquery["duration"] + "\nIn Queue"
+        AQradioButton = tk.CTkRadioButton(
+            self.graphHistoryFrame,
+            text=text,
+            variable=self.AQbuttonVar,
+            value=ALGOqueryID,
+            command=self.loadALGOquery,
+            state="disabled",
+        )
+        AQradioButton.grid(row=ALGOqueryID, column=0, padx=10, pady=(0, 10))
+        return AQradioButton
+
+    def finishALGOquery(self, ALGOquery, averageResult, tickerDataZScores):
+        ALGOqueryID = int(ALGOquery["ALGOqueryID"])
+        AQradioButton = self.ALGOqueryPendingButtons.pop(ALGOqueryID, None)
+        if AQradioButton is None:
+            AQradioButton = self.addALGOqueryButton(ALGOquery)
+
+        # Turn on radiobutton
+        AQradioButton.configure(
+            text=ALGOquery["ticker"] + " - " + ALGOquery["duration"], state="normal"
+        )
+
+        # Add AQ to history
+        self.ALGOqueryHistory = pd.concat(
+            [self.ALGOqueryHistory, ALGOquery.to_frame().T], ignore_index=True
         )
-        self.ALGOqueryID += 1
 
-        self.ALGOqueryQueue = pd.concat([self.ALGOqueryQueue, ALGOquery])
+        # Keep AQ dataFrames for future use, by ALGOqueryID
+        self.ALGOqueryResultHistory[ALGOqueryID] = averageResult
+        self.ALGOqueryDataHistory[ALGOqueryID] = tickerDataZScores[:, 1]
+
+        # Delete data after threshold to prevent unecissary space use
+        self.ALGOqueryButtonHistory.append(AQradioButton)
+        if len(self.ALGOqueryButtonHistory) > 50:
+            oldestID = int(self.ALGOqueryHistory["ALGOqueryID"].iloc[0])
+            del self.ALGOqueryResultHistory[oldestID]
+            del self.ALGOqueryDataHistory[oldestID]
+            self.ALGOqueryButtonHistory.pop(0).destroy()
+
+            self.ALGOqueryHistory = self.ALGOqueryHistory.drop(
+                self.ALGOqueryHistory.index[0]
+            )
+
+        AQradioButton.invoke()
 
     def loadALGOquery(self):
         # Determine which radio button is currently clicked
         ALGOquery = self.ALGOqueryHistory[
-            self.ALGOqueryHistory.iloc[:, 4] == self.AQbuttonVar.get()
+            self.ALGOqueryHistory["ALGOqueryID"] == self.AQbuttonVar.get()
         ]
 
         # Configure sp widget values based on selected radiobutton
@@ -285,6 +382,12 @@ class App(tk.CTk):
         self.spDurationBox.set(ALGOquery.iloc[0, 1])
         self.spDataSizeSlider.set(int(ALGOquery.iloc[0, 2]))
         self.spResultSizeSlider.set(int(ALGOquery.iloc[0, 3]))
+        if ALGOquery.get("approximate") is not None and (
+            ALGOquery["approximate"].iloc[0] == True
+        ):
+            self.spApproximateSwitch.select()
+        else:
+            self.spApproximateSwitch.deselect()
 
         self.updateResultSize(ALGOquery.iloc[0, 3])
 
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+
+from Algo import ALGOann
+from Algo import ALGOcorpus
+from tests.test_ALGOcorpus import syntheticTickers
+from tests.test_ALGOdt4 import tickerDataZScores
+from tests.test_ALGOscan import syntheticTicker
+
+# Bars of every ticker appended after the indexes are built
+appendedRows = 700
+
+
+class AnnTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.csvPath = os.path.join(self.path, "csv")
+        os.makedirs(self.csvPath)
+        self.tickers = syntheticTickers((12, 14, 10))
+        for name, bars in self.tickers.items():
+            bars.iloc[:-appendedRows].to_csv(
+                os.path.join(self.csvPath, name + ".csv"), index=False
+            )
+        self.corpus = ALGOcorpus.buildIndex(ALGOcorpus.buildCorpus(self.csvPath))
+        ALGOann.buildAnn(self.corpus, windowLens=(390,))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def append(self):
+        return ALGOcorpus.appendCorpus(
+            self.corpus,
+            {name: bars.iloc[-appendedRows:] for name, bars in self.tickers.items()},
+        )
+
+    def queries(self):
+        # Anchors across the session with different result sizes
+        source = syntheticTicker(4, seed=9)
+        for end, resultSize in ((500, 1), (833, 10), (1169, 50)):
+            yield {
+                "tickerDataZScores": tickerDataZScores(source.iloc[end - 390 : end]),
+                "predictionLen": 78,
+                "dataSize": 3,
+                "resultSize": resultSize,
+            }
+
+    def assertFullRecall(self, corpus):
+        # Every candidate is re-ranked, so nothing is missed
+        with mock.patch.object(ALGOann, "candidateFactor", 10**6):
+            for query in self.queries():
+                with self.subTest(resultSize=query["resultSize"]):
+                    result = ALGOann.approximateTopK(corpus, query)
+                    expected = ALGOann.exactTopK(corpus, query)
+                    self.assertGreater(len(expected[0]), 0)
+                    for values, reference in zip(result, expected):
+                        np.testing.assert_array_equal(values, reference)
+
+    def test_largeCandidateFactorIsExact(self):
+        self.assertFullRecall(self.corpus)
+
+    def test_appendMatchesRebuild(self):
+        corpus = self.append()
+        index = ALGOann.openAnn(corpus, 390)
+        self.assertIsNotNone(index)
+        self.assertGreater(index.meta["deltaWindows"], 0)
+
+        # A fresh index over a copy of the appended corpus
+        freshPath = os.path.join(self.path, "fresh")
+        shutil.copytree(corpus.binPath, freshPath)
+        shutil.rmtree(os.path.join(freshPath, ALGOann.annName))
+        fresh = ALGOcorpus.Corpus(freshPath)
+        ALGOann.buildAnn(fresh, windowLens=(390,))
+        freshIndex = ALGOann.openAnn(fresh, 390)
+
+        for anchorMinute in (570, 600, 779, 959):
+            with self.subTest(anchorMinute=anchorMinute):
+                summaries, fileIds, ends = index.bucket(anchorMinute)
+                freshSummaries, freshFileIds, freshEnds = freshIndex.bucket(
+                    anchorMinute
+                )
+                order = np.lexsort((ends, fileIds))
+                freshOrder = np.lexsort((freshEnds, freshFileIds))
+                np.testing.assert_array_equal(fileIds[order], freshFileIds[freshOrder])
+                np.testing.assert_array_equal(ends[order], freshEnds[freshOrder])
+                np.testing.assert_allclose(
+                    summaries[order], freshSummaries[freshOrder], rtol=1e-5, atol=1e-5
+                )
+
+        self.assertFullRecall(corpus)
+
+
+if __name__ == "__main__":
+    unittest.main()
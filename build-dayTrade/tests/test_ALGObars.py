@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+from Algo.AQP import ALGObars
+
+
+def writeBars(path, ticker, days, seed=0):
+    # 1-minute bars of the given number of sessions, like YahooProvider returns
+    rng = np.random.default_rng(seed)
+    sessions = pd.bdate_range("2023-01-02", periods=days)
+    datetimes = np.concatenate(
+        [
+            pd.date_range(session + pd.Timedelta("9:30:00"), periods=390, freq="min")
+            for session in sessions
+        ]
+    )
+    bars = pd.DataFrame(
+        {
+            "Datetime": datetimes,
+            "Close": 100 + np.cumsum(rng.normal(0, 0.1, len(datetimes))),
+            "Volume": rng.integers(1000, 100000, len(datetimes)).astype(float),
+        }
+    )
+    bars.to_csv(os.path.join(path, ticker + ".csv"), index=False)
+    return bars
+
+
+class BarCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.barPath = os.path.join(self.path, "bars")
+        os.makedirs(self.barPath)
+        self.bars = {
+            ticker: writeBars(self.barPath, ticker, 8, seed)
+            for seed, ticker in enumerate(["AAA", "BBB", "CCC"])
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def barCache(self, provider, **settings):
+        return ALGObars.BarCache(
+            provider, os.path.join(self.path, "cache"), backoff=0.01, **settings
+        )
+
+    def test_cacheHit(self):
+        provider = ALGObars.FileProvider(self.barPath)
+        barCache = self.barCache(provider)
+
+        fiveDays = barCache.bars("AAA", "5d")
+        oneDay = barCache.bars("AAA", "1d")
+        self.assertEqual(len(provider.calls), 1)
+        self.assertEqual(fiveDays["Datetime"].dt.normalize().nunique(), 5)
+        pd.testing.assert_frame_equal(oneDay, ALGObars.lastDays(self.bars["AAA"], 1))
+
+        # A new cache reads the bars persisted by the first one
+        barCache = self.barCache(provider, maxAge=float("inf"))
+        pd.testing.assert_frame_equal(barCache.bars("AAA", "5d"), fiveDays)
+        self.assertEqual(len(provider.calls), 1)
+
+    def test_tailFetchMerge(self):
+        provider = ALGObars.FileProvider(
+            self.barPath, now=pd.Timestamp("2023-01-11 12:00")
+        )
+        barCache = self.barCache(provider, maxAge=0)
+        barCache.bars("AAA", "5d")
+
+        # The last cached bar changes and the session goes on
+        bars = self.bars["AAA"]
+        lastCached = pd.Timestamp("2023-01-11 12:00")
+        bars.loc[bars["Datetime"] == lastCached, "Close"] += 1
+        bars.to_csv(os.path.join(self.barPath, "AAA.csv"), index=False)
+        provider.now = pd.Timestamp("2023-01-12 10:00")
+
+        result = barCache.bars("AAA", "5d")
+        self.assertEqual(provider.calls[-1], ("AAA", "1m", None, lastCached))
+        expected = ALGObars.lastDays(bars[bars["Datetime"] <= provider.now], 5)
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_backoffAfterFailedDownload(self):
+        provider = ALGObars.FileProvider(self.barPath)
+        barCache = self.barCache(provider, maxAttempts=4)
+
+        with mock.patch.object(ALGObars.time, "sleep") as sleep:
+            with self.assertRaises(ALGObars.FailedDownload):
+                barCache.bars("NOPE", "1d")
+        self.assertEqual(len(provider.calls), 4)
+        self.assertEqual(
+            [call.args[0] for call in sleep.call_args_list], [0.01, 0.02, 0.04]
+        )
+
+        # A failed tail download serves the cached bars
+        cached = barCache.bars("AAA", "1d")
+        os.remove(os.path.join(self.barPath, "AAA.csv"))
+        with mock.patch.object(ALGObars.time, "sleep"):
+            pd.testing.assert_frame_equal(barCache.bars("AAA", "1d", maxAge=0), cached)
+
+    def test_prefetch(self):
+        provider = ALGObars.FileProvider(self.barPath)
+        barCache = self.barCache(provider, maxAttempts=1)
+
+        failed = barCache.prefetch(["AAA", "BBB", "NOPE", "AAA", "CCC"], "5d")
+        self.assertEqual(failed, ["NOPE"])
+        self.assertEqual(
+            sorted(call[0] for call in provider.calls), ["AAA", "BBB", "CCC", "NOPE"]
+        )
+
+        # The queries that follow read the prefetched bars
+        for ticker in ("AAA", "BBB", "CCC"):
+            for period in ("1d", "5d"):
+                barCache.bars(ticker, period, maxAge=float("inf"))
+        self.assertEqual(len(provider.calls), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
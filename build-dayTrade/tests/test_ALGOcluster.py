@@ -0,0 +1,177 @@
+import threading
+import time
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+from Algo import ALGOscan
+from Algo.AQP import ALGOcluster
+from Algo.AQP import ALGOnode
+
+
+class FakeNode:
+    def __init__(self, distances, error=None, delay=None):
+        """
+        Stands in for a node, answering from a table of window distances.
+
+        Args:
+            distances (NumPy array): Distance of every row of every file.
+            error (Exception): Raised by every query instead of answering.
+            delay (float): Seconds a query waits on release before answering.
+        """
+        self.distances = distances
+        self.error = error
+        self.delay = delay
+        self.release = threading.Event()
+        self.calls = []
+
+    def query(
+        self,
+        firstFile,
+        fileCount,
+        predictionLen,
+        tickerDataMultiplied,
+        resultSize=100,
+        progress=None,
+    ):
+        self.calls.append((firstFile, fileCount))
+        if self.error is not None:
+            raise self.error
+        if self.delay is not None:
+            self.release.wait(self.delay)
+
+        # Like ALGOdt3.findMatches, the prediction of a match encodes it
+        topResults = ALGOscan.TopK(resultSize)
+        for fileId in range(firstFile, firstFile + fileCount):
+            rows = np.arange(self.distances.shape[1])
+            topResults.push(self.distances[fileId], fileId, rows)
+        distances, fileIds, rows = topResults.result()
+        return (
+            np.column_stack([distances, fileIds, rows]).astype(float),
+            np.vstack([distances, fileIds, rows]).astype(float),
+        )
+
+
+class SplitRangeTest(unittest.TestCase):
+    def assertCovers(self, ranges, firstFile, fileCount):
+        # Consecutive, disjoint and covering every file once
+        files = [
+            fileId
+            for start, count in sorted(ranges.values())
+            for fileId in range(start, start + count)
+        ]
+        self.assertEqual(files, list(range(firstFile, firstFile + fileCount)))
+        self.assertTrue(all(count > 0 for _, count in ranges.values()))
+
+    def test_unevenWeights(self):
+        ranges = ALGOcluster.splitRange(7, 100, {"a": 1.0, "b": 3.0, "c": 0.5})
+        self.assertCovers(ranges, 7, 100)
+        self.assertEqual(ranges["a"], (7, 22))
+        self.assertGreater(ranges["b"][1], 3 * ranges["c"][1])
+
+    def test_zeroWeight(self):
+        ranges = ALGOcluster.splitRange(0, 10, {"a": 0.0, "b": 2.0, "c": 1.0})
+        self.assertNotIn("a", ranges)
+        self.assertCovers(ranges, 0, 10)
+
+    def test_fewerFilesThanNodes(self):
+        ranges = ALGOcluster.splitRange(3, 2, dict.fromkeys("abcde", 1.0))
+        self.assertEqual(len(ranges), 2)
+        self.assertCovers(ranges, 3, 2)
+
+        self.assertEqual(ALGOcluster.splitRange(0, 0, {"a": 1.0}), {})
+
+
+class MergeMatchesTest(unittest.TestCase):
+    def test_equalsSingleTopK(self):
+        # Few distinct distances, so ties cross the parts
+        rng = np.random.default_rng(0)
+        distances = rng.integers(0, 20, (12, 40)).astype(float)
+        node = FakeNode(distances)
+
+        parts = [
+            node.query(firstFile, 3, 0, None, resultSize=25)
+            for firstFile in range(0, 12, 3)
+        ]
+        matches, predictions = ALGOcluster.mergeMatches(parts, 25)
+        expected = node.query(0, 12, 0, None, resultSize=25)
+
+        np.testing.assert_array_equal(matches, expected[0])
+        np.testing.assert_array_equal(predictions, expected[1])
+
+
+class CoordinatorTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.distances = rng.integers(0, 50, (20, 30)).astype(float)
+        self.expected = pd.DataFrame(FakeNode(self.distances).query(0, 20, 0, None)[1])
+
+    def query(self, coordinator):
+        return coordinator.query(20, 0, pd.Series(np.ones(10)))
+
+    def test_splitMatchesSingleNode(self):
+        nodes = {name: FakeNode(self.distances) for name in ("a", "b", "c")}
+        coordinator = ALGOcluster.Coordinator(nodes)
+        pd.testing.assert_frame_equal(self.query(coordinator), self.expected)
+        self.assertTrue(all(node.calls for node in nodes.values()))
+        self.assertEqual(set(coordinator.throughput), set(nodes))
+
+    def test_failover(self):
+        for error in (ALGOnode.NodeError("node crashed"), TimeoutError("timed out")):
+            with self.subTest(error=type(error).__name__):
+                nodes = {
+                    "a": FakeNode(self.distances),
+                    "down": FakeNode(self.distances, error=error),
+                    "b": FakeNode(self.distances),
+                }
+                coordinator = ALGOcluster.Coordinator(nodes)
+                startTime = time.time()
+                pd.testing.assert_frame_equal(self.query(coordinator), self.expected)
+
+                # Left out until retryAfter has passed
+                self.assertGreaterEqual(
+                    coordinator.downUntil["down"],
+                    startTime + ALGOcluster.retryAfter,
+                )
+                self.query(coordinator)
+                self.assertEqual(len(nodes["down"].calls), 1)
+
+                coordinator.downUntil["down"] = time.time()
+                self.query(coordinator)
+                self.assertEqual(len(nodes["down"].calls), 2)
+
+    def test_everyNodeFailed(self):
+        coordinator = ALGOcluster.Coordinator(
+            {"a": FakeNode(self.distances, error=TimeoutError("timed out"))}
+        )
+        with self.assertRaises(ALGOnode.NodeError):
+            self.query(coordinator)
+        with self.assertRaises(ALGOnode.NodeError):
+            self.query(coordinator)
+
+    def test_rebalance(self):
+        slow = FakeNode(self.distances, delay=10)
+        nodes = {"slow": slow, "fast": FakeNode(self.distances)}
+        coordinator = ALGOcluster.Coordinator(nodes)
+        coordinator.throughput = {"slow": 1000.0, "fast": 1000.0}
+
+        try:
+            with mock.patch.object(ALGOcluster, "slowGrace", 0.05):
+                result = self.query(coordinator)
+            pd.testing.assert_frame_equal(result, self.expected)
+
+            # The slow node's files were scanned by the fast one as well
+            self.assertEqual(slow.calls, [(0, 10)])
+            self.assertIn((0, 10), nodes["fast"].calls)
+
+            # Still scanning, so the next query leaves it out
+            self.assertEqual(coordinator.scanning(), {"slow"})
+            pd.testing.assert_frame_equal(self.query(coordinator), self.expected)
+            self.assertEqual(len(slow.calls), 1)
+        finally:
+            slow.release.set()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from Algo import ALGOcorpus
+from Algo import ALGOscan
+from tests.test_ALGOscan import syntheticTicker
+
+
+def syntheticTickers(days, seed=0):
+    # Tickers of the FRD500 layout, one per entry of days
+    return {
+        f"T{k}": syntheticTicker(count, seed=seed + k) for k, count in enumerate(days)
+    }
+
+
+class AppendCorpusTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.csvPath = os.path.join(self.path, "csv")
+        os.makedirs(self.csvPath)
+        self.tickers = syntheticTickers((6, 8))
+        for name, bars in self.tickers.items():
+            bars.iloc[:-400].to_csv(
+                os.path.join(self.csvPath, name + ".csv"), index=False
+            )
+        self.corpus = ALGOcorpus.buildIndex(ALGOcorpus.buildCorpus(self.csvPath))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def append(self, corpus):
+        # The new bars, overlapping the stored ones and repeated out of order
+        bars = {}
+        for name, tickerBars in self.tickers.items():
+            new = tickerBars.iloc[-450:-350]
+            bars[name] = pd.concat([new, new.iloc[::-1].iloc[:30]])
+        return ALGOcorpus.appendCorpus(corpus, bars)
+
+    def assertSameWindows(self, corpus):
+        # Window stats from the appended sums equal those of a fresh index
+        freshPath = os.path.join(self.path, "fresh")
+        shutil.copytree(corpus.binPath, freshPath)
+        fresh = ALGOcorpus.buildIndex(ALGOcorpus.Corpus(freshPath))
+
+        for fileId, (name, bars) in enumerate(self.tickers.items()):
+            expected = bars.iloc[:-350]
+            self.assertEqual(corpus.tickers[fileId]["rows"], len(expected))
+            np.testing.assert_array_equal(
+                corpus.column(fileId, "close"),
+                expected["close"].to_numpy(dtype=np.float32),
+            )
+
+            prefixes = corpus.prefixes(fileId)
+            freshPrefixes = fresh.prefixes(fileId)
+            self.assertIsNotNone(prefixes)
+            starts = np.arange(len(expected) - 390)
+            for column, prefix, freshPrefix in zip(
+                ("close", "volume"), prefixes, freshPrefixes
+            ):
+                values = corpus.column(fileId, column)
+                for result, reference in zip(
+                    ALGOscan.rollingStats(values, starts, 390, prefix),
+                    ALGOscan.rollingStats(values, starts, 390, freshPrefix),
+                ):
+                    np.testing.assert_allclose(result, reference, rtol=1e-9)
+
+    def test_appendContinuesPrefixSums(self):
+        corpus = self.append(self.corpus)
+        self.assertFalse(corpus.indexIsStale())
+        self.assertSameWindows(corpus)
+
+    def test_appendWithoutCentres(self):
+        # An index written before centres were stored
+        indexPath = os.path.join(self.corpus.binPath, ALGOcorpus.indexName)
+        with open(indexPath) as f:
+            index = json.load(f)
+        del index["centres"]
+        ALGOcorpus.writeJson(self.corpus.binPath, ALGOcorpus.indexName, index)
+
+        corpus = self.append(ALGOcorpus.Corpus(self.corpus.binPath))
+        self.assertFalse(corpus.indexIsStale())
+        self.assertSameWindows(corpus)
+
+
+if __name__ == "__main__":
+    unittest.main()
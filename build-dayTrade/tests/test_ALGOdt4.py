@@ -0,0 +1,188 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+from Algo import ALGOcorpus
+from Algo import ALGOdt4
+from Algo import ALGOpool
+from Algo import ALGOscan
+from Algo import ALGOkernel
+from tests.test_ALGOscan import syntheticTicker
+
+
+def tickerDataZScores(tickerCache):
+    # A query as ALGOqueryProcessor2 builds it, datetime then z-scores
+    close = tickerCache["close"].to_numpy(dtype=np.float64)
+    volume = tickerCache["volume"].to_numpy(dtype=np.float64)
+    query = np.column_stack(
+        [
+            tickerCache["datetime"].to_numpy().astype(object),
+            4 * (close - close.mean()) / close.std(),
+            (volume - volume.mean()) / volume.std(),
+        ]
+    )
+    query[:, 0] = [pd.Timestamp(x) for x in query[:, 0]]
+    return query
+
+
+def runScan(tickerDataPath, queries, **settings):
+    """
+    Scans the corpus for several queries in one scanFiles call, in this
+    process instead of the pool.
+
+    Args:
+        tickerDataPath (str): Directory of the CSV files, the binary corpus
+            is scanned when one was built from them.
+        queries (list): Queries as Algo.startBatch takes them.
+        settings: pruning, precision and compiled, see Algo.
+
+    Returns:
+        list: TopK.result() of every query.
+    """
+    with mock.patch.object(ALGOdt4, "tickerDataPath", tickerDataPath):
+        algo = ALGOdt4.Algo(None, None, None, None, **settings)
+    files = algo.listFiles()
+
+    scanQueries = []
+    for query in queries:
+        query = algo.querySettings(query)
+        scanQueries.append(
+            dict(
+                algo.queryTask(query, None),
+                vector=query["tickerDataZScores"][:, [1, 2]].astype(np.float64),
+                topResults=ALGOscan.TopK(query["resultSize"]),
+                pruneStats=ALGOscan.newPruneStats(),
+            )
+        )
+
+    task = algo.task(range(len(files)), files, [], None, None, 0)
+    # The columns are read as a worker without a shared corpus reads them
+    workerState = {"shared": None, "columns": {}, "corpus": algo.corpus}
+    with mock.patch.dict(ALGOpool.workerState, workerState):
+        ALGOdt4.scanFiles(task, algo.corpus, scanQueries, [0, 0])
+    return [query["topResults"].result() for query in scanQueries]
+
+
+class ScanFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def writeTickers(self, count, offset=0.0):
+        for k in range(count):
+            tickerCache = syntheticTicker(10, seed=k)
+            tickerCache["close"] += offset
+            tickerCache.to_csv(os.path.join(self.path, f"T{k}.csv"), index=False)
+
+    def assertSameResults(self, results, expected):
+        for result, reference in zip(results, expected):
+            for values, referenceValues in zip(result, reference):
+                np.testing.assert_array_equal(values, referenceValues)
+
+    def test_scanPathsMatchExhaustive(self):
+        # Large prices leave float32 little room, see ALGOscan.fusedTopK
+        for offset in (0.0, 50000.0):
+            self.writeTickers(4, offset)
+            query = {
+                "tickerDataZScores": tickerDataZScores(
+                    syntheticTicker(3, seed=9).iloc[100:490]
+                ),
+                "predictionLen": 78,
+                "dataSize": 4,
+                "resultSize": 20,
+            }
+            expected = runScan(self.path, [query], pruning=False)
+            for precision in ("float32", "float64"):
+                for compiled in (False, True):
+                    with self.subTest(
+                        offset=offset, precision=precision, compiled=compiled
+                    ):
+                        results = runScan(
+                            self.path,
+                            [query],
+                            precision=precision,
+                            compiled=compiled,
+                        )
+                        self.assertSameResults(results, expected)
+
+    def test_batchMatchesSeparateScans(self):
+        # Queries of different lengths, anchors, sizes and result counts
+        self.writeTickers(4)
+        source = syntheticTicker(8, seed=9)
+        queries = [
+            {
+                "tickerDataZScores": tickerDataZScores(
+                    source.iloc[start : start + windowLen]
+                ),
+                "predictionLen": windowLen // 5,
+                "dataSize": dataSize,
+                "resultSize": resultSize,
+            }
+            for start, windowLen, dataSize, resultSize in (
+                (100, 390, 4, 20),
+                (1000, 390, 2, 5),
+                (517, 1950, 4, 10),
+                (100, 390, 3, 100),
+            )
+        ]
+        for pruning in (False, True):
+            with self.subTest(pruning=pruning):
+                results = runScan(self.path, queries, pruning=pruning)
+                for query, result in zip(queries, results):
+                    (expected,) = runScan(self.path, [query], pruning=pruning)
+                    self.assertSameResults([result], [expected])
+
+    def test_staleSourceScansCsv(self):
+        self.writeTickers(3)
+        binPath = ALGOcorpus.corpusPath(self.path)
+        self.addCleanup(shutil.rmtree, binPath, True)
+        ALGOcorpus.buildIndex(ALGOcorpus.buildCorpus(self.path))
+        with mock.patch.object(ALGOdt4, "tickerDataPath", self.path):
+            self.assertIsNotNone(ALGOdt4.Algo(None, None, None, None).corpus)
+
+        # A ticker edited after the build, only its CSV has the new bars
+        syntheticTicker(10, seed=7).to_csv(
+            os.path.join(self.path, "T1.csv"), index=False
+        )
+        with mock.patch.object(ALGOdt4, "tickerDataPath", self.path):
+            with self.assertLogs(level="WARNING"):
+                self.assertIsNone(ALGOdt4.Algo(None, None, None, None).corpus)
+
+        query = {
+            "tickerDataZScores": tickerDataZScores(
+                syntheticTicker(3, seed=9).iloc[100:490]
+            ),
+            "predictionLen": 78,
+            "dataSize": 3,
+            "resultSize": 20,
+        }
+        results = runScan(self.path, [query])
+        shutil.rmtree(binPath)
+        self.assertSameResults(results, runScan(self.path, [query]))
+
+    @unittest.skipUnless(ALGOkernel.available, "numba is not installed")
+    def test_compiledKernelIsUsed(self):
+        self.writeTickers(2)
+        query = {
+            "tickerDataZScores": tickerDataZScores(
+                syntheticTicker(3, seed=9).iloc[100:490]
+            ),
+            "predictionLen": 78,
+            "dataSize": 2,
+            "resultSize": 20,
+        }
+        with mock.patch.object(
+            ALGOkernel, "kernelTopK", wraps=ALGOkernel.kernelTopK
+        ) as kernelTopK:
+            runScan(self.path, [query], compiled=True)
+        self.assertTrue(kernelTopK.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+
+from Algo import ALGOcorpus
+from Algo import ALGOincremental
+from Algo import ALGOpool
+from tests.test_ALGOcorpus import syntheticTickers
+from tests.test_ALGOdt4 import runScan, tickerDataZScores
+from tests.test_ALGOscan import syntheticTicker
+
+# Sessions of every ticker and the last ones appended after the build
+sessions = 30
+appendedSessions = 6
+
+
+class RefreshTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.path = tempfile.mkdtemp()
+        cls.csvPath = os.path.join(cls.path, "csv")
+        os.makedirs(cls.csvPath)
+
+        tickers = syntheticTickers((sessions,) * 3)
+        # Flat closes in one ticker and flat volumes across the appended bars
+        # in another, their sums are only flat within rounding
+        tickers["T1"].loc[5 * 390 : 12 * 390, "close"] = 100.0
+        tickers["T2"].loc[21 * 390 : 28 * 390, "volume"] = 5000.0
+
+        appended = -appendedSessions * 390
+        for name, bars in tickers.items():
+            bars.iloc[:appended].to_csv(
+                os.path.join(cls.csvPath, name + ".csv"), index=False
+            )
+        corpus = ALGOcorpus.buildIndex(ALGOcorpus.buildCorpus(cls.csvPath))
+
+        # Appended bars keep the centres of the build, the mean of the whole
+        # column has moved away from them
+        cls.corpus = ALGOcorpus.appendCorpus(
+            corpus, {name: bars.iloc[appended:] for name, bars in tickers.items()}
+        )
+
+        # The hold loop's query a few minutes later, a session later and with
+        # its last bar revised
+        source = syntheticTicker(12, seed=9)
+        revised = source.iloc[495 : 495 + 1950].copy()
+        revised.iloc[-1, revised.columns.get_loc("close")] += 0.05
+        cls.windows = [
+            source.iloc[100 : 100 + 1950],
+            source.iloc[105 : 105 + 1950],
+            source.iloc[495 : 495 + 1950],
+            revised,
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+
+    def query(self, window, resultSize):
+        return {
+            "tickerDataZScores": tickerDataZScores(window),
+            "predictionLen": 390,
+            "dataSize": 3,
+            "resultSize": resultSize,
+        }
+
+    def assertSameResult(self, result, expected):
+        for values, referenceValues in zip(result, expected):
+            np.testing.assert_array_equal(values, referenceValues)
+
+    def assertRefreshMatchesRescan(self, resultSize, pool=None):
+        matcher = ALGOincremental.IncrementalMatcher()
+        useIndex = not self.corpus.indexIsStale()
+        for position, window in enumerate(self.windows):
+            query = self.query(window, resultSize)
+            result = matcher.match(self.corpus, useIndex, query, pool)
+            self.assertEqual(matcher.rebuilds, 1)
+            self.assertEqual(matcher.refreshes, position)
+
+            (expected,) = runScan(self.csvPath, [query], pruning=False)
+            self.assertSameResult(result, expected)
+
+    def test_refreshMatchesRescan(self):
+        # A slide by a whole session touches 40% of a 5 session window
+        with mock.patch.object(ALGOincremental, "maxChanged", 0.5):
+            for resultSize in (1, 10, 1000):
+                with self.subTest(resultSize=resultSize):
+                    self.assertRefreshMatchesRescan(resultSize)
+
+    def test_rebuildOnPool(self):
+        with mock.patch.object(ALGOincremental, "maxChanged", 0.5):
+            with ALGOpool.ALGOpool(self.csvPath, processes=2) as pool:
+                self.assertRefreshMatchesRescan(10, pool)
+
+    def test_largeSlideRebuilds(self):
+        matcher = ALGOincremental.IncrementalMatcher()
+        useIndex = not self.corpus.indexIsStale()
+        source = syntheticTicker(12, seed=9)
+        for start in (100, 1100):
+            query = self.query(source.iloc[start : start + 1950], 10)
+            result = matcher.match(self.corpus, useIndex, query)
+
+            (expected,) = runScan(self.csvPath, [query], pruning=False)
+            self.assertSameResult(result, expected)
+        self.assertEqual(matcher.rebuilds, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import numpy as np
+
+from Algo import ALGOscan
+from Algo import ALGOkernel
+
+
+def randomFiles(count, rows, seed=0):
+    # Close and volume of random ticker files
+    rng = np.random.default_rng(seed)
+    return [
+        (
+            100 + np.cumsum(rng.normal(0, 0.1, rows)),
+            rng.integers(1000, 100000, rows).astype(float),
+        )
+        for _ in range(count)
+    ]
+
+
+def zScores(close, volume):
+    # Close and volume z-scores of a query, like ALGOdt4.Algo.startBatch
+    return np.column_stack(
+        [
+            4 * (close - close.mean()) / close.std(),
+            (volume - volume.mean()) / volume.std(),
+        ]
+    )
+
+
+class KernelTopKTest(unittest.TestCase):
+    def scan(self, topK, files, query, k, prefixes):
+        # Runs one top-k scan over every file, like ALGOdt4.scanTask
+        topResults = ALGOscan.TopK(k)
+        pruneStats = ALGOscan.newPruneStats()
+        for fileId, (close, volume) in enumerate(files):
+            starts = np.arange(0, len(close) - len(query), 7, dtype=np.int64)
+            filePrefixes = None
+            if prefixes:
+                filePrefixes = ALGOscan.prefixSums(close), ALGOscan.prefixSums(volume)
+            topK(
+                close,
+                volume,
+                starts,
+                query,
+                topResults,
+                fileId,
+                pruneStats,
+                filePrefixes,
+            )
+        return topResults.result()
+
+    def assertSameTopK(self, files, query):
+        for prefixes in (False, True):
+            for k in (1, 5, 40):
+                with self.subTest(prefixes=prefixes, k=k):
+                    expected = self.scan(ALGOscan.prunedTopK, files, query, k, prefixes)
+                    result = self.scan(ALGOkernel.kernelTopK, files, query, k, prefixes)
+
+                    np.testing.assert_array_equal(result[1], expected[1])
+                    np.testing.assert_array_equal(result[2], expected[2])
+                    np.testing.assert_allclose(result[0], expected[0], rtol=1e-12)
+
+    @unittest.skipUnless(ALGOkernel.available, "numba is not installed")
+    def test_compiledKernelMatchesPrunedTopK(self):
+        self.assertIsNot(ALGOkernel.compiledScan, ALGOkernel.abandonScan)
+        ALGOkernel.warmUp()
+
+        files = randomFiles(4, 6000)
+        close, volume = files[2]
+        query = zScores(close[1000:1390], volume[1000:1390])
+        self.assertSameTopK(files, query)
+
+        # float32 columns like the binary corpus
+        files = [
+            (close.astype(np.float32), volume.astype(np.float32))
+            for close, volume in files
+        ]
+        self.assertSameTopK(files, query)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import os
+import queue
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+from Algo import ALGOdt3
+from Algo.AQP import ALGOnode
+from tests.test_ALGOscan import syntheticTicker
+
+
+def serveNode(address, tickerDataPath):
+    # Body of the node process, stops cleanly on SIGTERM
+    ALGOdt3.tickerDataPath = tickerDataPath
+    node = ALGOnode.NodeServer(address, processes=1)
+    signal.signal(
+        signal.SIGTERM, lambda *args: threading.Thread(target=node.shutdown).start()
+    )
+    node.serveForever()
+
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def writeTickers(path, count):
+    # CSV tickers with the Close column ALGOdt3 reads
+    for k in range(count):
+        syntheticTicker(3, seed=k).rename(columns=str.capitalize).to_csv(
+            os.path.join(path, f"T{k}.csv"), index=False
+        )
+
+
+class NodeTest:
+    # Runs against a node in a child process, see TcpNodeTest and UnixNodeTest
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.tickerDataPath = os.path.join(self.path, "tickers")
+        os.makedirs(self.tickerDataPath)
+        writeTickers(self.tickerDataPath, 4)
+        self.node = None
+        self.startNode()
+
+        close = syntheticTicker(3, seed=9)["close"].iloc[-100:]
+        self.query = (close / close.iloc[-1]).reset_index(drop=True)
+
+    def tearDown(self):
+        self.stopNode()
+        shutil.rmtree(self.path)
+
+    def startNode(self):
+        self.node = mp.Process(
+            target=serveNode, args=(self.address, self.tickerDataPath)
+        )
+        self.node.start()
+
+        # The node answers once its pool is up
+        client = ALGOnode.NodeClient(self.address, timeout=5)
+        deadline = time.time() + 30
+        while True:
+            try:
+                client.ping()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+            finally:
+                client.close()
+
+    def stopNode(self):
+        if self.node is not None:
+            self.node.terminate()
+            self.node.join(10)
+            self.node = None
+
+    def test_roundTrip(self):
+        client = ALGOnode.NodeClient(self.address, timeout=10)
+        try:
+            self.assertGreater(client.ping(), 0)
+            self.assertEqual(client.request(ALGOnode.pingMessage)[0], 1)
+        finally:
+            client.close()
+
+    def test_queryMatchesLocalScan(self):
+        progress = []
+        client = ALGOnode.NodeClient(self.address, timeout=60)
+        try:
+            matches, predictions = client.query(
+                1,
+                3,
+                20,
+                self.query,
+                resultSize=10,
+                progress=lambda *p: progress.append(p),
+            )
+        finally:
+            client.close()
+
+        with mock.patch.object(ALGOdt3, "tickerDataPath", self.tickerDataPath):
+            expected = ALGOdt3.Algo(
+                3, 20, self.query, queue.Queue(), firstFile=1, resultSize=10
+            ).findMatches()
+
+        self.assertEqual(matches.shape, (10, 3))
+        np.testing.assert_array_equal(matches, expected[0])
+        np.testing.assert_array_equal(predictions, expected[1])
+        self.assertEqual(progress[-1][1:], (3, 3))
+
+    def test_errorFrame(self):
+        client = ALGOnode.NodeClient(self.address, timeout=10)
+        try:
+            answerType, answer = client.request(99)
+            self.assertEqual(answerType, ALGOnode.errorMessage)
+            self.assertIn(b"Unknown message type", bytes(answer))
+
+            # A malformed query is answered with an error, the connection stays
+            answerType, _ = client.request(ALGOnode.queryMessage, b"short")
+            self.assertEqual(answerType, ALGOnode.errorMessage)
+            client.ping()
+        finally:
+            client.close()
+
+        # An error answer to a query raises NodeError, here a payload that
+        # is not a whole number of float64 values
+        encodeQuery = ALGOnode.encodeQuery
+        pool = ALGOnode.NodePool(self.address, timeout=10)
+        with mock.patch.object(
+            ALGOnode, "encodeQuery", lambda *args: encodeQuery(*args) + b"x"
+        ):
+            with self.assertRaises(ALGOnode.NodeError):
+                pool.query(0, 1, 20, self.query, resultSize=10)
+        pool.close()
+
+    def test_reconnectAfterRestart(self):
+        client = ALGOnode.NodeClient(self.address, timeout=10)
+        try:
+            client.ping()
+            self.stopNode()
+            self.startNode()
+
+            # The closed connection is opened again and the ping sent once more
+            client.ping()
+            self.assertIsNotNone(client.sock)
+        finally:
+            client.close()
+
+
+class TcpNodeTest(NodeTest, unittest.TestCase):
+    def setUp(self):
+        self.address = ("127.0.0.1", freePort())
+        super().setUp()
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix sockets are not available")
+class UnixNodeTest(NodeTest, unittest.TestCase):
+    def setUp(self):
+        self.address = os.path.join(
+            tempfile.gettempdir(), f"algoNode{os.getpid()}.sock"
+        )
+        super().setUp()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+
+from Algo import ALGOpool
+from Algo import ALGOscan
+
+
+class WorkerTopKTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(ALGOpool.workerState, {"topK": {}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def topK(self, batchId, queryId):
+        return ALGOpool.workerTopK(batchId, queryId, lambda: ALGOscan.TopK(10))
+
+    def test_watchlistBatchKeepsEveryQuery(self):
+        # Chunk after chunk of one 60 query batch
+        first = [self.topK("batch", query) for query in range(60)]
+        for _ in range(3):
+            for query in range(60):
+                self.assertIs(self.topK("batch", query), first[query])
+
+    def test_oldestBatchIsEvicted(self):
+        first = self.topK("batch0", 0)
+        for batch in range(1, ALGOpool.maxWorkerBatches):
+            self.topK(f"batch{batch}", 0)
+        self.assertIs(self.topK("batch0", 0), first)
+
+        self.topK(f"batch{ALGOpool.maxWorkerBatches}", 0)
+        self.assertIsNot(self.topK("batch0", 0), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
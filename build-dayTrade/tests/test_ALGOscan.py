@@ -0,0 +1,356 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from Algo import ALGOscan
+
+
+def scanFileLoop(tickerCache, tickerDataZScores, predictionLen, filePath):
+    """
+    Reference per-row scan kept to check scanFile against.
+
+    Args:
+        tickerCache (DataFrame): The ticker file with datetime, close and volume.
+        tickerDataZScores (NumPy array): Time, close and volume z-scores of the query.
+        predictionLen (int): The number of rows required after each window.
+        filePath (str): Path reported in the result tuples.
+
+    Returns:
+        list: (distance, filePath, i) for every candidate window.
+    """
+    resultList = []
+    tickerDataLen = len(tickerDataZScores)
+    tickerDataTime = tickerDataZScores[-1, 0]
+    tickerCacheTimes = tickerCache["datetime"].dt.time.to_numpy()
+
+    for i in range(len(tickerCache) - tickerDataLen - int(predictionLen)):
+        if tickerCacheTimes[i + tickerDataLen - 1] == tickerDataTime.time():
+            tickerCacheSegmentClose = tickerCache.iloc[
+                i : i + tickerDataLen, 1
+            ].to_numpy()
+            tickerCacheSegmentVolume = tickerCache.iloc[
+                i : i + tickerDataLen, 2
+            ].to_numpy()
+
+            closeZScores = (
+                4 * (tickerCacheSegmentClose - np.mean(tickerCacheSegmentClose))
+            ) / np.std(tickerCacheSegmentClose)
+            volumeZScores = (
+                tickerCacheSegmentVolume - np.mean(tickerCacheSegmentVolume)
+            ) / np.std(tickerCacheSegmentVolume)
+
+            segmentZScores = np.column_stack([closeZScores, volumeZScores])
+
+            distance = np.linalg.norm(tickerDataZScores[:, [1, 2]] - segmentZScores)
+            resultList.append((distance, filePath, i))
+
+    return resultList
+
+
+def syntheticTicker(days, seed=0):
+    """
+    Builds a random 1-minute ticker file covering the given number of sessions.
+
+    Args:
+        days (int): Number of trading sessions of 390 minutes.
+        seed (int): Seed for the random walk.
+
+    Returns:
+        DataFrame: datetime, close and volume columns like the FRD500 files.
+    """
+    rng = np.random.default_rng(seed)
+    sessions = pd.bdate_range("2023-01-02", periods=days)
+    datetimes = np.concatenate(
+        [
+            pd.date_range(session + pd.Timedelta("9:30:00"), periods=390, freq="min")
+            for session in sessions
+        ]
+    )
+    close = 100 + np.cumsum(rng.normal(0, 0.1, len(datetimes)))
+    volume = rng.integers(1000, 100000, len(datetimes)).astype(float)
+    return pd.DataFrame({"datetime": datetimes, "close": close, "volume": volume})
+
+
+def zScoreQuery(tickerCache):
+    # Close and volume z-scores of a query, without its datetime column
+    close = tickerCache["close"].to_numpy(dtype=np.float64)
+    volume = tickerCache["volume"].to_numpy(dtype=np.float64)
+    return np.column_stack(
+        [
+            4 * (close - close.mean()) / close.std(),
+            (volume - volume.mean()) / volume.std(),
+        ]
+    )
+
+
+def scanFiles(files, windowLen):
+    """
+    Close, volume and candidate starts of synthetic files with ties and flat
+    windows, for comparing the top-k paths.
+
+    Args:
+        files (list): syntheticTicker DataFrames.
+        windowLen (int): The length of the query.
+
+    Returns:
+        list: (close, volume, starts) of every file, the first file twice so
+        every window of it is tied, and flat close and volume windows in the
+        last file.
+    """
+    columns = [
+        (
+            np.array(tickerCache["close"], dtype=np.float64),
+            np.array(tickerCache["volume"], dtype=np.float64),
+        )
+        for tickerCache in files
+    ]
+    columns.insert(1, tuple(column.copy() for column in columns[0]))
+
+    close, volume = columns[-1]
+    close[1000 : 1000 + 2 * windowLen] = close[1000]
+    volume[4000 : 4000 + 2 * windowLen] = 5000.0
+
+    return [
+        (close, volume, np.arange(0, len(close) - windowLen - windowLen // 5, 3))
+        for close, volume in columns
+    ]
+
+
+def exhaustiveTopK(files, query, k, prefixes=False):
+    # Every candidate scored with zScoreDistances, the reference of the pruned paths
+    topResults = ALGOscan.TopK(k)
+    for fileId, (close, volume, starts) in enumerate(files):
+        filePrefixes = None
+        if prefixes:
+            filePrefixes = ALGOscan.prefixSums(close), ALGOscan.prefixSums(volume)
+        topResults.push(
+            ALGOscan.zScoreDistances(close, volume, starts, query, filePrefixes),
+            fileId,
+            starts,
+        )
+    return topResults.result()
+
+
+def scanTopK(topK, files, query, k, prefixes=False, pruneStats=None):
+    # Runs one of the pruned top-k paths over every file, like ALGOdt4.scanFiles
+    topResults = ALGOscan.TopK(k)
+    if pruneStats is None:
+        pruneStats = ALGOscan.newPruneStats()
+    for fileId, (close, volume, starts) in enumerate(files):
+        filePrefixes = None
+        if prefixes:
+            filePrefixes = ALGOscan.prefixSums(close), ALGOscan.prefixSums(volume)
+        topK(close, volume, starts, query, topResults, fileId, pruneStats, filePrefixes)
+    return topResults.result()
+
+
+class ScanFileTest(unittest.TestCase):
+    def test_scanFileMatchesLoop(self):
+        # Parity check of the batched scan against the per-row reference
+        for windowLen in (390, 1950):
+            with self.subTest(windowLen=windowLen):
+                tickerCache = syntheticTicker(30, seed=windowLen)
+                query = syntheticTicker(6, seed=1).iloc[-windowLen:]
+                query = np.column_stack(
+                    [
+                        query["datetime"].to_numpy().astype(object),
+                        (4 * (query["close"] - query["close"].mean()))
+                        / query["close"].std(ddof=0),
+                        (query["volume"] - query["volume"].mean())
+                        / query["volume"].std(ddof=0),
+                    ]
+                )
+                query[:, 0] = [pd.Timestamp(x) for x in query[:, 0]]
+
+                expected = scanFileLoop(
+                    tickerCache, query, windowLen // 5, "ticker.csv"
+                )
+                distances, starts = ALGOscan.scanFile(
+                    tickerCache["close"].to_numpy(),
+                    tickerCache["volume"].to_numpy(),
+                    ALGOscan.timeOfDay(tickerCache["datetime"]),
+                    query[:, [1, 2]].astype(np.float64),
+                    ALGOscan.anchorTimeOfDay(query[-1, 0]),
+                    windowLen // 5,
+                )
+
+                self.assertTrue(len(starts) > 0)
+                self.assertEqual([i for _, _, i in expected], starts.tolist())
+                np.testing.assert_allclose(
+                    [distance for distance, _, _ in expected], distances, rtol=1e-9
+                )
+
+
+class PrunedTopKTest(unittest.TestCase):
+    def test_matchesExhaustive(self):
+        for windowLen in (390, 1950):
+            files = scanFiles(
+                [syntheticTicker(12, seed=windowLen + k) for k in range(3)], windowLen
+            )
+            query = zScoreQuery(syntheticTicker(6, seed=1).iloc[-windowLen:])
+            for prefixes in (False, True):
+                for k in (1, 10, 100):
+                    with self.subTest(windowLen=windowLen, prefixes=prefixes, k=k):
+                        expected = exhaustiveTopK(files, query, k, prefixes)
+                        result = scanTopK(
+                            ALGOscan.prunedTopK, files, query, k, prefixes
+                        )
+                        for values, reference in zip(result, expected):
+                            np.testing.assert_array_equal(values, reference)
+
+                        # A window of the first file is followed by its tie
+                        _, fileIds, rows = result
+                        for i in np.flatnonzero(fileIds[:-1] == 0):
+                            self.assertEqual(fileIds[i + 1], 1)
+                            self.assertEqual(rows[i + 1], rows[i])
+
+    def test_flatWindowsMatchExhaustive(self):
+        # Every candidate kept, flat windows are dropped or ranked the same way
+        windowLen = 390
+        files = scanFiles([syntheticTicker(4, seed=3)], windowLen)
+        query = zScoreQuery(syntheticTicker(4, seed=3).iloc[1000 : 1000 + windowLen])
+        k = sum(len(starts) for _, _, starts in files)
+        for prefixes in (False, True):
+            with self.subTest(prefixes=prefixes):
+                expected = exhaustiveTopK(files, query, k, prefixes)
+                result = scanTopK(ALGOscan.prunedTopK, files, query, k, prefixes)
+                for values, reference in zip(result, expected):
+                    np.testing.assert_array_equal(values, reference)
+                self.assertFalse(np.isnan(result[0]).any())
+
+
+class FusedTopKTest(unittest.TestCase):
+    def test_matchesPrunedAndExhaustive(self):
+        # float32 columns like the binary corpus, the offset leaves the moves
+        # a few float32 steps wide so cancellation breaks a wrong bound
+        for offset in (0.0, 50000.0):
+            for windowLen in (390, 1950):
+                files = [
+                    (
+                        (close + offset).astype(np.float32),
+                        volume.astype(np.float32),
+                        starts,
+                    )
+                    for close, volume, starts in scanFiles(
+                        [syntheticTicker(12, seed=windowLen + k) for k in range(3)],
+                        windowLen,
+                    )
+                ]
+                query = zScoreQuery(syntheticTicker(6, seed=1).iloc[-windowLen:])
+                for prefixes in (False, True):
+                    for k in (1, 10, 100):
+                        with self.subTest(
+                            offset=offset, windowLen=windowLen, prefixes=prefixes, k=k
+                        ):
+                            expected = exhaustiveTopK(files, query, k, prefixes)
+                            pruned = scanTopK(
+                                ALGOscan.prunedTopK, files, query, k, prefixes
+                            )
+                            pruneStats = ALGOscan.newPruneStats()
+                            result = scanTopK(
+                                ALGOscan.fusedTopK,
+                                files,
+                                query,
+                                k,
+                                prefixes,
+                                pruneStats,
+                            )
+                            self.assertGreater(pruneStats["fused"], 0)
+                            for values, prunedValues, reference in zip(
+                                result, pruned, expected
+                            ):
+                                np.testing.assert_array_equal(values, reference)
+                                np.testing.assert_array_equal(prunedValues, reference)
+
+
+def ratioFile(offset, windowLen, query):
+    """
+    Close column of a synthetic file at a price offset, with two identical
+    exact matches of the query planted in it.
+    """
+    close = syntheticTicker(20, seed=windowLen).to_numpy()[:, 1].astype(np.float64)
+    close += offset
+    for start in (3000, 5000):
+        close[start : start + windowLen] = query * close[3000 + windowLen - 1]
+    return close
+
+
+def directRatioDistances(close, starts, query):
+    # The ALGOdt3 distance, one window at a time
+    windowLen = len(query)
+    return np.array(
+        [
+            np.linalg.norm(
+                query - close[start : start + windowLen] / close[start + windowLen - 1]
+            )
+            for start in starts
+        ]
+    )
+
+
+class RatioProfileTest(unittest.TestCase):
+    def cases(self):
+        # Large prices leave the profile's cancellation the fewest digits
+        for offset in (0.0, 50000.0):
+            for windowLen in (390, 1950):
+                query = syntheticTicker(6, seed=1).to_numpy()[-windowLen:, 1]
+                query = (query + offset).astype(np.float64)
+                query /= query[-1]
+                yield offset, windowLen, query, ratioFile(offset, windowLen, query)
+
+    def assertSameTopK(self, result, expected):
+        distances, fileIds, rows = result
+        np.testing.assert_array_equal(rows, expected[2])
+        np.testing.assert_array_equal(fileIds, expected[1])
+        np.testing.assert_allclose(distances, expected[0], rtol=1e-9, atol=1e-12)
+
+    def test_profileWithinTolerance(self):
+        for offset, windowLen, query, close in self.cases():
+            with self.subTest(offset=offset, windowLen=windowLen):
+                profile = ALGOscan.ratioProfile(close, query)
+                direct = directRatioDistances(
+                    close, np.arange(len(close) - windowLen + 1), query
+                )
+                slack = np.sqrt(ALGOscan.profileTolerance) * (
+                    2 * np.linalg.norm(query) + direct
+                )
+                self.assertTrue(np.all(np.abs(profile - direct) <= slack))
+
+    def test_profileTopKMatchesDirect(self):
+        for offset, windowLen, query, close in self.cases():
+            profile = ALGOscan.ratioProfile(close, query)
+            for rows in (
+                np.arange(len(profile)),
+                ALGOscan.skipFilter(profile, windowLen),
+            ):
+                for k in (1, 10, 100):
+                    with self.subTest(
+                        offset=offset, windowLen=windowLen, rows=len(rows), k=k
+                    ):
+                        expected = ALGOscan.TopK(k)
+                        expected.push(directRatioDistances(close, rows, query), 0, rows)
+                        topResults = ALGOscan.TopK(k)
+                        ALGOscan.profileTopK(close, profile, rows, query, topResults, 0)
+                        self.assertSameTopK(topResults.result(), expected.result())
+
+    def test_ratioTopKMatchesDirect(self):
+        for offset, windowLen, query, close in self.cases():
+            stop = len(close) - windowLen - windowLen // 5
+            direct = directRatioDistances(close, np.arange(stop), query)
+            for prefix in (None, ALGOscan.prefixSums(close)):
+                for k in (1, 10, 100):
+                    with self.subTest(
+                        offset=offset,
+                        windowLen=windowLen,
+                        prefix=prefix is not None,
+                        k=k,
+                    ):
+                        expected = ALGOscan.TopK(k)
+                        expected.push(direct, 0, np.arange(stop))
+                        topResults = ALGOscan.TopK(k)
+                        ALGOscan.ratioTopK(close, stop, query, topResults, 0, prefix)
+                        self.assertSameTopK(topResults.result(), expected.result())
+
+
+if __name__ == "__main__":
+    unittest.main()